@@ -0,0 +1,449 @@
+"""Calcoli sui dati (budget, aggregati, indici) indipendenti da Streamlit."""
+import numpy as np
+import pandas as pd
+
+# Prefissi (prime 3 lettere) e numeri accettati per ogni mese
+_MESI_PREFISSO = {
+    'gen': 'Gen', 'feb': 'Feb', 'mar': 'Mar', 'apr': 'Apr', 'mag': 'Mag', 'giu': 'Giu',
+    'lug': 'Lug', 'ago': 'Ago', 'set': 'Set', 'ott': 'Ott', 'nov': 'Nov', 'dic': 'Dic',
+}
+_MESI_NUMERO = {
+    '1': 'Gen', '01': 'Gen', '2': 'Feb', '02': 'Feb', '3': 'Mar', '03': 'Mar',
+    '4': 'Apr', '04': 'Apr', '5': 'Mag', '05': 'Mag', '6': 'Giu', '06': 'Giu',
+    '7': 'Lug', '07': 'Lug', '8': 'Ago', '08': 'Ago', '9': 'Set', '09': 'Set',
+    '10': 'Ott', '11': 'Nov', '12': 'Dic',
+}
+
+
+# ==============================================================================
+# 1. REGISTRO TRANSAZIONI
+# ==============================================================================
+
+def prepara_registro(df_cloud):
+    """Tipi corretti (Data, Importo, Categoria) e colonne di lavoro Anno/MeseNum."""
+    df_cloud["Data"] = pd.to_datetime(df_cloud["Data"], errors='coerce')
+    df_cloud["Importo"] = pd.to_numeric(df_cloud["Importo"], errors='coerce').fillna(0)
+    
+    # Pulizia Categoria
+    if "Categoria" in df_cloud.columns:
+        df_cloud["Categoria"] = df_cloud["Categoria"].astype(str).str.strip()
+    
+    # --- FIX CRITICO: AGGIUNTA COLONNE GLOBALI PER EVITARE KEYERROR ---
+    if not df_cloud.empty and "Data" in df_cloud.columns:
+        df_cloud["Anno"] = df_cloud["Data"].dt.year
+        df_cloud["MeseNum"] = df_cloud["Data"].dt.month
+    else:
+        # Se il DB è vuoto, inizializza colonne vuote
+        df_cloud["Anno"] = 2026
+        df_cloud["MeseNum"] = 1
+    return df_cloud
+
+
+# ==============================================================================
+# 2. CUBO MENSILE (Anno, Mese, Categoria, Tipo)
+# ==============================================================================
+
+_CHIAVI_CUBO = ["Anno", "MeseNum", "Categoria", "Tipo"]
+
+
+class CuboMensile:
+    """
+    Totali del registro per (Anno, MeseNum, Categoria, Tipo). Qualsiasi periodo (mese,
+    trimestre, semestre, anno) si ottiene sommando poche celle invece di scorrere le transazioni.
+    """
+
+    def __init__(self, df_registro):
+        self._celle = self._aggrega(df_registro)
+
+    @staticmethod
+    def _aggrega(df):
+        if df.empty:
+            indice = pd.MultiIndex.from_arrays([[]] * len(_CHIAVI_CUBO), names=_CHIAVI_CUBO)
+            return pd.Series([], index=indice, dtype=float, name="Importo")
+        return df.groupby(_CHIAVI_CUBO)["Importo"].sum()
+
+    def aggiungi(self, df_nuove):
+        """Aggiornamento incrementale dopo un append al registro."""
+        self._celle = self._celle.add(self._aggrega(df_nuove), fill_value=0)
+
+    def __len__(self):
+        return len(self._celle)
+
+    def anni(self):
+        """Anni presenti, dal più recente."""
+        return sorted(self._celle.index.get_level_values("Anno").unique(), reverse=True)
+
+    def periodo(self, anno, mesi):
+        """Totali per (Categoria, Tipo) nei mesi indicati: colonne Categoria, Tipo, Reale."""
+        celle = self._celle
+        anni_idx = celle.index.get_level_values("Anno")
+        mesi_idx = celle.index.get_level_values("MeseNum")
+        sel = celle[(anni_idx == anno) & mesi_idx.isin(mesi)]
+        if sel.empty:
+            return pd.DataFrame(columns=["Categoria", "Tipo", "Reale"])
+        return sel.groupby(level=["Categoria", "Tipo"]).sum().reset_index().rename(columns={"Importo": "Reale"})
+
+
+# ==============================================================================
+# 3. INDICE SALDI (SOMME PREFISSE PER MESE)
+# ==============================================================================
+
+class IndiceSaldi:
+    """
+    Entrate operative (esclusa la categoria SALDO INIZIALE) e uscite per (Anno, Mese) con
+    somme cumulative dentro l'anno e tra gli anni: totali di periodo, saldi di apertura e
+    chiusura e riporto degli anni precedenti diventano lookup O(1).
+    """
+
+    def __init__(self, df_registro):
+        self._mensili = pd.DataFrame(columns=["Entrate", "Uscite"], dtype=float)
+        self.aggiungi(df_registro)
+
+    def aggiungi(self, df_nuove):
+        """Somma i movimenti nuovi ai mesi e ricalcola le cumulate (O(anni x 12))."""
+        df = df_nuove.dropna(subset=["Anno", "MeseNum"])
+        entrate = df["Importo"].where((df["Tipo"] == "Entrata") & (df["Categoria"] != "SALDO INIZIALE"), 0)
+        uscite = df["Importo"].where(df["Tipo"] == "Uscita", 0)
+        nuovi = pd.DataFrame({"Entrate": entrate, "Uscite": uscite}).groupby(
+            [df["Anno"].astype(int), df["MeseNum"].astype(int)]
+        ).sum()
+        self._mensili = self._mensili.add(nuovi, fill_value=0) if len(self._mensili) else nuovi
+        self._ricalcola()
+
+    def _ricalcola(self):
+        anni = sorted({a for a, _ in self._mensili.index}) or [0]
+        self._anni = np.array(anni)
+        self._pos = {a: i for i, a in enumerate(anni)}
+        # Colonna 0 = prima di gennaio: cum[i, m] = totale dei mesi 1..m
+        self._entrate = np.zeros((len(anni), 13))
+        self._uscite = np.zeros((len(anni), 13))
+        for (anno, mese), riga in self._mensili.iterrows():
+            self._entrate[self._pos[anno], mese] = riga["Entrate"]
+            self._uscite[self._pos[anno], mese] = riga["Uscite"]
+        self._entrate = self._entrate.cumsum(axis=1)
+        self._uscite = self._uscite.cumsum(axis=1)
+        # Riporto: netto cumulato di tutti gli anni precedenti
+        netto_annuo = self._entrate[:, 12] - self._uscite[:, 12]
+        self._riporto = np.concatenate([[0.0], netto_annuo.cumsum()])
+
+    def _cumulata(self, tabella, anno, mese):
+        i = self._pos.get(anno)
+        return 0.0 if i is None else float(tabella[i, mese])
+
+    def entrate(self, anno, mese_da=1, mese_a=12):
+        return self._cumulata(self._entrate, anno, mese_a) - self._cumulata(self._entrate, anno, mese_da - 1)
+
+    def uscite(self, anno, mese_da=1, mese_a=12):
+        return self._cumulata(self._uscite, anno, mese_a) - self._cumulata(self._uscite, anno, mese_da - 1)
+
+    def netto_prima_di(self, anno, mese):
+        """Entrate - uscite dell'anno nei mesi precedenti a `mese`."""
+        return self.entrate(anno, 1, mese - 1) - self.uscite(anno, 1, mese - 1)
+
+    def riporto(self, anno):
+        """Netto di tutti gli anni precedenti ad `anno` (chiusure riportate in avanti)."""
+        return float(self._riporto[np.searchsorted(self._anni, anno)])
+
+    def saldo_apertura(self, anno, mese, saldo_iniziale=0.0, con_riporto=False):
+        """Saldo a inizio `mese`: saldo iniziale (+ riporto anni precedenti) + netto dei mesi prima."""
+        base = saldo_iniziale + (self.riporto(anno) if con_riporto else 0.0)
+        return base + self.netto_prima_di(anno, mese)
+
+    def saldo_chiusura(self, anno, mese, saldo_iniziale=0.0, con_riporto=False):
+        """Saldo a fine `mese`."""
+        return self.saldo_apertura(anno, mese + 1, saldo_iniziale, con_riporto)
+
+    def cumulate(self):
+        """(anni, entrate cumulate, uscite cumulate): matrici anni x 13, colonna m = mesi 1..m."""
+        return self._anni, self._entrate, self._uscite
+
+
+# ==============================================================================
+# 4. KPI
+# ==============================================================================
+
+# Granularità del cruscotto KPI -> mesi per periodo
+GRANULARITA_KPI = {"Mensile": 1, "Trimestrale": 3, "Semestrale": 6, "Annuale": 12}
+
+
+def periodo_del_mese(granularita, mese):
+    """Numero del periodo (1 = primo) che contiene `mese` per la granularità data."""
+    return (mese - 1) // GRANULARITA_KPI[granularita] + 1
+
+
+def mesi_del_periodo(granularita, periodo):
+    passo = GRANULARITA_KPI[granularita]
+    return list(range((periodo - 1) * passo + 1, periodo * passo + 1))
+
+
+def saldo_iniziale_budget(df_budget):
+    """Saldo iniziale dell'anno: voce SALDO INIZIALE di Gennaio nel budget."""
+    if df_budget is None or df_budget.empty:
+        return 0.0
+    mask = (df_budget["Mese"] == "Gen") & (df_budget["Categoria"] == "SALDO INIZIALE")
+    return float(df_budget.loc[mask, "Importo"].sum())
+
+
+def _rapporto(num, den, scala=100.0):
+    """num / den * scala dove den > 0, altrimenti 0 (come le formule originali)."""
+    num, den = np.broadcast_arrays(np.asarray(num, dtype=float), np.asarray(den, dtype=float))
+    out = np.zeros(num.shape)
+    np.divide(num * scala, den, out=out, where=den > 0)
+    return out
+
+
+def tabella_kpi(df_registro, df_budget, target, indice=None):
+    """
+    Tutti i KPI del cruscotto per ogni anno x granularità x periodo in un solo passaggio
+    vettoriale. Una riga per (Anno, Granularita, Periodo) con MeseDa/MeseA, i totali di
+    periodo e d'anno e gli indici ROE, Growth, IER, IAT, IER Periodo, IER Giornaliero, IPP,
+    Burn Rate. I KPI annuali sono ripetuti su tutti i periodi dello stesso anno.
+    """
+    if indice is None:
+        indice = IndiceSaldi(df_registro)
+    anni, ent_cum, usc_cum = indice.cumulate()
+    saldo_ini = saldo_iniziale_budget(df_budget)
+
+    # Totali annuali (uno per anno)
+    ent_anno = ent_cum[:, 12]
+    usc_anno = usc_cum[:, 12]
+    utile_anno = ent_anno - usc_anno
+    saldo_fin = saldo_ini + utile_anno
+    risorse = saldo_ini + ent_anno
+    delta_target = target - saldo_ini
+
+    roe = _rapporto(saldo_fin - saldo_ini, risorse)
+    ier = _rapporto(utile_anno, ent_anno)
+    growth = _rapporto(saldo_fin - saldo_ini, saldo_ini)
+    iat = _rapporto(saldo_fin - saldo_ini, delta_target)
+    ier_giornaliero = _rapporto(saldo_fin, risorse)
+    ipp = _rapporto(saldo_fin - saldo_ini, delta_target, 1.0) * _rapporto(saldo_fin, risorse, 1.0) * 100
+
+    # Periodi di tutte le granularità: (granularità, periodo, mese_da, mese_a)
+    periodi = [
+        (nome, p, (p - 1) * passo + 1, p * passo)
+        for nome, passo in GRANULARITA_KPI.items()
+        for p in range(1, 12 // passo + 1)
+    ]
+    da = np.array([p[2] for p in periodi])
+    a = np.array([p[3] for p in periodi])
+
+    # Matrici anni x periodi dalle somme prefisse
+    ent_per = ent_cum[:, a] - ent_cum[:, da - 1]
+    usc_per = usc_cum[:, a] - usc_cum[:, da - 1]
+    giorni = 30 * (a - da + 1)
+
+    n_anni, n_per = ent_per.shape
+
+    def per_anno(v):
+        return np.repeat(v, n_per)
+
+    return pd.DataFrame({
+        "Anno": per_anno(anni),
+        "Granularita": np.tile([p[0] for p in periodi], n_anni),
+        "Periodo": np.tile([p[1] for p in periodi], n_anni),
+        "MeseDa": np.tile(da, n_anni),
+        "MeseA": np.tile(a, n_anni),
+        "Entrate Periodo": ent_per.ravel(),
+        "Uscite Periodo": usc_per.ravel(),
+        "Utile Periodo": (ent_per - usc_per).ravel(),
+        "Entrate Anno": per_anno(ent_anno),
+        "Uscite Anno": per_anno(usc_anno),
+        "Saldo Iniziale": saldo_ini,
+        "Saldo Finale": per_anno(saldo_fin),
+        "ROE": per_anno(roe),
+        "Growth": per_anno(growth),
+        "IER": per_anno(ier),
+        "IAT": per_anno(iat),
+        "IER Periodo": _rapporto(ent_per - usc_per, ent_per).ravel(),
+        "IER Giornaliero": per_anno(ier_giornaliero),
+        "IPP": per_anno(ipp),
+        "Burn Rate": (usc_per / giorni).ravel(),
+    })
+
+
+# ==============================================================================
+# 5. BUDGET
+# ==============================================================================
+
+def normalizza_mese(col):
+    """'gennaio', '1', '01', 'GEN' -> 'Gen'. Valori sconosciuti: capitalize()."""
+    v = col.astype(str).str.strip().str.lower()
+    return v.str[:3].map(_MESI_PREFISSO).fillna(v.map(_MESI_NUMERO)).fillna(v.str.capitalize())
+
+
+def normalizza_tipo(col):
+    """'uscite', 'spesa' -> 'Uscita'; 'entrate', 'ricavi' -> 'Entrata'. Altri: capitalize()."""
+    v = col.astype(str).str.strip().str.lower()
+    uscita = v.str.contains('usc', regex=False) | v.str.contains('spes', regex=False)
+    entrata = v.str.contains('ent', regex=False) | v.str.contains('ric', regex=False)
+    return pd.Series(
+        np.select([uscita, entrata], ['Uscita', 'Entrata'], default=v.str.capitalize()),
+        index=col.index,
+    )
+
+
+def pulisci_importo(col):
+    """Importi in formato italiano ('1.000,00 €', '100,50') -> float (non validi = 0)."""
+    s = col.astype(str).str.strip().str.replace('€', '', regex=False)
+    # Caso 1.000,00 -> togli punto; poi la virgola diventa punto decimale
+    migliaia = s.str.contains('.', regex=False) & s.str.contains(',', regex=False)
+    s = s.where(~migliaia, s.str.replace('.', '', regex=False))
+    s = s.str.replace(',', '.', regex=False)
+    return pd.to_numeric(s, errors='coerce').fillna(0)
+
+
+def _su_valori_unici(col, funzione):
+    """Applica la normalizzazione solo ai valori distinti e la propaga con una lookup."""
+    codici, unici = pd.factorize(col.astype(str))
+    valori = funzione(pd.Series(unici)).to_numpy()
+    return pd.Series(valori[codici], index=col.index)
+
+
+def normalizza_budget(df_bud):
+    """Rinomina le colonne di DB_BUDGET e normalizza mesi, tipi e importi (tutto vettoriale)."""
+    df_bud = df_bud.fillna(0)
+
+    # Rinomina colonne standard
+    if len(df_bud.columns) >= 4:
+        df_bud.columns = ["Mese", "Categoria", "Tipo", "Importo"]
+
+    # Pulizia base spazi
+    for col in ["Mese", "Categoria", "Tipo"]:
+        if col in df_bud.columns:
+            df_bud[col] = df_bud[col].astype(str).str.strip()
+
+    if "Mese" in df_bud.columns:
+        df_bud["Mese"] = _su_valori_unici(df_bud["Mese"], normalizza_mese)
+    if "Tipo" in df_bud.columns:
+        df_bud["Tipo"] = _su_valori_unici(df_bud["Tipo"], normalizza_tipo)
+    if "Importo" in df_bud.columns:
+        df_bud["Importo"] = _su_valori_unici(df_bud["Importo"], pulisci_importo).astype(float)
+    return df_bud
+
+
+# ==============================================================================
+# 6. INTERROGAZIONI (budget vs reale, totali di periodo, ripartizioni, andamento)
+# ==============================================================================
+# Le aggregazioni delle viste sono definite una volta sola, come interrogazioni con
+# parametri (anno, mesi) su strutture già aggregate: il registro si scorre solo quando
+# cambia versione (cubi condivisi), ogni interrogazione lavora su poche centinaia di celle.
+
+MESI_BUDGET = ['Gen', 'Feb', 'Mar', 'Apr', 'Mag', 'Giu', 'Lug', 'Ago', 'Set', 'Ott', 'Nov', 'Dic']
+CATEGORIA_SALDO = "SALDO INIZIALE"
+
+
+class CuboBudget:
+    """Budget normalizzato sommato per (MeseNum, Categoria, Tipo)."""
+
+    def __init__(self, df_budget):
+        if df_budget is None or df_budget.empty or "Mese" not in df_budget.columns:
+            indice = pd.MultiIndex.from_arrays([[], [], []], names=["MeseNum", "Categoria", "Tipo"])
+            self._celle = pd.Series([], index=indice, dtype=float, name="Importo")
+            return
+        mese = df_budget["Mese"].map({m: i for i, m in enumerate(MESI_BUDGET, start=1)})
+        df = df_budget.assign(MeseNum=mese).dropna(subset=["MeseNum"])
+        self._celle = df.groupby([df["MeseNum"].astype(int), "Categoria", "Tipo"])["Importo"].sum()
+
+    def periodo(self, mesi):
+        """Budget per (Categoria, Tipo) nei mesi indicati: colonne Categoria, Tipo, Budget."""
+        sel = self._celle[self._celle.index.get_level_values("MeseNum").isin(mesi)]
+        if sel.empty:
+            return pd.DataFrame(columns=["Categoria", "Tipo", "Budget"])
+        return sel.groupby(level=["Categoria", "Tipo"]).sum().reset_index().rename(columns={"Importo": "Budget"})
+
+
+class CuboGiornaliero:
+    """Totali del registro per (Data, Tipo), per l'andamento del saldo dentro un periodo."""
+
+    def __init__(self, df_registro):
+        self._celle = self._aggrega(df_registro)
+
+    @staticmethod
+    def _aggrega(df):
+        df = df.dropna(subset=["Data"])
+        if df.empty:
+            indice = pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), []], names=["Data", "Tipo"])
+            return pd.Series([], index=indice, dtype=float, name="Importo")
+        return df.groupby(["Data", "Tipo"])["Importo"].sum()
+
+    def aggiungi(self, df_nuove):
+        """Aggiornamento incrementale dopo un append al registro."""
+        self._celle = self._celle.add(self._aggrega(df_nuove), fill_value=0)
+
+    def periodo(self, anno, mesi):
+        """Serie (Data, Tipo) -> importo dei giorni dell'anno e dei mesi indicati."""
+        date = self._celle.index.get_level_values("Data")
+        return self._celle[(date.year == anno) & date.month.isin(mesi)]
+
+
+class Interrogazioni:
+    """
+    Interrogazioni delle viste BILANCIO, KPI e ANALISI GRAFICA sui cubi condivisi.
+    Tutte restituiscono DataFrame nuovi: i cubi non vengono mai modificati.
+    """
+
+    def __init__(self, cubo, cubo_budget, giornaliero=None):
+        self.cubo = cubo
+        self.cubo_budget = cubo_budget
+        self.giornaliero = giornaliero
+
+    def budget_vs_reale(self, anno, mesi, unione="outer", escludi=()):
+        """
+        Budget e Reale per (Categoria, Tipo) nel periodo. unione="outer" tiene tutte le
+        categorie, "left" solo quelle a budget (se il budget del periodo è vuoto restano
+        le categorie reali). Le categorie in `escludi` sono tolte da entrambi i lati.
+        """
+        reale = self.cubo.periodo(anno, mesi)
+        budget = self.cubo_budget.periodo(mesi)
+        if escludi:
+            reale = reale[~reale["Categoria"].isin(escludi)]
+            budget = budget[~budget["Categoria"].isin(escludi)]
+        if unione == "left" and budget.empty:
+            confronto = reale.copy()
+        else:
+            confronto = pd.merge(budget, reale, on=["Categoria", "Tipo"], how=unione).fillna(0)
+        for colonna in ("Budget", "Reale"):
+            if colonna not in confronto.columns:
+                confronto[colonna] = 0.0
+        return confronto.reset_index(drop=True)
+
+    @staticmethod
+    def totali_periodo(confronto):
+        """Saldo iniziale a budget, entrate operative (senza SALDO INIZIALE) e uscite, budget e reali."""
+        saldo = confronto["Categoria"] == CATEGORIA_SALDO
+        entrate = confronto[(confronto["Tipo"] == "Entrata") & ~saldo]
+        uscite = confronto[confronto["Tipo"] == "Uscita"]
+        return {
+            "saldo_iniziale_budget": confronto.loc[saldo, "Budget"].sum(),
+            "entrate_budget": entrate["Budget"].sum(),
+            "entrate_reale": entrate["Reale"].sum(),
+            "uscite_budget": uscite["Budget"].sum(),
+            "uscite_reale": uscite["Reale"].sum(),
+        }
+
+    @staticmethod
+    def ripartizione(confronto, tipo, escludi=()):
+        """
+        Righe di un tipo con lo scostamento: per le uscite Risparmio = Budget - Reale,
+        per le entrate Delta = Reale - Budget (positivo = meglio del budget in entrambi i casi).
+        """
+        righe = confronto[(confronto["Tipo"] == tipo) & ~confronto["Categoria"].isin(escludi)].copy()
+        if tipo == "Uscita":
+            righe["Risparmio"] = righe["Budget"] - righe["Reale"]
+        else:
+            righe["Delta"] = righe["Reale"] - righe["Budget"]
+        return righe
+
+    def andamento_giornaliero(self, anno, mesi):
+        """Entrate, uscite, netto e saldo cumulativo per giorno nel periodo (vuoto se non ci sono movimenti)."""
+        celle = self.giornaliero.periodo(anno, mesi)
+        if celle.empty:
+            return pd.DataFrame(columns=["Entrata", "Uscita", "Netto", "Saldo Cumulativo"])
+        giorni = celle.unstack().fillna(0)
+        for tipo in ("Entrata", "Uscita"):
+            if tipo not in giorni.columns:
+                giorni[tipo] = 0
+        giorni["Netto"] = giorni["Entrata"] - giorni["Uscita"]
+        giorni["Saldo Cumulativo"] = giorni["Netto"].cumsum()
+        return giorni
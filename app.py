@@ -3,10 +3,28 @@ from streamlit_gsheets import GSheetsConnection
 import pandas as pd
 from datetime import datetime
 from imap_tools import MailBox
-import re
+import hashlib
+import os
 import uuid
 import plotly.express as px
 import plotly.graph_objects as go
+from analisi import (
+    CATEGORIA_SALDO, CuboBudget, CuboGiornaliero, CuboMensile, IndiceSaldi, Interrogazioni,
+    mesi_del_periodo, normalizza_budget, periodo_del_mese, saldo_iniziale_budget,
+    tabella_kpi,
+)
+from archivio import ArchivioFogli, ArchivioSQLite
+from cache_grafici import CacheFigure
+from cache_locale import CacheLocale, VersioniFogli
+from categorie import RegistroCategorie
+from firme import IndiceFirme
+from ingestione import INTERVALLO_LETTURA, CodaMail, LavoratoreMail, analizza_mail
+from modifiche import calcola_modifiche, chiavi_righe, unisci_modifiche
+from parole_chiave import ArchivioParole
+from partizioni import FOGLIO_MANIFESTO, Registro, registro_vuoto
+from prestazioni import Misuratore, attiva, nuovo_profilo, salva_profilo, span
+from posta import REGOLE_FILTRO_BANCHE, StatoSync, chiave_casella, scarica_nuove_mail
+from ricerca import IndiceRicerca
 
 # ==============================================================================
 # 1. CONFIGURAZIONE PAGINA
@@ -17,1322 +35,1261 @@ st.set_page_config(
     page_icon="☁️"
 )
 
-# Mappa Mesi Completa
-MAP_MESI = {
-    1: 'Gen', 
-    2: 'Feb', 
-    3: 'Mar', 
-    4: 'Apr', 
-    5: 'Mag', 
-    6: 'Giu',
-    7: 'Lug', 
-    8: 'Ago', 
-    9: 'Set', 
-    10: 'Ott', 
-    11: 'Nov', 
-    12: 'Dic'
-}
-MAP_NUM_MESI = {v: k for k, v in MAP_MESI.items()}
-
-# --- 🧠 MAPPA PAROLE CHIAVE (ESPLOSA) ---
-MAPPA_KEYWORD = {
-    "lidl": "USCITE/PRANZO", 
-    "conad": "USCITE/PRANZO", 
-    "esselunga": "USCITE/PRANZO",
-    "coop": "USCITE/PRANZO", 
-    "carrefour": "USCITE/PRANZO", 
-    "eurospin": "USCITE/PRANZO",
-    "aldi": "USCITE/PRANZO", 
-    "ristorante": "USCITE/PRANZO", 
-    "pizzeria": "USCITE/PRANZO",
-    "sushi": "USCITE/PRANZO", 
-    "mcdonald": "USCITE/PRANZO", 
-    "burger king": "USCITE/PRANZO",
-    "bar ": "USCITE/PRANZO", 
-    "caffè": "USCITE/PRANZO", 
-    "eni": "CARBURANTE",
-    "q8": "CARBURANTE", 
-    "esso": "CARBURANTE", 
-    "benzina": "CARBURANTE",
-    "autostrade": "VARIE", 
-    "telepass": "VARIE", 
-    "amazon": "VARIE", 
-    "paypal": "PERSONALE",
-    "netflix": "VARIE", 
-    "spotify": "SPOTIFY", 
-    "dazn": "VARIE", 
-    "disney": "VARIE",
-    "farmacia": "VARIE", 
-    "medico": "VARIE", 
-    "ticket": "VARIE",
-    "ICM": "CARBURANTE",
-    "TAMOIL": "CARBURANTE"
-}
+# Misure del rerun (pannello Performance) ed eventuale profilo cProfile chiesto dal rerun precedente
+misuratore = attiva(Misuratore(dettagli=st.query_params.get("debug") == "1"))
+profilo_rerun = nuovo_profilo() if st.session_state.pop("profila_rerun", False) else None
 
-# ==============================================================================
-# 2. CONNESSIONE AI FOGLI GOOGLE
-# ==============================================================================
+# Corpo della pagina: il finally chiude sempre il profilo del rerun
 try:
-    conn = st.connection("gsheets", type=GSheetsConnection)
-except Exception as e:
-    st.error("Errore connessione. Controlla i secrets!")
-    st.stop()
-
-# ==============================================================================
-# 3. FUNZIONI DI CARICAMENTO E PULIZIA DATI
-# ==============================================================================
-
-@st.cache_data(ttl=60)
-def get_custom_map():
-    """Carica le associazioni imparate dal foglio DB_KEYWORDS."""
-    try:
-        # Legge colonne A e B (Parola, Categoria)
-        df = conn.read(worksheet="DB_KEYWORDS", usecols=[0, 1])
-        if df.empty: return {}
-        # Crea un dizionario { 'beyfin': 'Carburante', ... }
-        return dict(zip(df.iloc[:, 0].astype(str).str.lower().str.strip(), df.iloc[:, 1]))
-    except:
-        return {}
-def get_categories():
-    """Carica le categorie dal foglio '2026'."""
+    # Mappa Mesi Completa
+    MAP_MESI = {
+        1: 'Gen', 
+        2: 'Feb', 
+        3: 'Mar', 
+        4: 'Apr', 
+        5: 'Mag', 
+        6: 'Giu',
+        7: 'Lug', 
+        8: 'Ago', 
+        9: 'Set', 
+        10: 'Ott', 
+        11: 'Nov', 
+        12: 'Dic'
+    }
+    MAP_NUM_MESI = {v: k for k, v in MAP_MESI.items()}
+
+    # --- 🧠 MAPPA PAROLE CHIAVE (ESPLOSA) ---
+    MAPPA_KEYWORD = {
+        "lidl": "USCITE/PRANZO", 
+        "conad": "USCITE/PRANZO", 
+        "esselunga": "USCITE/PRANZO",
+        "coop": "USCITE/PRANZO", 
+        "carrefour": "USCITE/PRANZO", 
+        "eurospin": "USCITE/PRANZO",
+        "aldi": "USCITE/PRANZO", 
+        "ristorante": "USCITE/PRANZO", 
+        "pizzeria": "USCITE/PRANZO",
+        "sushi": "USCITE/PRANZO", 
+        "mcdonald": "USCITE/PRANZO", 
+        "burger king": "USCITE/PRANZO",
+        "bar ": "USCITE/PRANZO", 
+        "caffè": "USCITE/PRANZO", 
+        "eni": "CARBURANTE",
+        "q8": "CARBURANTE", 
+        "esso": "CARBURANTE", 
+        "benzina": "CARBURANTE",
+        "autostrade": "VARIE", 
+        "telepass": "VARIE", 
+        "amazon": "VARIE", 
+        "paypal": "PERSONALE",
+        "netflix": "VARIE", 
+        "spotify": "SPOTIFY", 
+        "dazn": "VARIE", 
+        "disney": "VARIE",
+        "farmacia": "VARIE", 
+        "medico": "VARIE", 
+        "ticket": "VARIE",
+        "ICM": "CARBURANTE",
+        "TAMOIL": "CARBURANTE"
+    }
+
+    # ==============================================================================
+    # 2. CONNESSIONE AI FOGLI GOOGLE (O ALL'ARCHIVIO LOCALE SQLITE)
+    # ==============================================================================
+    # Modalità offline: BILANCIO_ARCHIVIO=sqlite nell'ambiente oppure [archivio] tipo = "sqlite" nei secrets
     try:
-        df_cat = conn.read(worksheet="2026", usecols=[0, 2], header=None)
-        
-        # Pulizia Entrate (Ciclo For Esplicito)
-        raw_entrate = df_cat.iloc[3:23, 0].dropna().unique().tolist()
-        cat_entrate = []
-        for x in raw_entrate:
-            valore_pulito = str(x).strip()
-            if valore_pulito != "":
-                cat_entrate.append(valore_pulito)
-        cat_entrate.sort()
-        
-        # Pulizia Uscite (Ciclo For Esplicito)
-        raw_uscite = df_cat.iloc[2:23, 1].dropna().unique().tolist()
-        cat_uscite = []
-        for x in raw_uscite:
-            valore_pulito = str(x).strip()
-            if valore_pulito != "":
-                cat_uscite.append(valore_pulito)
-        cat_uscite.sort()
-        
-        # Aggiunta Default se mancano
-        if "DA VERIFICARE" not in cat_entrate:
-            cat_entrate.insert(0, "DA VERIFICARE")
-        
-        if "DA VERIFICARE" not in cat_uscite:
-            cat_uscite.insert(0, "DA VERIFICARE")
-        
-        return cat_entrate, cat_uscite
-    except Exception as e:
-        # Fallback in caso di errore
-        return ["DA VERIFICARE"], ["DA VERIFICARE"]
-
-CAT_ENTRATE, CAT_USCITE = get_categories()
-LISTA_TUTTE = sorted(list(set(CAT_ENTRATE + CAT_USCITE)))
+        config_archivio = dict(st.secrets.get("archivio", {}))
+    except Exception:
+        config_archivio = {}
+    MODALITA_OFFLINE = os.environ.get("BILANCIO_ARCHIVIO", config_archivio.get("tipo", "gsheets")) == "sqlite"
+    PERCORSO_OFFLINE = config_archivio.get("percorso", os.path.join(".bilancio_cache", "archivio.sqlite"))
+
+    conn = None
+    if not MODALITA_OFFLINE:
+        try:
+            conn = st.connection("gsheets", type=GSheetsConnection)
+        except Exception as e:
+            st.error("Errore connessione. Controlla i secrets!")
+            st.stop()
+
+    @st.cache_resource
+    def get_archivio():
+        """Livello di persistenza (scritture parziali, worksheet aperti una volta sola)."""
+        if MODALITA_OFFLINE:
+            return ArchivioSQLite(PERCORSO_OFFLINE)
+        return ArchivioFogli(conn)
+
+    @st.cache_resource
+    def get_cache_fogli():
+        """Copia locale dei fogli (SQLite su disco + ultima versione in memoria), condivisa tra sessioni."""
+        return CacheLocale()
+
+    @st.cache_resource
+    def get_versioni():
+        """Token di versione dei fogli condiviso da tutte le sessioni."""
+        return VersioniFogli(get_archivio().versione, intervallo=30)
+
+    @st.cache_resource
+    def get_cache_grafici():
+        """Figure Plotly già costruite, riusate finché dati e parametri non cambiano."""
+        return CacheFigure(max_voci=64, max_byte=50 * 1024 * 1024)
+
+    @st.cache_resource
+    def get_registro():
+        """Registro transazioni: foglio unico oppure un foglio per anno con il manifesto."""
+        return Registro(get_archivio(), get_cache_fogli(), get_versioni())
+
+    archivio = get_archivio()
+    cache_fogli = get_cache_fogli()
+    versioni = get_versioni()
+    cache_grafici = get_cache_grafici()
+    registro = get_registro()
+
+    # ==============================================================================
+    # 3. FUNZIONI DI CARICAMENTO E PULIZIA DATI
+    # ==============================================================================
+
+    @st.cache_resource
+    def get_archivio_parole():
+        """Parole imparate (DB_KEYWORDS) in memoria, condivise tra sessioni."""
+        return ArchivioParole(archivio)
+
+    def get_parole():
+        """Archivio delle parole imparate, riletto dal foglio solo se è cambiato."""
+        parole = get_archivio_parole()
+        parole.sincronizza(versioni.token("DB_KEYWORDS"))
+        return parole
+
+    def get_custom_map():
+        """Associazioni imparate { 'beyfin': 'Carburante', ... } (chiavi in minuscolo)."""
+        return get_parole().mappa()
+
+
+    @st.cache_resource
+    def get_registro_categorie():
+        """Categorie per anno, lette una volta per versione del foglio e condivise tra sessioni."""
+        return RegistroCategorie(archivio)
+
+    def get_categories():
+        """Categorie dal foglio dell'anno corrente (o dell'ultimo anno disponibile)."""
+        return get_registro_categorie().categorie(datetime.now().year, versioni.token)
+
+    CATEGORIE = get_categories()
+    CAT_ENTRATE, CAT_USCITE, LISTA_TUTTE = CATEGORIE.entrate, CATEGORIE.uscite, CATEGORIE.tutte
+
+
+    def carica_budget():
+        """Scarica DB_BUDGET (prime 4 colonne) e normalizza mesi, tipi e importi."""
+        return normalizza_budget(archivio.leggi("DB_BUDGET", usecols=list(range(4))))
+
+    def get_vista(anni=None):
+        """
+        (nome, snapshot) del registro con i soli anni indicati (None = tutti): con il registro
+        diviso per anno si scaricano solo quelle partizioni. Snapshot condiviso, in sola lettura.
+        """
+        try:
+            return registro.vista(anni)
+        except Exception as e:
+            st.error(f"Errore caricamento DB: {e}")
+            return "DB_TRANSAZIONI[]", registro_vuoto()
+
+    def get_anni():
+        """Anni del registro dal più recente (dal manifesto se il registro è diviso per anno)."""
+        try:
+            return registro.anni() or [datetime.now().year]
+        except Exception:
+            return [datetime.now().year]
+
+    def get_derivato(nome_struttura, costruisci, anni=None, snapshot=None):
+        """
+        Struttura derivata (cubo, indici) della vista sugli anni indicati, condivisa tra tab e sessioni.
+        snapshot = (nome, df) già restituito da get_vista: la struttura corrisponde a quelle righe
+        anche se nel frattempo il registro è stato ricaricato.
+        """
+        nome, df = snapshot if snapshot is not None else get_vista(anni)
+        return cache_fogli.derivato(nome, nome_struttura, costruisci, df)
+
+    def get_cubo(anni=None):
+        """
+        Cubo mensile (Anno, Mese, Categoria, Tipo) degli anni indicati. Con l'archivio SQLite
+        parte dai totali calcolati in SQL, senza leggere le singole transazioni.
+        """
+        try:
+            totali = registro.totali(anni)
+        except Exception as e:
+            st.error(f"Errore caricamento DB: {e}")
+            totali = None
+        if totali is not None:
+            return get_derivato("cubo", CuboMensile, snapshot=totali)
+        return get_derivato("cubo", CuboMensile, anni)
+
+    def get_indice_saldi(anni=None):
+        """Somme prefisse mensili di entrate/uscite degli anni indicati (saldi in O(1))."""
+        return get_derivato("saldi", IndiceSaldi, anni)
+
+    def get_indice_ricerca(anni=None, snapshot=None):
+        """Indice dei filtri dello STORICO (testo e valori discreti)."""
+        return get_derivato("ricerca", IndiceRicerca, anni, snapshot)
+
+    def get_indice_firme(anni=None):
+        """Firme già presenti nel registro, per scartare i duplicati in O(1) durante l'import."""
+        return get_derivato("firme", IndiceFirme, anni)
+
+    def get_budget_data():
+        """Budget normalizzato, calcolato una volta per versione del foglio e condiviso da tutti i tab."""
+        try:
+            return cache_fogli.carica("DB_BUDGET", versioni.token("DB_BUDGET"), carica_budget)
+        except:
+            return pd.DataFrame()
+
+    def get_interrogazioni(anni=None):
+        """Interrogazioni budget vs reale, ripartizioni e andamento sui cubi degli anni indicati."""
+        return Interrogazioni(
+            get_cubo(anni),
+            cache_fogli.derivato("DB_BUDGET", "cubo_budget", CuboBudget, get_budget_data()),
+            get_derivato("giornaliero", CuboGiornaliero, anni),
+        )
 
+    # ==============================================================================
+    # 4. FUNZIONI UTILI (MAIL, GRAFICI, LOGICA, COLORI)
+    # ==============================================================================
+
+    # Le funzioni usate dall'analisi delle mail girano anche nel thread in background:
+    # usano gli oggetti condivisi già risolti qui sotto, non le funzioni di Streamlit.
+    archivio_parole = get_archivio_parole()
+    registro_categorie = get_registro_categorie()
+
+    def trova_categoria_smart(descrizione, tipo):
+        """
+        Assegna categoria: Prima controlla memoria, poi keyword fisse, poi nome. L'automa delle
+        parole chiave è compilato una volta per versione di DB_KEYWORDS e aggiornato in place.
+        """
+        archivio_parole.sincronizza(versioni.token("DB_KEYWORDS"))
+        categorie = registro_categorie.categorie(datetime.now().year, versioni.token)
+        return archivio_parole.categorizzatore(tuple(categorie.per_tipo(tipo)), MAPPA_KEYWORD).classifica(descrizione)
+
+    def indice_firme_anno(anno):
+        """Firme già salvate nella partizione di un anno."""
+        nome, df = registro.vista([anno])
+        return cache_fogli.derivato(nome, "firme", IndiceFirme, df)
+
+    def analizza_messaggi(messaggi):
+        """(transazioni, scartate, statistiche) delle mail scaricate, senza i duplicati del registro."""
+        return analizza_mail(messaggi, trova_categoria_smart, indice_firme_anno)
 
-@st.cache_data(ttl=0) 
-def get_budget_data():
-    """Carica il budget dal foglio DB_BUDGET e normalizza i dati."""
     try:
-        # Legge solo le prime 4 colonne
-        df_bud = conn.read(worksheet="DB_BUDGET", usecols=list(range(4))).fillna(0)
-        
-        # Rinomina colonne standard
-        if len(df_bud.columns) >= 4:
-            df_bud.columns = ["Mese", "Categoria", "Tipo", "Importo"]
-        
-        # Pulizia base spazi
-        for col in ["Mese", "Categoria", "Tipo"]:
-            if col in df_bud.columns:
-                df_bud[col] = df_bud[col].astype(str).str.strip()
-
-        # Funzione Normalizzazione Mese
-        def normalizza_mese(val):
-            v = str(val).strip().lower()
-            if v.startswith('gen') or v in ['1', '01']: return 'Gen'
-            if v.startswith('feb') or v in ['2', '02']: return 'Feb'
-            if v.startswith('mar') or v in ['3', '03']: return 'Mar'
-            if v.startswith('apr') or v in ['4', '04']: return 'Apr'
-            if v.startswith('mag') or v in ['5', '05']: return 'Mag'
-            if v.startswith('giu') or v in ['6', '06']: return 'Giu'
-            if v.startswith('lug') or v in ['7', '07']: return 'Lug'
-            if v.startswith('ago') or v in ['8', '08']: return 'Ago'
-            if v.startswith('set') or v in ['9', '09']: return 'Set'
-            if v.startswith('ott') or v == '10': return 'Ott'
-            if v.startswith('nov') or v == '11': return 'Nov'
-            if v.startswith('dic') or v == '12': return 'Dic'
-            return v.capitalize()
-
-        if "Mese" in df_bud.columns:
-            df_bud["Mese"] = df_bud["Mese"].apply(normalizza_mese)
-
-        # Funzione Normalizzazione Tipo
-        def normalizza_tipo(val):
-            v = str(val).strip().lower()
-            if 'usc' in v or 'spes' in v:
-                return 'Uscita'
-            if 'ent' in v or 'ric' in v:
-                return 'Entrata'
-            return v.capitalize()
-
-        if "Tipo" in df_bud.columns:
-            df_bud["Tipo"] = df_bud["Tipo"].apply(normalizza_tipo)
-            
-        # Funzione Fix Importi
-        if "Importo" in df_bud.columns:
-            def pulisci_numero(val):
-                s = str(val).strip().replace('€', '')
-                if '.' in s and ',' in s: 
-                    # Caso 1.000,00 -> togli punto, cambia virgola in punto
-                    s = s.replace('.', '').replace(',', '.')
-                elif ',' in s: 
-                    # Caso 100,00 -> cambia virgola in punto
-                    s = s.replace(',', '.')
-                return s
-            
-            df_bud["Importo"] = df_bud["Importo"].apply(pulisci_numero)
-            df_bud["Importo"] = pd.to_numeric(df_bud["Importo"], errors='coerce').fillna(0)
-        
-        return df_bud
-    except:
-        return pd.DataFrame()
-
-# ==============================================================================
-# 4. FUNZIONI UTILI (MAIL, GRAFICI, LOGICA, COLORI)
-# ==============================================================================
-
-def trova_categoria_smart(descrizione, lista_categorie_disponibili):
-    """Assegna categoria: Prima controlla memoria, poi keyword fisse, poi nome."""
-    desc_lower = descrizione.lower().strip()
-    
-    # 0. CARICAMENTO MEMORIA (Imparata)
-    mappa_custom = get_custom_map()
-    
-    # Cerca se una parola imparata è contenuta nella descrizione
-    for parola_learned, cat_learned in mappa_custom.items():
-        if parola_learned in desc_lower:
-            # Verifica che la categoria imparata esista ancora
-            for c in lista_categorie_disponibili:
-                if cat_learned.lower() == c.lower():
-                    return c
-
-    # 1. Controllo Keyword Hardcoded (MAPPA_KEYWORD)
-    for parola_chiave, target_categoria in MAPPA_KEYWORD.items():
-        if parola_chiave in desc_lower:
-            for cat in lista_categorie_disponibili:
-                if target_categoria.lower() in cat.lower():
-                    return cat
-                    
-    # 2. Controllo Corrispondenza Nome Categoria
-    for cat in lista_categorie_disponibili:
-        if cat.lower() in desc_lower:
-            return cat
-            
-    return "DA VERIFICARE"
-
-def scarica_spese_da_gmail():
-    """Legge la mail, riconosce Stipendio, PayPal e Rata Auto (tramite IBAN)."""
-    nuove_transazioni = []
-    mail_scartate = [] 
-    
-    if "email" not in st.secrets:
-        st.error("Mancano i secrets per la mail!")
-        return pd.DataFrame(), pd.DataFrame()
+        config_email = dict(st.secrets.get("email", {}))
+    except Exception:
+        config_email = {}
+
+    def config_mail():
+        """(user, password, server, regole) dai secrets, oppure None se mancano."""
+        if not config_email:
+            return None
+        # Regole filtro opzionali nei secrets, es: filtri = [["from", "widiba"], ["subject", "widiba"]]
+        return (config_email["user"], config_email["password"],
+                config_email["imap_server"], config_email.get("filtri", REGOLE_FILTRO_BANCHE))
+
+    def apri_casella(user, pwd, server):
+        """Casella IMAP autenticata (da usare con `with`, che chiude la connessione)."""
+        with span("imap", "login"):
+            return MailBox(server).login(user, pwd)
+
+    # Lettura mail in background (opzionale): BILANCIO_MAIL_WORKER=1 nell'ambiente oppure
+    # [email] lavoratore = true nei secrets (intervallo_lettura = secondi tra due letture)
+    LAVORATORE_MAIL = os.environ.get("BILANCIO_MAIL_WORKER", "") in ("1", "true") or bool(config_email.get("lavoratore", False))
+
+    @st.cache_resource
+    def get_coda_mail():
+        """Transazioni lette dalle mail e in attesa di conferma, condivise tra sessioni e riavvii."""
+        return CodaMail()
+
+    @st.cache_resource
+    def get_lavoratore_mail():
+        """Thread che legge la casella a intervalli e riempie la coda (uno per processo)."""
+        config = config_mail()
+        if not LAVORATORE_MAIL or config is None:
+            return None
+        user, pwd, server, regole = config
+        return LavoratoreMail(
+            lambda: apri_casella(user, pwd, server), analizza_messaggi, get_coda_mail(),
+            chiave_casella(user, server), regole=regole,
+            intervallo=int(config_email.get("intervallo_lettura", INTERVALLO_LETTURA)),
+        ).avvia()
+
+    def scarica_spese_da_gmail(completo=False):
+        """
+        Legge la mail, riconosce Stipendio, PayPal e Rata Auto (tramite IBAN).
+        Scarica solo le mail successive all'ultima sincronizzazione (completo=True rilegge le ultime 50).
+        Il filtro banca gira sul server (IMAP SEARCH); restituisce anche le statistiche del filtro.
+        Le transazioni già nel registro o ripetute nello stesso scaricamento vengono scartate.
+        Restituisce anche il punto di ripresa (chiave, uidvalidity, ultimo_uid) da salvare con
+        StatoSync().salva(*ripresa) quando le mail sono al sicuro (None se la lettura fallisce).
+        """
+        statistiche = {"esaminate": 0, "candidate": 0, "scartate_server": 0, "scartate_client": 0, "duplicate": 0}
+        config = config_mail()
+        if config is None:
+            st.error("Mancano i secrets per la mail!")
+            return pd.DataFrame(), pd.DataFrame(), statistiche, None
+        user, pwd, server, regole = config
+        chiave = chiave_casella(user, server)
+
+        try:
+            with apri_casella(user, pwd, server) as mailbox:
+                # Solo le mail nuove rispetto all'ultimo UID visto (mark_seen=False -> NON segna come letta)
+                messaggi, stat_server, punto = scarica_nuove_mail(
+                    mailbox, StatoSync(), chiave, completo=completo, regole=regole
+                )
+            statistiche.update(stat_server)
+            nuove_transazioni, mail_scartate, stat_analisi = analizza_messaggi(messaggi)
+            statistiche.update(stat_analisi)
+        except Exception as e:
+            st.error(f"Errore lettura mail: {e}")
+            return pd.DataFrame(), pd.DataFrame(), statistiche, None
+
+        return pd.DataFrame(nuove_transazioni), pd.DataFrame(mail_scartate), statistiche, (chiave, *punto)
+
+
+    def style_delta_standard(val):
+        """
+        Stile per Entrate e Utile:
+        - Positivo (>= 0) -> Verde
+        - Negativo (< 0) -> Rosso
+        """
+        if val >= 0:
+            return 'color: green; font-weight: bold'
+        else:
+            return 'color: red; font-weight: bold'
+
+    def style_delta_spese(val):
+        """
+        Stile per Uscite (Logica Risparmio):
+        - Positivo (Budget > Reale, ho risparmiato) -> Verde
+        - Negativo (Budget < Reale, ho sforato) -> Rosso
+        """
+        if val >= 0:
+            return 'color: green; font-weight: bold'
+        else:
+            return 'color: red; font-weight: bold'
 
-    user = st.secrets["email"]["user"]
-    pwd = st.secrets["email"]["password"]
-    server = st.secrets["email"]["imap_server"]
+    def genera_grafico_avanzato(df, tipo_grafico, col_valore, col_label, titolo, color_sequence):
+        """Genera il grafico in base al selettore dell'utente."""
+        if df.empty or df[col_valore].sum() == 0:
+            return None
     
-    try:
-        with MailBox(server).login(user, pwd) as mailbox:
-            # mark_seen=False -> NON segna la mail come letta
-            for msg in mailbox.fetch(limit=50, reverse=True, mark_seen=False): 
-                
-                soggetto = msg.subject
-                corpo = msg.text or msg.html
-                corpo_clean = " ".join(corpo.split())
-                
-                # Filtro: deve esserci 'widiba' (case insensitive)
-                if "widiba" not in corpo_clean.lower() and "widiba" not in soggetto.lower():
-                      continue
-
-                importo = 0.0
-                tipo = "Uscita" # Default
-                descrizione = "Transazione Generica"
-                categoria_suggerita = "DA VERIFICARE"
-                trovato = False
-
-                # --- 1. REGEX USCITE ---
-                regex_uscite = [
-                    r'(?:pagamento|prelievo|addebito|bonifico).*?di\s+([\d.,]+)\s+euro.*?(?:presso|per|a favore di|su)\s+(.*?)(?:\.|$)',
-                    r'ha\s+prelevato\s+([\d.,]+)\s+euro.*?(?:presso)\s+(.*?)(?:\.|$)'
-                ]
-                
-                # --- 2. REGEX ENTRATE ---
-                regex_entrate_data = [
-                    (r'(?:accredito|bonifico).*?di\s+([\d.,]+)\s+euro.*?(?:per|da|a favore di)\s+(.*?)(?:\.|$)', 1, 2),
-                    (r'accredito\s+per\s+(.*?)\s+di\s+([\d.,]+)\s+euro', 2, 1),
-                    (r'hai\s+ricevuto\s+([\d.,]+)\s+euro\s+da\s+(.*?)(?:\.|$)', 1, 2)
-                ]
-
-                # A. Cerca nelle USCITE
-                for rx in regex_uscite:
-                    match = re.search(rx, corpo_clean, re.IGNORECASE)
-                    if match:
-                        importo_str = match.group(1)
-                        desc_temp = match.group(2).strip()
-                        importo = float(importo_str.replace('.', '').replace(',', '.'))
-                        tipo = "Uscita"
-                        descrizione = desc_temp
-                        
-                        # --- MODIFICA SPECIFICA RATA AUTO ---
-                        # Se c'è l'IBAN della rata, sovrascriviamo la descrizione
-                        if "IT77J0338501601100000720458" in corpo_clean:
-                            descrizione = "Rata Auto"
-                            # Se vuoi assegnare una categoria automatica, scommenta la riga sotto:
-                            # categoria_suggerita = "AUTO" o "DEBITI"
-                        
-                        if categoria_suggerita == "DA VERIFICARE":
-                             categoria_suggerita = trova_categoria_smart(descrizione, CAT_USCITE)
-                             
-                        trovato = True
-                        break 
-
-                # B. Cerca nelle ENTRATE (se non è un'uscita)
-                if not trovato:
-                    for rx_data in regex_entrate_data:
-                        rx_pattern = rx_data[0]
-                        idx_imp = rx_data[1]
-                        idx_desc = rx_data[2]
-                        
-                        match = re.search(rx_pattern, corpo_clean, re.IGNORECASE)
-                        if match:
-                            importo_str = match.group(idx_imp)
-                            desc_temp = match.group(idx_desc).strip()
-                            
-                            importo = float(importo_str.replace('.', '').replace(',', '.'))
-                            tipo = "Entrata"
-                            descrizione = desc_temp
-                            
-                            if "paypal" in corpo_clean.lower():
-                                descrizione = f"PayPal - {descrizione}"
-                                
-                            categoria_suggerita = trova_categoria_smart(descrizione, CAT_ENTRATE)
-                            trovato = True
-                            break
-
-                # C. Salvataggio o Scarto
-                if trovato:
-                    firma_univoca = f"{msg.date.strftime('%Y%m%d')}-{importo}-{descrizione[:10]}"
-                    transazione = {
-                        "Data": msg.date.strftime("%Y-%m-%d"),
-                        "Descrizione": descrizione,
-                        "Importo": importo,
-                        "Tipo": tipo,
-                        "Categoria": categoria_suggerita, 
-                        "Mese": msg.date.strftime('%b-%y'),
-                        "Firma": firma_univoca
-                    }
-                    nuove_transazioni.append(transazione)
-                else:
-                    firma_errore = f"ERR-{msg.date.strftime('%Y%m%d')}-{uuid.uuid4().hex[:6]}"
-                    scartata = {
-                        "Data": msg.date.strftime("%Y-%m-%d"),
-                        "Descrizione": soggetto,
-                        "Importo": 0.0,
-                        "Tipo": "Uscita",
-                        "Categoria": "DA VERIFICARE",
-                        "Mese": msg.date.strftime('%b-%y'),
-                        "Firma": firma_errore
-                    }
-                    mail_scartate.append(scartata)
-                    
-    except Exception as e:
-        st.error(f"Errore lettura mail: {e}")
-        
-    return pd.DataFrame(nuove_transazioni), pd.DataFrame(mail_scartate)
-def style_delta_standard(val):
-    """
-    Stile per Entrate e Utile:
-    - Positivo (>= 0) -> Verde
-    - Negativo (< 0) -> Rosso
-    """
-    if val >= 0:
-        return 'color: green; font-weight: bold'
-    else:
-        return 'color: red; font-weight: bold'
-
-def style_delta_spese(val):
-    """
-    Stile per Uscite (Logica Risparmio):
-    - Positivo (Budget > Reale, ho risparmiato) -> Verde
-    - Negativo (Budget < Reale, ho sforato) -> Rosso
-    """
-    if val >= 0:
-        return 'color: green; font-weight: bold'
-    else:
-        return 'color: red; font-weight: bold'
-
-def genera_grafico_avanzato(df, tipo_grafico, col_valore, col_label, titolo, color_sequence):
-    """Genera il grafico in base al selettore dell'utente."""
-    if df.empty or df[col_valore].sum() == 0:
-        return None
-    
-    if tipo_grafico == "Torta (Donut)":
-        fig = px.pie(df, values=col_valore, names=col_label, hole=0.4, title=titolo, color_discrete_sequence=color_sequence)
-        fig.update_traces(textposition='inside', textinfo='percent+label')
+        if tipo_grafico == "Torta (Donut)":
+            fig = px.pie(df, values=col_valore, names=col_label, hole=0.4, title=titolo, color_discrete_sequence=color_sequence)
+            fig.update_traces(textposition='inside', textinfo='percent+label')
         
-    elif tipo_grafico == "Barre Orizzontali":
-        fig = px.bar(df, x=col_valore, y=col_label, orientation='h', title=titolo, text_auto='.2s', color=col_valore, color_continuous_scale=color_sequence)
-        fig.update_layout(yaxis={'categoryorder':'total ascending'})
+        elif tipo_grafico == "Barre Orizzontali":
+            fig = px.bar(df, x=col_valore, y=col_label, orientation='h', title=titolo, text_auto='.2s', color=col_valore, color_continuous_scale=color_sequence)
+            fig.update_layout(yaxis={'categoryorder':'total ascending'})
         
-    elif tipo_grafico == "Treemap (Mappa)":
-        fig = px.treemap(df, path=[col_label], values=col_valore, title=titolo, color=col_valore, color_continuous_scale=color_sequence)
+        elif tipo_grafico == "Treemap (Mappa)":
+            fig = px.treemap(df, path=[col_label], values=col_valore, title=titolo, color=col_valore, color_continuous_scale=color_sequence)
         
-    else:
-        return None
+        else:
+            return None
     
-    return fig
-
-def crea_tachimetro(valore, titolo, min_v=0, max_v=100, soglia_ok=50):
-    """Crea un grafico Gauge (tachimetro)."""
-    fig = go.Figure(go.Indicator(
-        mode = "gauge+number",
-        value = valore,
-        title = {'text': titolo, 'font': {'size': 14}},
-        gauge = {
-            'axis': {'range': [None, max_v]},
-            'bar': {'color': "darkblue"},
-            'steps': [
-                {'range': [0, soglia_ok], 'color': "lightgray"},
-                {'range': [soglia_ok, max_v], 'color': "lightgreen"}
-            ],
-            'threshold': {
-                'line': {'color': "red", 'width': 4},
-                'thickness': 0.75,
-                'value': valore
+        return fig
+
+    def crea_tachimetro(valore, titolo, min_v=0, max_v=100, soglia_ok=50):
+        """Crea un grafico Gauge (tachimetro)."""
+        fig = go.Figure(go.Indicator(
+            mode = "gauge+number",
+            value = valore,
+            title = {'text': titolo, 'font': {'size': 14}},
+            gauge = {
+                'axis': {'range': [None, max_v]},
+                'bar': {'color': "darkblue"},
+                'steps': [
+                    {'range': [0, soglia_ok], 'color': "lightgray"},
+                    {'range': [soglia_ok, max_v], 'color': "lightgreen"}
+                ],
+                'threshold': {
+                    'line': {'color': "red", 'width': 4},
+                    'thickness': 0.75,
+                    'value': valore
+                }
             }
-        }
-    ))
-    fig.update_layout(height=200, margin=dict(l=20, r=20, t=30, b=20))
-    return fig
-
-# ==============================================================================
-# 5. CARICAMENTO DATI INIZIALE
-# ==============================================================================
-st.title("☁️ Piano Pluriennale 2026")
-
-try:
-    df_cloud = conn.read(worksheet="DB_TRANSAZIONI", usecols=list(range(7)), ttl=0)
-    df_cloud["Data"] = pd.to_datetime(df_cloud["Data"], errors='coerce')
-    df_cloud["Importo"] = pd.to_numeric(df_cloud["Importo"], errors='coerce').fillna(0)
-    
-    # Pulizia Categoria
-    if "Categoria" in df_cloud.columns:
-        df_cloud["Categoria"] = df_cloud["Categoria"].astype(str).str.strip()
-    
-    # --- FIX CRITICO: AGGIUNTA COLONNE GLOBALI PER EVITARE KEYERROR ---
-    if not df_cloud.empty and "Data" in df_cloud.columns:
-        df_cloud["Anno"] = df_cloud["Data"].dt.year
-        df_cloud["MeseNum"] = df_cloud["Data"].dt.month
-    else:
-        # Se il DB è vuoto, inizializza colonne vuote
-        df_cloud["Anno"] = 2026
-        df_cloud["MeseNum"] = 1
-
-except Exception as e:
-    st.error(f"Errore caricamento DB: {e}")
-    df_cloud = pd.DataFrame(columns=["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma", "Anno", "MeseNum"])
-
-# Inizializzazione Session State
-if "df_mail_found" not in st.session_state:
-    st.session_state["df_mail_found"] = pd.DataFrame()
-if "df_mail_discarded" not in st.session_state:
-    st.session_state["df_mail_discarded"] = pd.DataFrame()
-if "df_manual_entry" not in st.session_state:
-    st.session_state["df_manual_entry"] = pd.DataFrame(columns=["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"])
-
-# ==============================================================================
-# 6. DEFINIZIONE TABS PRINCIPALI
-# ==============================================================================
-tab_bil, tab_kpi, tab_graf, tab_imp, tab_stor = st.tabs([
-    "📑 BILANCIO", 
-    "📈 INDICI & KPI", 
-    "📊 ANALISI GRAFICA", 
-    "📥 IMPORTA", 
-    "🗂 STORICO"
-])
-
-# ==============================================================================
-# TAB 1: RIEPILOGO & BILANCIO
-# ==============================================================================
-with tab_bil:
-    # 1. Caricamento Dati
-    df_budget_b = get_budget_data()
-    # Usiamo una copia locale per non toccare il globale
-    df_analysis_b = df_cloud.copy()
-    
-    st.markdown("### 🏦 Bilancio di Esercizio")
+        ))
+        fig.update_layout(height=200, margin=dict(l=20, r=20, t=30, b=20))
+        return fig
+
+    # ==============================================================================
+    # 5. CARICAMENTO DATI INIZIALE
+    # ==============================================================================
+    st.title("☁️ Piano Pluriennale 2026")
+
+    with st.sidebar.expander("🗄️ Archivio"):
+        partizioni_registro = registro.manifesto()
+        if partizioni_registro:
+            st.caption(f"Registro diviso per anno: {len(partizioni_registro)} fogli (si caricano solo gli anni mostrati)")
+        elif st.button("📦 Dividi il registro per anno", help="Crea un foglio per anno e il manifesto DB_PARTIZIONI; DB_TRANSAZIONI resta come copia"):
+            with st.spinner("Divisione del registro in corso..."):
+                manifesto_scritto = registro.partiziona()
+            st.success(f"Creati {len(manifesto_scritto)} fogli annuali")
+            st.rerun()
+        if MODALITA_OFFLINE:
+            st.caption(f"Modalità offline: archivio SQLite locale ({PERCORSO_OFFLINE})")
+        else:
+            st.caption("Google Sheets. La copia offline si usa con BILANCIO_ARCHIVIO=sqlite.")
+            if st.button("💾 Crea copia offline"):
+                anno_corrente = datetime.now().year
+                fogli_offline = ["DB_TRANSAZIONI", "DB_BUDGET", "DB_KEYWORDS"] + [str(a) for a in range(anno_corrente, anno_corrente - 4, -1)]
+                if partizioni_registro:
+                    fogli_offline += [FOGLIO_MANIFESTO] + [f for f, _ in partizioni_registro.values()]
+                with st.spinner("Copia dei fogli in corso..."):
+                    copiati = ArchivioSQLite(PERCORSO_OFFLINE).importa(archivio, fogli_offline)
+                st.success(f"Copiati {len(copiati)} fogli in {PERCORSO_OFFLINE}")
+
+    # Inizializzazione Session State
+    if "df_mail_found" not in st.session_state:
+        st.session_state["df_mail_found"] = pd.DataFrame()
+    if "df_mail_discarded" not in st.session_state:
+        st.session_state["df_mail_discarded"] = pd.DataFrame()
+    if "df_manual_entry" not in st.session_state:
+        st.session_state["df_manual_entry"] = pd.DataFrame(columns=["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"])
+
+    # ==============================================================================
+    # 6. DEFINIZIONE TABS PRINCIPALI
+    # ==============================================================================
+    # Al posto di st.tabs (che esegue il corpo di tutte le schede a ogni rerun) si sceglie una
+    # vista: viene calcolata solo quella mostrata. La scelta resta in session_state tra i rerun.
+    VISTE = ["📑 BILANCIO", "📈 INDICI & KPI", "📊 ANALISI GRAFICA", "📥 IMPORTA", "🗂 STORICO"]
+    VISTA_BIL, VISTA_KPI, VISTA_GRAF, VISTA_IMP, VISTA_STOR = VISTE
+    vista = st.radio("Sezione", VISTE, horizontal=True, key="vista_attiva", label_visibility="collapsed")
+
+    # ==============================================================================
+    # TAB 1: RIEPILOGO & BILANCIO
+    # ==============================================================================
+    if vista == VISTA_BIL:
+        # 1. Caricamento Dati
+        df_budget_b = get_budget_data()
     
-    # 2. Selettori Periodo
-    cb1, cb2, cb3 = st.columns(3)
-    with cb1:
-        lista_anni = sorted(df_analysis_b["Anno"].unique(), reverse=True)
-        if not lista_anni: lista_anni = [2026]
-        anno_b = st.selectbox("📅 Anno Riferimento", lista_anni, key="a_bil")
-    with cb2:
-        per_b = st.selectbox("📊 Periodo", ["Mensile", "Trimestrale", "Semestrale", "Annuale"], key="p_bil")
+        st.markdown("### 🏦 Bilancio di Esercizio")
     
-    l_mesi_b = []
-    l_num_b = []
+        # 2. Selettori Periodo
+        cb1, cb2, cb3 = st.columns(3)
+        with cb1:
+            lista_anni = get_anni()
+            if not lista_anni: lista_anni = [2026]
+            anno_b = st.selectbox("📅 Anno Riferimento", lista_anni, key="a_bil")
+        with cb2:
+            per_b = st.selectbox("📊 Periodo", ["Mensile", "Trimestrale", "Semestrale", "Annuale"], key="p_bil")
     
-    with cb3:
-        if per_b == "Mensile":
-            m = st.selectbox("Mese", list(MAP_MESI.values()), index=datetime.now().month-1, key="m_bil")
-            l_mesi_b = [m]
-            l_num_b = [MAP_NUM_MESI[m]]
-        elif per_b == "Trimestrale":
-            t = st.selectbox("Trimestre", ["Q1 (Gen-Mar)", "Q2 (Apr-Giu)", "Q3 (Lug-Set)", "Q4 (Ott-Dic)"], key="t_bil")
-            if "Q1" in t: l_num_b = [1, 2, 3]
-            elif "Q2" in t: l_num_b = [4, 5, 6]
-            elif "Q3" in t: l_num_b = [7, 8, 9]
-            else: l_num_b = [10, 11, 12]
-            l_mesi_b = [MAP_MESI[n] for n in l_num_b]
-        elif per_b == "Semestrale":
-            s = st.selectbox("Semestre", ["Semestre 1 (Gen-Giu)", "Semestre 2 (Lug-Dic)"], key="s_bil")
-            if "1" in s: l_num_b = [1, 2, 3, 4, 5, 6]
-            else: l_num_b = [7, 8, 9, 10, 11, 12]
-            l_mesi_b = [MAP_MESI[n] for n in l_num_b]
-        elif per_b == "Annuale":
-            st.write("Tutto l'anno")
-            l_num_b = list(range(1, 13))
-            l_mesi_b = list(MAP_MESI.values())
-
-    # 3. Calcoli Dati Reali
-    reale_raw = df_analysis_b[(df_analysis_b["Anno"] == anno_b) & (df_analysis_b["MeseNum"].isin(l_num_b))]
-    if not reale_raw.empty:
-        consuntivo_b = reale_raw.groupby(["Categoria", "Tipo"])["Importo"].sum().reset_index().rename(columns={"Importo": "Reale"})
-    else:
-        consuntivo_b = pd.DataFrame(columns=["Categoria", "Tipo", "Reale"])
+        l_mesi_b = []
+        l_num_b = []
     
-    # 4. Calcoli Dati Budget
-    preventivo_b = pd.DataFrame()
-    if not df_budget_b.empty and "Mese" in df_budget_b.columns:
-        b_raw = df_budget_b[df_budget_b["Mese"].isin(l_mesi_b)]
-        if not b_raw.empty:
-            preventivo_b = b_raw.groupby(["Categoria", "Tipo"])["Importo"].sum().reset_index().rename(columns={"Importo": "Budget"})
-
-    # 5. Merge
-    bilancio = pd.merge(preventivo_b, consuntivo_b, on=["Categoria", "Tipo"], how="outer").fillna(0)
-    if "Budget" not in bilancio.columns: bilancio["Budget"] = 0.0
-    if "Reale" not in bilancio.columns: bilancio["Reale"] = 0.0
-
-    # 6. Estrazione Valori Chiave (COMPLETO)
+        with cb3:
+            if per_b == "Mensile":
+                m = st.selectbox("Mese", list(MAP_MESI.values()), index=datetime.now().month-1, key="m_bil")
+                l_mesi_b = [m]
+                l_num_b = [MAP_NUM_MESI[m]]
+            elif per_b == "Trimestrale":
+                t = st.selectbox("Trimestre", ["Q1 (Gen-Mar)", "Q2 (Apr-Giu)", "Q3 (Lug-Set)", "Q4 (Ott-Dic)"], key="t_bil")
+                if "Q1" in t: l_num_b = [1, 2, 3]
+                elif "Q2" in t: l_num_b = [4, 5, 6]
+                elif "Q3" in t: l_num_b = [7, 8, 9]
+                else: l_num_b = [10, 11, 12]
+                l_mesi_b = [MAP_MESI[n] for n in l_num_b]
+            elif per_b == "Semestrale":
+                s = st.selectbox("Semestre", ["Semestre 1 (Gen-Giu)", "Semestre 2 (Lug-Dic)"], key="s_bil")
+                if "1" in s: l_num_b = [1, 2, 3, 4, 5, 6]
+                else: l_num_b = [7, 8, 9, 10, 11, 12]
+                l_mesi_b = [MAP_MESI[n] for n in l_num_b]
+            elif per_b == "Annuale":
+                st.write("Tutto l'anno")
+                l_num_b = list(range(1, 13))
+                l_mesi_b = list(MAP_MESI.values())
+
+        # Strutture condivise dell'anno scelto (sola lettura); il riporto ha bisogno anche degli anni precedenti
+        con_riporto = st.session_state.get("riporto_anni", False)
+        interrogazioni = get_interrogazioni([anno_b])
+        indice_saldi = get_indice_saldi([a for a in lista_anni if a <= anno_b] if con_riporto else [anno_b])
+
+        # 3-5. Budget vs Reale del periodo (celle del cubo mensile e del cubo budget, senza scorrere le transazioni)
+        with span("aggregazione", "bilancio"):
+            bilancio = interrogazioni.budget_vs_reale(anno_b, l_num_b)
+            totali_b = interrogazioni.totali_periodo(bilancio)
+
+        # 6. Estrazione Valori Chiave (COMPLETO)
     
-    # --- A. SALDO INIZIALE DINAMICO ---
-    # 1. Base: Saldo Budget di Gennaio (soldi a inizio anno)
-    saldo_start_anno = 0.0
-    if not df_budget_b.empty:
-        mask_gen = (df_budget_b["Mese"] == "Gen") & (df_budget_b["Categoria"] == "SALDO INIZIALE")
-        if mask_gen.any():
-            saldo_start_anno = df_budget_b.loc[mask_gen, "Importo"].sum()
-
-    # 2. Calcolo Delta Mesi Precedenti (quanto è successo prima del mese che guardi)
-    mese_start_view = min(l_num_b)
-    delta_precedente = 0.0
-
-    if mese_start_view > 1:
-        # Filtra transazioni REALI antecedenti al mese selezionato nello stesso anno
-        mask_prev = (df_analysis_b["Anno"] == anno_b) & (df_analysis_b["MeseNum"] < mese_start_view)
-        df_prev = df_analysis_b[mask_prev]
-
-        if not df_prev.empty:
-            # Entrate Totali precedenti (escluso saldo iniziale)
-            ent_prev = df_prev[(df_prev["Tipo"] == "Entrata") & (df_prev["Categoria"] != "SALDO INIZIALE")]["Importo"].sum()
-            # Uscite Totali precedenti
-            usc_prev = df_prev[df_prev["Tipo"] == "Uscita"]["Importo"].sum()
-            delta_precedente = ent_prev - usc_prev
-
-    # 3. Saldo Iniziale Reale Definitivo
-    saldo_ini_real = saldo_start_anno + delta_precedente
-
-    # Saldo Iniziale Budget (resta la somma del periodo selezionato)
-    saldo_ini_row = bilancio[bilancio["Categoria"] == "SALDO INIZIALE"]
-    saldo_ini_bud = saldo_ini_row["Budget"].sum()
-
-    # --- B. ENTRATE E USCITE OPERATIVE (Periodo Corrente) ---
-    # (Queste righe mancavano prima e causavano l'errore)
-    ent_op_df = bilancio[(bilancio["Tipo"]=="Entrata") & (bilancio["Categoria"]!="SALDO INIZIALE")]
-    ent_op_bud = ent_op_df["Budget"].sum()
-    ent_op_real = ent_op_df["Reale"].sum()
-
-    usc_op_df = bilancio[bilancio["Tipo"]=="Uscita"]
-    usc_op_bud = usc_op_df["Budget"].sum()
-    usc_op_real = usc_op_df["Reale"].sum()
-
-    # --- C. UTILE E SALDO FINALE ---
-    utile_bud = ent_op_bud - usc_op_bud
-    utile_real = ent_op_real - usc_op_real
-
-    saldo_fin_bud = saldo_ini_bud + utile_bud
-    saldo_fin_real = saldo_ini_real + utile_real
-    # ==========================================================================
-    # LOGICA PRIVACY MODE (Inserita qui, dopo i calcoli)
-    # ==========================================================================
-    if "nascondi_saldi" not in st.session_state:
-        st.session_state["nascondi_saldi"] = False
-
-    st.write("") # Spaziatura
-    col_priv, _ = st.columns([2, 8])
-    with col_priv:
-        icona = "🫣" if st.session_state["nascondi_saldi"] else "👁️"
-        label = "Mostra Dati" if st.session_state["nascondi_saldi"] else "Nascondi Dati"
+        # --- A. SALDO INIZIALE DINAMICO ---
+        # 1. Base: Saldo Budget di Gennaio (soldi a inizio anno)
+        saldo_start_anno = saldo_iniziale_budget(df_budget_b)
+
+        # 2. Delta Mesi Precedenti (entrate escluso saldo iniziale - uscite): lookup sulle somme prefisse
+        # Con il riporto, il saldo di Gennaio vale per il primo anno e gli anni successivi
+        # partono dalla chiusura dell'anno precedente.
+        mese_start_view = min(l_num_b)
+
+        # 3. Saldo Iniziale Reale Definitivo
+        saldo_ini_real = indice_saldi.saldo_apertura(anno_b, mese_start_view, saldo_start_anno, con_riporto)
+
+        # Saldo Iniziale Budget (resta la somma del periodo selezionato)
+        saldo_ini_bud = totali_b["saldo_iniziale_budget"]
+
+        # --- B. ENTRATE E USCITE OPERATIVE (Periodo Corrente) ---
+        ent_op_bud, ent_op_real = totali_b["entrate_budget"], totali_b["entrate_reale"]
+        usc_op_bud, usc_op_real = totali_b["uscite_budget"], totali_b["uscite_reale"]
+
+        # --- C. UTILE E SALDO FINALE ---
+        utile_bud = ent_op_bud - usc_op_bud
+        utile_real = ent_op_real - usc_op_real
+
+        saldo_fin_bud = saldo_ini_bud + utile_bud
+        saldo_fin_real = saldo_ini_real + utile_real
+        # ==========================================================================
+        # LOGICA PRIVACY MODE (Inserita qui, dopo i calcoli)
+        # ==========================================================================
+        if "nascondi_saldi" not in st.session_state:
+            st.session_state["nascondi_saldi"] = False
+
+        st.write("") # Spaziatura
+        col_priv, _ = st.columns([2, 8])
+        with col_priv:
+            icona = "🫣" if st.session_state["nascondi_saldi"] else "👁️"
+            label = "Mostra Dati" if st.session_state["nascondi_saldi"] else "Nascondi Dati"
         
-        if st.button(f"{icona} {label}", key="btn_privacy_tab1"):
-            st.session_state["nascondi_saldi"] = not st.session_state["nascondi_saldi"]
-
-    def fmt_priv(valore):
-        if st.session_state["nascondi_saldi"]:
-            return "**** €"
-        return f"{valore:,.2f} €"
-    # ==========================================================================
-
-    # 7. Display Metriche
-    st.divider()
-    m1, m2, m3, m4 = st.columns(4)
+            if st.button(f"{icona} {label}", key="btn_privacy_tab1"):
+                st.session_state["nascondi_saldi"] = not st.session_state["nascondi_saldi"]
+            st.checkbox("🔁 Riporta saldi anni precedenti", key="riporto_anni",
+                        help="Il saldo iniziale di un anno diventa la chiusura reale dell'anno precedente")
+
+        def fmt_priv(valore):
+            if st.session_state["nascondi_saldi"]:
+                return "**** €"
+            return f"{valore:,.2f} €"
+        # ==========================================================================
+
+        # 7. Display Metriche
+        st.divider()
+        m1, m2, m3, m4 = st.columns(4)
     
-    m1.metric("💰 Saldo Iniziale", 
-              fmt_priv(saldo_ini_real), 
-              delta=None if st.session_state["nascondi_saldi"] else f"Budget: {saldo_ini_bud:,.2f} €")
+        m1.metric("💰 Saldo Iniziale", 
+                  fmt_priv(saldo_ini_real), 
+                  delta=None if st.session_state["nascondi_saldi"] else f"Budget: {saldo_ini_bud:,.2f} €")
               
-    m2.metric("📈 Entrate Operative", 
-              fmt_priv(ent_op_real), 
-              delta=None if st.session_state["nascondi_saldi"] else f"{(ent_op_real-ent_op_bud):,.2f} € vs Budget")
+        m2.metric("📈 Entrate Operative", 
+                  fmt_priv(ent_op_real), 
+                  delta=None if st.session_state["nascondi_saldi"] else f"{(ent_op_real-ent_op_bud):,.2f} € vs Budget")
               
-    m3.metric("📉 Uscite Totali", 
-              fmt_priv(usc_op_real), 
-              delta=None if st.session_state["nascondi_saldi"] else f"{(usc_op_real-usc_op_bud):,.2f} € vs Budget", 
-              delta_color="inverse")
+        m3.metric("📉 Uscite Totali", 
+                  fmt_priv(usc_op_real), 
+                  delta=None if st.session_state["nascondi_saldi"] else f"{(usc_op_real-usc_op_bud):,.2f} € vs Budget", 
+                  delta_color="inverse")
               
-    m4.metric("🏁 Saldo Finale", 
-              fmt_priv(saldo_fin_real), 
-              delta=None if st.session_state["nascondi_saldi"] else f"Utile: {utile_real:,.2f} €")
+        m4.metric("🏁 Saldo Finale", 
+                  fmt_priv(saldo_fin_real), 
+                  delta=None if st.session_state["nascondi_saldi"] else f"Utile: {utile_real:,.2f} €")
 
-    # 8. Schemini Dettaglio
-    st.divider()
-    col_schemino_sx, col_schemino_dx = st.columns(2)
+        # 8. Schemini Dettaglio
+        st.divider()
+        col_schemino_sx, col_schemino_dx = st.columns(2)
     
-    # Schemino Entrate
-    with col_schemino_sx:
-        st.subheader("🟢 Dettaglio Entrate")
-        df_e_view = ent_op_df[["Categoria", "Budget", "Reale"]].copy()
-        df_e_view["Delta"] = df_e_view["Reale"] - df_e_view["Budget"]
-        st.dataframe(
-            df_e_view.sort_values("Reale", ascending=False)
-            .style.format("{:.2f} €", subset=["Budget", "Reale", "Delta"])
-            .map(lambda v: style_delta_standard(v), subset=["Delta"]), 
-            use_container_width=True
-        )
-        st.info(f"**Totale Entrate Operative:** {ent_op_real:,.2f} € (Budget: {ent_op_bud:,.2f} €)")
+        # Schemino Entrate
+        with col_schemino_sx:
+            st.subheader("🟢 Dettaglio Entrate")
+            df_e_view = interrogazioni.ripartizione(bilancio, "Entrata", escludi=[CATEGORIA_SALDO])[["Categoria", "Budget", "Reale", "Delta"]]
+            st.dataframe(
+                df_e_view.sort_values("Reale", ascending=False)
+                .style.format("{:.2f} €", subset=["Budget", "Reale", "Delta"])
+                .map(lambda v: style_delta_standard(v), subset=["Delta"]), 
+                use_container_width=True
+            )
+            st.info(f"**Totale Entrate Operative:** {ent_op_real:,.2f} € (Budget: {ent_op_bud:,.2f} €)")
 
-    # Schemino Uscite
-    with col_schemino_dx:
-        st.subheader("🔴 Dettaglio Uscite")
-        df_u_view = usc_op_df[["Categoria", "Budget", "Reale"]].copy()
-        df_u_view["Risparmio"] = df_u_view["Budget"] - df_u_view["Reale"]
-        st.dataframe(
-            df_u_view.sort_values("Reale", ascending=False)
-            .style.format("{:.2f} €", subset=["Budget", "Reale", "Risparmio"])
-            .map(lambda v: style_delta_spese(v), subset=["Risparmio"]), 
-            use_container_width=True
-        )
-        st.info(f"**Totale Uscite:** {usc_op_real:,.2f} € (Budget: {usc_op_bud:,.2f} €)")
+        # Schemino Uscite
+        with col_schemino_dx:
+            st.subheader("🔴 Dettaglio Uscite")
+            df_u_view = interrogazioni.ripartizione(bilancio, "Uscita")[["Categoria", "Budget", "Reale", "Risparmio"]]
+            st.dataframe(
+                df_u_view.sort_values("Reale", ascending=False)
+                .style.format("{:.2f} €", subset=["Budget", "Reale", "Risparmio"])
+                .map(lambda v: style_delta_spese(v), subset=["Risparmio"]), 
+                use_container_width=True
+            )
+            st.info(f"**Totale Uscite:** {usc_op_real:,.2f} € (Budget: {usc_op_bud:,.2f} €)")
 
-    st.markdown("---")
+        st.markdown("---")
     
-    # 9. Utile Finale
-    col_utile_real, col_utile_bud = st.columns(2)
+        # 9. Utile Finale
+        col_utile_real, col_utile_bud = st.columns(2)
     
-    if utile_real >= 0: colore_utile = "green"
-    else: colore_utile = "red"
+        if utile_real >= 0: colore_utile = "green"
+        else: colore_utile = "red"
         
-    if utile_bud >= 0: colore_utile_bud = "green"
-    else: colore_utile_bud = "red"
+        if utile_bud >= 0: colore_utile_bud = "green"
+        else: colore_utile_bud = "red"
     
-    # Applichiamo la privacy anche qui
-    txt_utile_real = "**** €" if st.session_state["nascondi_saldi"] else f"{utile_real:+,.2f} €"
-    txt_utile_bud = "**** €" if st.session_state["nascondi_saldi"] else f"{utile_bud:+,.2f} €"
-    
-    with col_utile_real:
-        st.markdown(f"### 💡 Utile REALE: :{colore_utile}[{txt_utile_real}]")
-    with col_utile_bud:
-        st.markdown(f"### 📋 Utile BUDGET: :{colore_utile_bud}[{txt_utile_bud}]")
-# ==============================================================================
-# TAB 2: INDICI & KPI
-# ==============================================================================
-with tab_kpi:
-    st.markdown("### 🚀 Cruscotto Indici Finanziari")
+        # Applichiamo la privacy anche qui
+        txt_utile_real = "**** €" if st.session_state["nascondi_saldi"] else f"{utile_real:+,.2f} €"
+        txt_utile_bud = "**** €" if st.session_state["nascondi_saldi"] else f"{utile_bud:+,.2f} €"
     
-    col_target, col_legenda = st.columns([1, 3])
-    with col_target:
-        target_patrimoniale = st.number_input("🎯 Obiettivo Annuale (€)", value=10000.0, step=500.0)
-    with col_legenda:
-        with st.expander("ℹ️ Spiegazione Indici (Legenda)"):
-            st.markdown("""
-            * **ROE (Rendimento):** Quanto rendono le tue risorse totali.
-            * **IER (Efficienza Risparmio):** Percentuale delle entrate che diventa risparmio.
-            * **Growth (Crescita):** Di quanto è cresciuto il patrimonio rispetto all'inizio anno.
-            * **IAT (Avanzamento Target):** Percentuale di completamento dell'obiettivo annuale.
-            * **IPP (Performance):** Indice combinato di progresso ed efficienza.
-            """)
-
-    st.markdown("---")
+        with col_utile_real:
+            st.markdown(f"### 💡 Utile REALE: :{colore_utile}[{txt_utile_real}]")
+        with col_utile_bud:
+            st.markdown(f"### 📋 Utile BUDGET: :{colore_utile_bud}[{txt_utile_bud}]")
+    # ==============================================================================
+    # TAB 2: INDICI & KPI
+    # ==============================================================================
+    if vista == VISTA_KPI:
+        st.markdown("### 🚀 Cruscotto Indici Finanziari")
     
-    # Filtri per KPI
-    ck1, ck2 = st.columns(2)
-    with ck1:
-        lista_anni_k = sorted(df_cloud["Anno"].unique(), reverse=True)
-        if not lista_anni_k: lista_anni_k = [2026]
-        anno_k = st.selectbox("📅 Anno KPI", lista_anni_k, key="a_kpi")
-    with ck2:
-        per_k = st.selectbox("📊 Periodo KPI", ["Mensile", "Trimestrale", "Semestrale", "Annuale"], key="p_kpi")
-    
-    # Logica Filtro Mesi
-    l_mesi_k = []
-    l_num_k = []
-    if per_k == "Mensile":
-        m = datetime.now().month
-        l_num_k = [m]
-    elif per_k == "Trimestrale":
-        mese_corr = datetime.now().month
-        if mese_corr <= 3: l_num_k = [1,2,3]
-        elif mese_corr <= 6: l_num_k = [4,5,6]
-        elif mese_corr <= 9: l_num_k = [7,8,9]
-        else: l_num_k = [10,11,12]
-    elif per_k == "Semestrale":
-        mese_corr = datetime.now().month
-        if mese_corr <= 6: l_num_k = list(range(1,7))
-        else: l_num_k = list(range(7,13))
-    elif per_k == "Annuale":
-        l_num_k = list(range(1, 13))
-    else:
-        l_num_k = list(range(1, 13))
-
-    # --- CALCOLO DATI ---
-    
-    # 1. Dati Periodo Selezionato
-    df_kpi_per = df_cloud[(df_cloud["Anno"] == anno_k) & (df_cloud["MeseNum"].isin(l_num_k))]
-    
-    # 2. Dati Intero Anno (per Target)
-    df_kpi_anno = df_cloud[df_cloud["Anno"] == anno_k]
-    
-    # 3. Saldo Iniziale (Gennaio)
-    bud_g = get_budget_data()
-    saldo_ini_anno = 0.0
-    if not bud_g.empty:
-        # Cerca saldo iniziale di Gennaio
-        mask_saldo = (bud_g["Mese"]=="Gen") & (bud_g["Categoria"]=="SALDO INIZIALE")
-        if mask_saldo.any():
-            saldo_ini_anno = bud_g[mask_saldo]["Importo"].sum()
-    
-    # 4. Totali Annuali
-    ent_tot_anno = df_kpi_anno[(df_kpi_anno["Tipo"]=="Entrata") & (df_kpi_anno["Categoria"]!="SALDO INIZIALE")]["Importo"].sum()
-    usc_tot_anno = df_kpi_anno[df_kpi_anno["Tipo"]=="Uscita"]["Importo"].sum()
-    utile_anno = ent_tot_anno - usc_tot_anno
-    saldo_fin_anno = saldo_ini_anno + utile_anno
-    risorse_disp_anno = saldo_ini_anno + ent_tot_anno
-
-    # 5. Totali Periodo
-    ent_periodo = df_kpi_per[(df_kpi_per["Tipo"]=="Entrata") & (df_kpi_per["Categoria"]!="SALDO INIZIALE")]["Importo"].sum()
-    usc_periodo = df_kpi_per[df_kpi_per["Tipo"]=="Uscita"]["Importo"].sum()
-    utile_periodo = ent_periodo - usc_periodo
-
-    # --- FORMULE KPI (ESTESE) ---
-    
-    # ROE
-    if risorse_disp_anno > 0:
-        roe = ((saldo_fin_anno - saldo_ini_anno) / risorse_disp_anno * 100)
-    else:
-        roe = 0
-    
-    # IER (Annuale)
-    if ent_tot_anno > 0:
-        ier = (utile_anno / ent_tot_anno * 100)
-    else:
-        ier = 0
-    
-    # Growth
-    if saldo_ini_anno > 0:
-        growth = ((saldo_fin_anno - saldo_ini_anno) / saldo_ini_anno * 100)
-    else:
-        growth = 0
-    
-    # IAT
-    delta_target = target_patrimoniale - saldo_ini_anno
-    if delta_target > 0:
-        iat = ((saldo_fin_anno - saldo_ini_anno) / delta_target * 100)
-    else:
-        iat = 0
-    
-    # IAT Lineare
-    iat_lineare = (datetime.now().month / 12) * 100
-
-    # IER Periodo
-    if ent_periodo > 0:
-        ier_periodo = (utile_periodo / ent_periodo * 100)
-    else:
-        ier_periodo = 0
-
-    # IER Giornaliero
-    if risorse_disp_anno > 0:
-        ier_giornaliero = (saldo_fin_anno / risorse_disp_anno * 100)
-    else:
-        ier_giornaliero = 0
-
-    # IPP
-    if delta_target > 0:
-        term_iat = (saldo_fin_anno - saldo_ini_anno) / delta_target
-    else:
-        term_iat = 0
-        
-    if risorse_disp_anno > 0:
-        term_eff = saldo_fin_anno / risorse_disp_anno
-    else:
-        term_eff = 0
-        
-    ipp = term_iat * term_eff * 100
-
-    # Burn Rate
-    giorni_periodo = 30 * len(l_num_k)
-    if giorni_periodo > 0:
-        burn_rate = usc_periodo / giorni_periodo
-    else:
-        burn_rate = 0
-
-    # --- VISUALIZZAZIONE KPI ---
-    st.markdown("##### 📌 KPI Annuali (Macro)")
-    k1, k2, k3, k4 = st.columns(4)
-    k1.metric("ROE (Rendimento)", f"{roe:.2f}%")
-    k2.metric("Growth (Crescita)", f"{growth:.2f}%")
-    k3.metric("IER (Annuale)", f"{ier:.2f}%")
-    k4.metric("IAT (Target)", f"{iat:.2f}%", delta=f"{iat-iat_lineare:.1f}% vs Lineare")
+        col_target, col_legenda = st.columns([1, 3])
+        with col_target:
+            target_patrimoniale = st.number_input("🎯 Obiettivo Annuale (€)", value=10000.0, step=500.0)
+        with col_legenda:
+            with st.expander("ℹ️ Spiegazione Indici (Legenda)"):
+                st.markdown("""
+                * **ROE (Rendimento):** Quanto rendono le tue risorse totali.
+                * **IER (Efficienza Risparmio):** Percentuale delle entrate che diventa risparmio.
+                * **Growth (Crescita):** Di quanto è cresciuto il patrimonio rispetto all'inizio anno.
+                * **IAT (Avanzamento Target):** Percentuale di completamento dell'obiettivo annuale.
+                * **IPP (Performance):** Indice combinato di progresso ed efficienza.
+                """)
+
+        st.markdown("---")
     
-    st.markdown("##### ⚡ KPI Operativi (Periodo Selezionato)")
-    ka1, ka2, ka3, ka4 = st.columns(4)
-    ka1.metric("IER Periodo", f"{ier_periodo:.1f}%")
-    ka2.metric("Burn Rate", f"{burn_rate:.2f} €/gg")
-    ka3.metric("IER Giornaliero", f"{ier_giornaliero:.2f}%")
-    ka4.metric("IPP (Score)", f"{ipp:.2f}")
-
-    st.divider()
+        # Filtri per KPI
+        ck1, ck2 = st.columns(2)
+        with ck1:
+            lista_anni_k = get_anni()
+            if not lista_anni_k: lista_anni_k = [2026]
+            anno_k = st.selectbox("📅 Anno KPI", lista_anni_k, key="a_kpi")
+        with ck2:
+            per_k = st.selectbox("📊 Periodo KPI", ["Mensile", "Trimestrale", "Semestrale", "Annuale"], key="p_kpi")
     
-    # Grafici Gauge
-    gc1, gc2 = st.columns(2)
-    with gc1:
-        st.plotly_chart(crea_tachimetro(ier, "Efficienza Risparmio (IER)", max_v=50, soglia_ok=20), use_container_width=True)
-    with gc2:
-        st.plotly_chart(crea_tachimetro(iat, "Avanzamento Obiettivo (IAT)", max_v=100, soglia_ok=iat_lineare), use_container_width=True)
+        # --- CALCOLO DATI ---
+        # Tutti i KPI dell'anno e dei suoi periodi in un solo passaggio: cambiare periodo è
+        # solo una selezione di riga. Il periodo è quello che contiene il mese corrente.
+        _, df_kpi = get_vista([anno_k])
+        df_budget_k, indice_saldi_k = get_budget_data(), get_indice_saldi([anno_k])
+        with span("aggregazione", "tabella KPI"):
+            tab_kpi_df = tabella_kpi(df_kpi, df_budget_k, target_patrimoniale, indice=indice_saldi_k)
+        periodo_k = periodo_del_mese(per_k, datetime.now().month)
+        l_num_k = mesi_del_periodo(per_k, periodo_k)
+        righe_k = tab_kpi_df[(tab_kpi_df["Anno"] == anno_k) & (tab_kpi_df["Granularita"] == per_k)]
+        riga_k = righe_k[righe_k["Periodo"] == periodo_k]
+        kpi = riga_k.iloc[0] if not riga_k.empty else pd.Series(0.0, index=tab_kpi_df.columns)
+
+        roe, growth, ier, iat = kpi["ROE"], kpi["Growth"], kpi["IER"], kpi["IAT"]
+        ier_periodo, ier_giornaliero, ipp, burn_rate = kpi["IER Periodo"], kpi["IER Giornaliero"], kpi["IPP"], kpi["Burn Rate"]
+
+        # IAT Lineare
+        iat_lineare = (datetime.now().month / 12) * 100
+
+        # --- VISUALIZZAZIONE KPI ---
+        st.markdown("##### 📌 KPI Annuali (Macro)")
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("ROE (Rendimento)", f"{roe:.2f}%")
+        k2.metric("Growth (Crescita)", f"{growth:.2f}%")
+        k3.metric("IER (Annuale)", f"{ier:.2f}%")
+        k4.metric("IAT (Target)", f"{iat:.2f}%", delta=f"{iat-iat_lineare:.1f}% vs Lineare")
     
-    st.info(f"💡 **IAT Lineare atteso:** {iat_lineare:.1f}% (Siamo al mese {datetime.now().month})")
-
-    # Grafico Andamento Saldo
-    st.markdown("### 📈 Andamento Saldo nel Periodo")
-    if not df_kpi_per.empty:
-        daily_io = df_kpi_per.groupby(["Data", "Tipo"])["Importo"].sum().unstack().fillna(0)
-        
-        if "Entrata" not in daily_io.columns:
-            daily_io["Entrata"] = 0
-        if "Uscita" not in daily_io.columns:
-            daily_io["Uscita"] = 0
-            
-        daily_io["Netto"] = daily_io["Entrata"] - daily_io["Uscita"]
-        daily_io["Saldo Cumulativo"] = daily_io["Netto"].cumsum()
-        
-        fig_trend = px.area(daily_io, y="Saldo Cumulativo", title="Evoluzione Saldo (Netto) nel Periodo")
-        st.plotly_chart(fig_trend, use_container_width=True)
-    else:
-        st.info("Nessun dato per il grafico temporale nel periodo selezionato.")
-
-# ==============================================================================
-# TAB 3: ANALISI GRAFICA AVANZATA
-# ==============================================================================
-with tab_graf:
-    df_budget_g = get_budget_data()
+        st.markdown("##### ⚡ KPI Operativi (Periodo Selezionato)")
+        ka1, ka2, ka3, ka4 = st.columns(4)
+        ka1.metric("IER Periodo", f"{ier_periodo:.1f}%")
+        ka2.metric("Burn Rate", f"{burn_rate:.2f} €/gg")
+        ka3.metric("IER Giornaliero", f"{ier_giornaliero:.2f}%")
+        ka4.metric("IPP (Score)", f"{ipp:.2f}")
+
+        st.divider()
     
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        lista_anni_g = sorted(df_cloud["Anno"].unique(), reverse=True)
-        if not lista_anni_g: lista_anni_g = [2026]
-        anno_g = st.selectbox("📅 Anno", lista_anni_g, key="a_graf")
-    with c2:
-        per_g = st.selectbox("📊 Periodo", ["Mensile", "Trimestrale", "Semestrale", "Annuale"], key="p_graf")
+        # Grafici Gauge
+        gc1, gc2 = st.columns(2)
+        with gc1:
+            st.plotly_chart(cache_grafici.figura(crea_tachimetro, ier, "Efficienza Risparmio (IER)", max_v=50, soglia_ok=20), use_container_width=True)
+        with gc2:
+            st.plotly_chart(cache_grafici.figura(crea_tachimetro, iat, "Avanzamento Obiettivo (IAT)", max_v=100, soglia_ok=iat_lineare), use_container_width=True)
     
-    l_mesi_g = []
-    l_num_g = []
-    with c3:
-        if per_g == "Mensile":
-            m = st.selectbox("Mese", list(MAP_MESI.values()), index=datetime.now().month-1, key="m_graf")
-            l_mesi_g = [m]
-            l_num_g = [MAP_NUM_MESI[m]]
-        elif per_g == "Trimestrale":
-            t = st.selectbox("Trimestre", ["Q1 (Gen-Mar)", "Q2 (Apr-Giu)", "Q3 (Lug-Set)", "Q4 (Ott-Dic)"], key="t_graf")
-            if "Q1" in t: l_num_g = [1, 2, 3]
-            elif "Q2" in t: l_num_g = [4, 5, 6]
-            elif "Q3" in t: l_num_g = [7, 8, 9]
-            else: l_num_g = [10, 11, 12]
-            l_mesi_g = [MAP_MESI[n] for n in l_num_g]
-        elif per_g == "Semestrale":
-            s = st.selectbox("Semestre", ["Semestre 1 (Gen-Giu)", "Semestre 2 (Lug-Dic)"], key="s_graf")
-            if "1" in s: l_num_g = [1, 2, 3, 4, 5, 6]
-            else: l_num_g = [7, 8, 9, 10, 11, 12]
-            l_mesi_g = [MAP_MESI[n] for n in l_num_g]
-        elif per_g == "Annuale":
-            st.write("Tutto l'anno")
-            l_num_g = list(range(1, 13))
-            l_mesi_g = list(MAP_MESI.values())
-
-    df_filt_g = df_cloud[(df_cloud["Anno"] == anno_g) & (df_cloud["MeseNum"].isin(l_num_g))]
-    
-    if not df_filt_g.empty:
-        cons_g = df_filt_g.groupby(["Categoria", "Tipo"])["Importo"].sum().reset_index().rename(columns={"Importo": "Reale"})
-    else:
-        cons_g = pd.DataFrame(columns=["Categoria", "Tipo", "Reale"])
+        st.info(f"💡 **IAT Lineare atteso:** {iat_lineare:.1f}% (Siamo al mese {datetime.now().month})")
+
+        # Andamento dei KPI di periodo nell'anno (già calcolati nella tabella)
+        if per_k != "Annuale" and not righe_k.empty:
+            fig_kpi = cache_grafici.figura(px.line, righe_k, x="Periodo", y=["IER Periodo", "Burn Rate"], markers=True,
+                                            title=f"Andamento KPI {per_k.lower()} {anno_k}")
+            st.plotly_chart(fig_kpi, use_container_width=True)
+
+        # Grafico Andamento Saldo
+        st.markdown("### 📈 Andamento Saldo nel Periodo")
+        # Il grafico giornaliero ha bisogno delle singole transazioni del periodo
+        with span("aggregazione", "andamento giornaliero"):
+            daily_io = get_interrogazioni([anno_k]).andamento_giornaliero(anno_k, l_num_k)
+        if not daily_io.empty:
+            fig_trend = cache_grafici.figura(px.area, daily_io, y="Saldo Cumulativo", title="Evoluzione Saldo (Netto) nel Periodo")
+            st.plotly_chart(fig_trend, use_container_width=True)
+        else:
+            st.info("Nessun dato per il grafico temporale nel periodo selezionato.")
+
+    # ==============================================================================
+    # TAB 3: ANALISI GRAFICA AVANZATA
+    # ==============================================================================
+    if vista == VISTA_GRAF:
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            lista_anni_g = get_anni()
+            if not lista_anni_g: lista_anni_g = [2026]
+            anno_g = st.selectbox("📅 Anno", lista_anni_g, key="a_graf")
+        with c2:
+            per_g = st.selectbox("📊 Periodo", ["Mensile", "Trimestrale", "Semestrale", "Annuale"], key="p_graf")
     
-    prev_g = pd.DataFrame()
-    if not df_budget_g.empty and "Mese" in df_budget_g.columns:
-        b_filt_g = df_budget_g[df_budget_g["Mese"].isin(l_mesi_g)]
-        if not b_filt_g.empty:
-            prev_g = b_filt_g.groupby(["Categoria", "Tipo"])["Importo"].sum().reset_index().rename(columns={"Importo": "Budget"})
-
-    # Filtro Saldo Iniziale
-    if not prev_g.empty:
-        prev_g = prev_g[prev_g["Categoria"] != "SALDO INIZIALE"]
-    if not cons_g.empty:
-        cons_g = cons_g[cons_g["Categoria"] != "SALDO INIZIALE"]
-
-    merged_g = pd.merge(prev_g, cons_g, on=["Categoria", "Tipo"], how="left").fillna(0) if not prev_g.empty else cons_g.copy()
-    if "Budget" not in merged_g.columns: merged_g["Budget"] = 0.0
+        l_mesi_g = []
+        l_num_g = []
+        with c3:
+            if per_g == "Mensile":
+                m = st.selectbox("Mese", list(MAP_MESI.values()), index=datetime.now().month-1, key="m_graf")
+                l_mesi_g = [m]
+                l_num_g = [MAP_NUM_MESI[m]]
+            elif per_g == "Trimestrale":
+                t = st.selectbox("Trimestre", ["Q1 (Gen-Mar)", "Q2 (Apr-Giu)", "Q3 (Lug-Set)", "Q4 (Ott-Dic)"], key="t_graf")
+                if "Q1" in t: l_num_g = [1, 2, 3]
+                elif "Q2" in t: l_num_g = [4, 5, 6]
+                elif "Q3" in t: l_num_g = [7, 8, 9]
+                else: l_num_g = [10, 11, 12]
+                l_mesi_g = [MAP_MESI[n] for n in l_num_g]
+            elif per_g == "Semestrale":
+                s = st.selectbox("Semestre", ["Semestre 1 (Gen-Giu)", "Semestre 2 (Lug-Dic)"], key="s_graf")
+                if "1" in s: l_num_g = [1, 2, 3, 4, 5, 6]
+                else: l_num_g = [7, 8, 9, 10, 11, 12]
+                l_mesi_g = [MAP_MESI[n] for n in l_num_g]
+            elif per_g == "Annuale":
+                st.write("Tutto l'anno")
+                l_num_g = list(range(1, 13))
+                l_mesi_g = list(MAP_MESI.values())
+
+        # Categorie a budget (senza SALDO INIZIALE); senza budget nel periodo, quelle reali
+        with span("aggregazione", "budget vs reale"):
+            merged_g = get_interrogazioni([anno_g]).budget_vs_reale(anno_g, l_num_g, unione="left", escludi=[CATEGORIA_SALDO])
+            # Delta Generico (Budget - Reale), mostrato anche nella tabella delle uscite
+            merged_g["Delta"] = merged_g["Budget"] - merged_g["Reale"]
+
+        st.markdown("#### 🎨 Configurazione")
+        cg1, cg2 = st.columns(2)
+        with cg1: source_data = st.radio("Sorgente:", ["Reale", "Budget"], horizontal=True)
+        with cg2: chart_type = st.selectbox("Grafico:", ["Torta (Donut)", "Barre Orizzontali", "Treemap (Mappa)"])
+        col_val = "Reale" if "Reale" in source_data else "Budget"
+
+        cl, cr = st.columns(2)
     
-    # Delta Generico (Solo per calcoli interni)
-    merged_g["Delta"] = merged_g["Budget"] - merged_g["Reale"]
-
-    st.markdown("#### 🎨 Configurazione")
-    cg1, cg2 = st.columns(2)
-    with cg1: source_data = st.radio("Sorgente:", ["Reale", "Budget"], horizontal=True)
-    with cg2: chart_type = st.selectbox("Grafico:", ["Torta (Donut)", "Barre Orizzontali", "Treemap (Mappa)"])
-    col_val = "Reale" if "Reale" in source_data else "Budget"
-
-    cl, cr = st.columns(2)
+        # Sezione Uscite
+        out_g = Interrogazioni.ripartizione(merged_g, "Uscita")
+
+        with cl:
+            st.markdown(f"### 🔴 Uscite ({col_val})")
+            if not out_g.empty:
+                fig = cache_grafici.figura(genera_grafico_avanzato, out_g, chart_type, col_val, "Categoria", "Uscite", px.colors.sequential.RdBu)
+                if fig: st.plotly_chart(fig, use_container_width=True)
+                # Applicazione stile corretto per le Spese (Risparmio = Verde)
+                st.dataframe(
+                    out_g.sort_values("Budget", ascending=False)
+                    .style.format("{:.2f} €", subset=["Budget", "Reale", "Risparmio"])
+                    .map(lambda v: style_delta_spese(v), subset=["Risparmio"]),
+                    use_container_width=True
+                )
     
-    # Sezione Uscite
-    out_g = merged_g[merged_g["Tipo"]=="Uscita"].copy()
-    # Calcolo Risparmio (Budget - Reale)
-    out_g["Risparmio"] = out_g["Budget"] - out_g["Reale"]
-
-    with cl:
-        st.markdown(f"### 🔴 Uscite ({col_val})")
-        if not out_g.empty:
-            fig = genera_grafico_avanzato(out_g, chart_type, col_val, "Categoria", "Uscite", px.colors.sequential.RdBu)
-            if fig: st.plotly_chart(fig, use_container_width=True)
-            # Applicazione stile corretto per le Spese (Risparmio = Verde)
-            st.dataframe(
-                out_g.sort_values("Budget", ascending=False)
-                .style.format("{:.2f} €", subset=["Budget", "Reale", "Risparmio"])
-                .map(lambda v: style_delta_spese(v), subset=["Risparmio"]),
-                use_container_width=True
+        # Sezione Entrate
+        inc_g = Interrogazioni.ripartizione(merged_g, "Entrata")
+
+        with cr:
+            st.markdown(f"### 🟢 Entrate ({col_val})")
+            if not inc_g.empty:
+                fig = cache_grafici.figura(genera_grafico_avanzato, inc_g, chart_type, col_val, "Categoria", "Entrate", px.colors.sequential.Teal)
+                if fig: st.plotly_chart(fig, use_container_width=True)
+                # Applicazione stile standard (Positivo = Verde)
+                st.dataframe(
+                    inc_g.sort_values("Reale", ascending=False)
+                    .style.format("{:.2f} €", subset=["Budget", "Reale", "Delta"])
+                    .map(lambda v: style_delta_standard(v), subset=["Delta"]),
+                    use_container_width=True
+                )
+
+    # ==============================================================================
+    # TAB 4: IMPORTA (CON FORM E APPRENDIMENTO)
+    # ==============================================================================
+    if vista == VISTA_IMP:
+        # Con il lettore in background le mail arrivano già analizzate nella coda locale
+        lavoratore = get_lavoratore_mail()
+        coda_mail = get_coda_mail() if lavoratore else None
+        col_search, col_actions = st.columns([1, 4])
+        with col_actions:
+            resync_completo = st.checkbox("🔁 Rileggi ultime 50 mail", help="Ignora l'ultima sincronizzazione e riscarica le mail recenti")
+        with col_search:
+            if st.button("🔎 Cerca Mail", type="primary"):
+                with st.spinner("Analisi mail in corso..."):
+                    if lavoratore:
+                        # Stesso ciclo del thread (aspetta quello in corso), il risultato va in coda
+                        try:
+                            st.session_state["stat_sync"] = lavoratore.ciclo(completo=resync_completo)
+                        except Exception as e:
+                            st.error(f"Errore lettura mail: {e}")
+                    else:
+                        df_mail, df_scartate, stat_sync, ripresa = scarica_spese_da_gmail(completo=resync_completo)
+                        st.session_state["stat_sync"] = stat_sync
+                        # Il punto di ripresa avanza subito solo se non ci sono transazioni da salvare,
+                        # altrimenti dopo "SALVA TUTTO" (fino ad allora "Cerca Mail" le rilegge)
+                        if ripresa is not None:
+                            if df_mail.empty:
+                                StatoSync().salva(*ripresa)
+                            else:
+                                st.session_state["ripresa_mail"] = ripresa
+                        # Sync incrementale: le nuove mail si aggiungono a quelle non ancora salvate
+                        if not df_mail.empty:
+                            df_mail = pd.concat([st.session_state["df_mail_found"], df_mail], ignore_index=True)
+                            st.session_state["df_mail_found"] = df_mail.drop_duplicates(subset=["Firma"], keep="last")
+                        if not df_scartate.empty:
+                            st.session_state["df_mail_discarded"] = pd.concat([st.session_state["df_mail_discarded"], df_scartate], ignore_index=True)
+
+        if lavoratore:
+            st.session_state["df_mail_found"] = coda_mail.pronte()
+            st.session_state["df_mail_discarded"] = coda_mail.scartate()
+            m = lavoratore.metriche()
+            ultima = f"{m['dall_ultimo_ciclo_s'] / 60:.0f} min fa" if m["dall_ultimo_ciclo_s"] is not None else "in corso"
+            ritardo = f"{m['ritardo_s'] / 60:.0f} min" if m["ritardo_s"] is not None else "-"
+            st.caption(
+                f"⚙️ Lettura in background ogni {lavoratore.intervallo} s · ultima {ultima} · "
+                f"{m['in_attesa']} pronte · ritardo mail → coda {ritardo} · "
+                f"{m['mail_al_secondo']:.1f} mail/s · {m['errori']} errori"
             )
+            if m["ultimo_errore"]:
+                st.caption(f"⚠️ Ultimo errore: {m['ultimo_errore']}")
     
-    # Sezione Entrate
-    inc_g = merged_g[merged_g["Tipo"]=="Entrata"].copy()
-    # Calcolo Delta Entrate (Reale - Budget)
-    inc_g["Delta"] = inc_g["Reale"] - inc_g["Budget"]
-
-    with cr:
-        st.markdown(f"### 🟢 Entrate ({col_val})")
-        if not inc_g.empty:
-            fig = genera_grafico_avanzato(inc_g, chart_type, col_val, "Categoria", "Entrate", px.colors.sequential.Teal)
-            if fig: st.plotly_chart(fig, use_container_width=True)
-            # Applicazione stile standard (Positivo = Verde)
-            st.dataframe(
-                inc_g.sort_values("Reale", ascending=False)
-                .style.format("{:.2f} €", subset=["Budget", "Reale", "Delta"])
-                .map(lambda v: style_delta_standard(v), subset=["Delta"]),
-                use_container_width=True
+        if "stat_sync" in st.session_state:
+            stat = st.session_state["stat_sync"]
+            st.caption(
+                f"📨 {stat['candidate']} mail bancarie scaricate · "
+                f"{stat['scartate_server']} escluse dal server · "
+                f"{stat['scartate_client']} scartate dal filtro locale · "
+                f"{stat.get('duplicate', 0)} già importate"
             )
 
-# ==============================================================================
-# TAB 4: IMPORTA (CON FORM E APPRENDIMENTO)
-# ==============================================================================
-with tab_imp:
-    col_search, col_actions = st.columns([1, 4])
-    with col_search:
-        if st.button("🔎 Cerca Mail", type="primary"):
-            with st.spinner("Analisi mail in corso..."):
-                df_mail, df_scartate = scarica_spese_da_gmail()
-                st.session_state["df_mail_found"] = df_mail
-                st.session_state["df_mail_discarded"] = df_scartate
-    
-    st.divider()
-
-    # Box Errori Mail
-    if not st.session_state["df_mail_discarded"].empty:
-        with st.expander(f"⚠️ {len(st.session_state['df_mail_discarded'])} Mail Scartate", expanded=True):
-            st.dataframe(st.session_state["df_mail_discarded"][["Data", "Descrizione"]], use_container_width=True)
-            if st.button("⬇️ Recupera"):
-                recuperate = st.session_state["df_mail_discarded"].copy()
-                st.session_state["df_manual_entry"] = pd.concat([st.session_state["df_manual_entry"], recuperate], ignore_index=True)
-                st.session_state["df_mail_discarded"] = pd.DataFrame()
-                st.rerun()
+        st.divider()
+
+        # Box Errori Mail
+        if not st.session_state["df_mail_discarded"].empty:
+            with st.expander(f"⚠️ {len(st.session_state['df_mail_discarded'])} Mail Scartate", expanded=True):
+                st.dataframe(st.session_state["df_mail_discarded"][["Data", "Descrizione"]], use_container_width=True)
+                if st.button("⬇️ Recupera"):
+                    recuperate = st.session_state["df_mail_discarded"].copy()
+                    if coda_mail:
+                        coda_mail.rimuovi(recuperate["Firma"])
+                    st.session_state["df_manual_entry"] = pd.concat([st.session_state["df_manual_entry"], recuperate], ignore_index=True)
+                    st.session_state["df_mail_discarded"] = pd.DataFrame()
+                    st.rerun()
 
-    # Divisione Tabelle
-    df_new = st.session_state["df_mail_found"]
+        # Divisione Tabelle
+        df_new = st.session_state["df_mail_found"]
     
-    df_view_entrate = pd.DataFrame()
-    df_view_uscite = pd.DataFrame()
+        df_view_entrate = pd.DataFrame()
+        df_view_uscite = pd.DataFrame()
     
-    if not df_new.empty:
-        if "Firma" in df_cloud.columns:
-            firme_esistenti = df_cloud["Firma"].astype(str).tolist()
-            df_new = df_new[~df_new["Firma"].astype(str).isin(firme_esistenti)]
+        if not df_new.empty:
+            if "Firma" in df_new.columns:
+                # Righe trovate in una ricerca precedente ma salvate nel frattempo
+                anni_new = pd.to_datetime(df_new["Data"], errors="coerce").dt.year.dropna().astype(int).unique().tolist()
+                maschera_nuove = get_indice_firme(anni_new).maschera_nuove(df_new["Firma"])
+                if coda_mail and not maschera_nuove.all():
+                    coda_mail.rimuovi(df_new.loc[~maschera_nuove, "Firma"])
+                df_new = df_new[maschera_nuove]
         
-        df_view_entrate = df_new[df_new["Tipo"] == "Entrata"]
-        df_view_uscite = df_new[df_new["Tipo"] == "Uscita"]
-
-    # ==========================================================================
-    # FORM UNICO: BLOCCA I REFRESH FINCHÉ NON PREMI "SALVA"
-    # ==========================================================================
-    with st.form("form_importazione"):
-        st.markdown("##### 💰 Nuove Entrate")
-        if not df_view_entrate.empty:
-            ed_ent = st.data_editor(
-                df_view_entrate,
-                column_config={"Categoria": st.column_config.SelectboxColumn(options=CAT_ENTRATE)},
-                key="k_ent", use_container_width=True, num_rows="dynamic"
-            )
-        else:
-            ed_ent = pd.DataFrame()
-            st.info("Nessuna nuova entrata trovata.")
-
-        st.markdown("##### 💸 Nuove Uscite")
-        if not df_view_uscite.empty:
-            ed_usc = st.data_editor(
-                df_view_uscite,
-                column_config={"Categoria": st.column_config.SelectboxColumn(options=CAT_USCITE)},
-                key="k_usc", use_container_width=True, num_rows="dynamic"
-            )
-        else:
-            ed_usc = pd.DataFrame()
-            st.info("Nessuna nuova uscita trovata.")
-
-        st.markdown("---")
-        st.markdown("##### ✍️ Manuale / Correzioni")
+            df_view_entrate = df_new[df_new["Tipo"] == "Entrata"]
+            df_view_uscite = df_new[df_new["Tipo"] == "Uscita"]
+
+        # ==========================================================================
+        # FORM UNICO: BLOCCA I REFRESH FINCHÉ NON PREMI "SALVA"
+        # ==========================================================================
+        with st.form("form_importazione"):
+            st.markdown("##### 💰 Nuove Entrate")
+            if not df_view_entrate.empty:
+                ed_ent = st.data_editor(
+                    df_view_entrate,
+                    column_config={"Categoria": st.column_config.SelectboxColumn(options=CAT_ENTRATE)},
+                    key="k_ent", use_container_width=True, num_rows="dynamic"
+                )
+            else:
+                ed_ent = pd.DataFrame()
+                st.info("Nessuna nuova entrata trovata.")
+
+            st.markdown("##### 💸 Nuove Uscite")
+            if not df_view_uscite.empty:
+                ed_usc = st.data_editor(
+                    df_view_uscite,
+                    column_config={"Categoria": st.column_config.SelectboxColumn(options=CAT_USCITE)},
+                    key="k_usc", use_container_width=True, num_rows="dynamic"
+                )
+            else:
+                ed_usc = pd.DataFrame()
+                st.info("Nessuna nuova uscita trovata.")
+
+            st.markdown("---")
+            st.markdown("##### ✍️ Manuale / Correzioni")
         
-        # --- 1. GESTIONE MEMORIA ROBUSTA ---
-        # Se non esiste una "memoria" per i dati manuali, la creiamo vuota ma strutturata
-        if "manual_data" not in st.session_state:
-            st.session_state["manual_data"] = pd.DataFrame(
-                columns=["Data", "Descrizione", "Importo", "Tipo", "Categoria"]
+            # --- 1. GESTIONE MEMORIA ROBUSTA ---
+            # Se non esiste una "memoria" per i dati manuali, la creiamo vuota ma strutturata
+            if "manual_data" not in st.session_state:
+                st.session_state["manual_data"] = pd.DataFrame(
+                    columns=["Data", "Descrizione", "Importo", "Tipo", "Categoria"]
+                )
+
+            # Se la tabella è vuota, aggiungiamo una riga vuota pronta all'uso (con data oggi)
+            if st.session_state["manual_data"].empty:
+                nuova_riga = pd.DataFrame([{
+                    "Data": datetime.now(),
+                    "Descrizione": "",
+                    "Importo": 0.0,
+                    "Tipo": "Uscita",
+                    "Categoria": "DA VERIFICARE"
+                }])
+                # Usiamo concat per non avere problemi di indici
+                st.session_state["manual_data"] = pd.concat([st.session_state["manual_data"], nuova_riga], ignore_index=True)
+
+            # --- 2. EDITOR COLLEGATO ALLA MEMORIA ---
+            # Modificando qui, modifichi direttamente 'manual_data'
+            ed_man = st.data_editor(
+                st.session_state["manual_data"],
+                num_rows="dynamic",
+                column_config={
+                    "Categoria": st.column_config.SelectboxColumn(options=LISTA_TUTTE, required=True),
+                    "Tipo": st.column_config.SelectboxColumn(options=["Entrata", "Uscita"], required=True),
+                    "Data": st.column_config.DateColumn(format="YYYY-MM-DD", required=True),
+                    "Importo": st.column_config.NumberColumn(format="%.2f €", required=True),
+                    "Descrizione": st.column_config.TextColumn(required=True)
+                },
+                key="editor_manuale_fin", # Chiave univoca
+                use_container_width=True
             )
 
-        # Se la tabella è vuota, aggiungiamo una riga vuota pronta all'uso (con data oggi)
-        if st.session_state["manual_data"].empty:
-            nuova_riga = pd.DataFrame([{
-                "Data": datetime.now(),
-                "Descrizione": "",
-                "Importo": 0.0,
-                "Tipo": "Uscita",
-                "Categoria": "DA VERIFICARE"
-            }])
-            # Usiamo concat per non avere problemi di indici
-            st.session_state["manual_data"] = pd.concat([st.session_state["manual_data"], nuova_riga], ignore_index=True)
-
-        # --- 2. EDITOR COLLEGATO ALLA MEMORIA ---
-        # Modificando qui, modifichi direttamente 'manual_data'
-        ed_man = st.data_editor(
-            st.session_state["manual_data"],
-            num_rows="dynamic",
-            column_config={
-                "Categoria": st.column_config.SelectboxColumn(options=sorted(CAT_USCITE + CAT_ENTRATE), required=True),
-                "Tipo": st.column_config.SelectboxColumn(options=["Entrata", "Uscita"], required=True),
-                "Data": st.column_config.DateColumn(format="YYYY-MM-DD", required=True),
-                "Importo": st.column_config.NumberColumn(format="%.2f €", required=True),
-                "Descrizione": st.column_config.TextColumn(required=True)
-            },
-            key="editor_manuale_fin", # Chiave univoca
-            use_container_width=True
-        )
-
-        # --- 3. SALVATAGGIO ---
-        submitted = st.form_submit_button("💾 SALVA TUTTO E IMPARA", type="primary")
-
-        if submitted:
-            save_list = []
-            keyword_list = []
-
-            # A. Processo Entrate (Mail)
-            if not ed_ent.empty:
-                # Filtriamo solo quelle che hanno un importo (per sicurezza)
-                v_ent = ed_ent[ed_ent["Importo"] != 0].copy()
-                if not v_ent.empty:
-                    save_list.append(v_ent)
-                    # Apprendimento
-                    for _, row in v_ent.iterrows():
-                        if row["Categoria"] != "DA VERIFICARE":
-                            keyword_list.append({"Parola": row["Descrizione"], "Categoria": row["Categoria"]})
-
-            # B. Processo Uscite (Mail)
-            if not ed_usc.empty:
-                v_usc = ed_usc[ed_usc["Importo"] != 0].copy()
-                if not v_usc.empty:
-                    save_list.append(v_usc)
-                    # Apprendimento
-                    for _, row in v_usc.iterrows():
-                        if row["Categoria"] != "DA VERIFICARE":
-                            keyword_list.append({"Parola": row["Descrizione"], "Categoria": row["Categoria"]})
-
-            # C. Processo Manuale (Dalla variabile ed_man che ora contiene i dati modificati)
-            if not ed_man.empty:
-                # Pulizia Importo
-                ed_man["Importo"] = pd.to_numeric(ed_man["Importo"], errors='coerce').fillna(0.0)
+            # --- 3. SALVATAGGIO ---
+            submitted = st.form_submit_button("💾 SALVA TUTTO E IMPARA", type="primary")
+
+            if submitted:
+                save_list = []
+                keyword_list = []
+
+                # A. Processo Entrate (Mail)
+                if not ed_ent.empty:
+                    # Filtriamo solo quelle che hanno un importo (per sicurezza)
+                    v_ent = ed_ent[ed_ent["Importo"] != 0].copy()
+                    if not v_ent.empty:
+                        save_list.append(v_ent)
+                        # Apprendimento
+                        for _, row in v_ent.iterrows():
+                            if row["Categoria"] != "DA VERIFICARE":
+                                keyword_list.append({"Parola": row["Descrizione"], "Categoria": row["Categoria"]})
+
+                # B. Processo Uscite (Mail)
+                if not ed_usc.empty:
+                    v_usc = ed_usc[ed_usc["Importo"] != 0].copy()
+                    if not v_usc.empty:
+                        save_list.append(v_usc)
+                        # Apprendimento
+                        for _, row in v_usc.iterrows():
+                            if row["Categoria"] != "DA VERIFICARE":
+                                keyword_list.append({"Parola": row["Descrizione"], "Categoria": row["Categoria"]})
+
+                # C. Processo Manuale (Dalla variabile ed_man che ora contiene i dati modificati)
+                if not ed_man.empty:
+                    # Pulizia Importo
+                    ed_man["Importo"] = pd.to_numeric(ed_man["Importo"], errors='coerce').fillna(0.0)
                 
-                # Filtro Validità: Importo diverso da 0 E Descrizione non vuota
-                validi_man = ed_man[
-                    (ed_man["Importo"] != 0) & 
-                    (ed_man["Descrizione"].str.strip() != "")
-                ].copy()
+                    # Filtro Validità: Importo diverso da 0 E Descrizione non vuota
+                    validi_man = ed_man[
+                        (ed_man["Importo"] != 0) & 
+                        (ed_man["Descrizione"].str.strip() != "")
+                    ].copy()
                 
-                if not validi_man.empty:
-                    # Completiamo i dati mancanti
-                    validi_man["Data"] = pd.to_datetime(validi_man["Data"])
-                    validi_man["Mese"] = validi_man["Data"].dt.strftime('%b-%y')
-                    validi_man["Firma"] = [f"MAN-{uuid.uuid4().hex[:6]}" for _ in range(len(validi_man))]
+                    if not validi_man.empty:
+                        # Completiamo i dati mancanti
+                        validi_man["Data"] = pd.to_datetime(validi_man["Data"])
+                        validi_man["Mese"] = validi_man["Data"].dt.strftime('%b-%y')
+                        validi_man["Firma"] = [f"MAN-{uuid.uuid4().hex[:6]}" for _ in range(len(validi_man))]
                     
-                    save_list.append(validi_man)
+                        save_list.append(validi_man)
                     
-                    # Apprendimento Manuale
-                    for _, row in validi_man.iterrows():
-                        if row["Categoria"] != "DA VERIFICARE":
-                            keyword_list.append({"Parola": row["Descrizione"], "Categoria": row["Categoria"]})
-
-            # --- D. SALVATAGGIO FINALE NEL DB ---
-            if save_list:
-                # 1. Aggiorna DB Transazioni
-                fin = pd.concat([df_cloud] + save_list, ignore_index=True)
-                fin["Data"] = pd.to_datetime(fin["Data"]).dt.strftime("%Y-%m-%d")
-                conn.update(worksheet="DB_TRANSAZIONI", data=fin)
+                        # Apprendimento Manuale
+                        for _, row in validi_man.iterrows():
+                            if row["Categoria"] != "DA VERIFICARE":
+                                keyword_list.append({"Parola": row["Descrizione"], "Categoria": row["Categoria"]})
+
+                # --- D. SALVATAGGIO FINALE NEL DB ---
+                if save_list:
+                    # 1. Aggiorna DB Transazioni: si accodano solo le righe nuove, ognuna nella
+                    # partizione del suo anno (snapshot e cubi aggiornati in place se basta l'append)
+                    nuove = pd.concat(save_list, ignore_index=True)
+                    nuove["Data"] = pd.to_datetime(nuove["Data"]).dt.strftime("%Y-%m-%d")
+                    registro.accoda(nuove)
+                    if coda_mail:
+                        coda_mail.rimuovi(nuove["Firma"])
+                    if "ripresa_mail" in st.session_state:
+                        StatoSync().salva(*st.session_state.pop("ripresa_mail"))
                 
-                # --- AGGIORNAMENTO INTELLIGENTE DB KEYWORDS ---
-            if keyword_list:
-                try:
-                    # 1. LEGGIAMO LO STORICO ESISTENTE (Fondamentale!)
+                    # --- AGGIORNAMENTO INTELLIGENTE DB KEYWORDS ---
+                if keyword_list:
                     try:
-                        # Leggiamo tutto il foglio corrente
-                        df_old_kw = conn.read(worksheet="DB_KEYWORDS", usecols=[0, 1])
-                        # Se è vuoto o non ha colonne giuste, lo inizializziamo
-                        if df_old_kw.empty or "Parola" not in df_old_kw.columns:
-                            df_old_kw = pd.DataFrame(columns=["Parola", "Categoria"])
-                    except Exception:
-                        # Se il foglio non esiste proprio o dà errore, partiamo da zero
-                        df_old_kw = pd.DataFrame(columns=["Parola", "Categoria"])
-
-                    # 2. CREIAMO IL DATAFRAME DELLE NOVITÀ
-                    df_new_kw = pd.DataFrame(keyword_list)
-
-                    # 3. UNIAMO VECCHIO + NUOVO
-                    # Mettiamo prima il vecchio, poi il nuovo in fondo
-                    df_total = pd.concat([df_old_kw, df_new_kw], ignore_index=True)
-
-                    # 4. PULIZIA E DEDUPLICAZIONE AVANZATA
-                    # Creiamo una colonna temporanea per confrontare le parole senza badare a maiuscole/spazi
-                    df_total["_key_temp"] = df_total["Parola"].astype(str).str.lower().str.strip()
-                    
-                    # Rimuoviamo i duplicati basandoci sulla chiave pulita. 
-                    # keep='last' è CRUCIALE: significa "tieni l'ultima versione che ho inserito".
-                    # Così se cambi categoria a una parola, il sistema si aggiorna.
-                    df_total = df_total.drop_duplicates(subset=["_key_temp"], keep='last')
-                    
-                    # 5. PREPARIAMO IL FILE FINALE
-                    # Teniamo solo le colonne giuste
-                    df_final_keywords = df_total[["Parola", "Categoria"]].copy()
-                    
-                    # Ordiniamo alfabeticamente per pulizia
-                    df_final_keywords = df_final_keywords.sort_values(by="Parola")
-
-                    # 6. SCRIVIAMO IL NUOVO ELENCO COMPLETO
-                    conn.update(worksheet="DB_KEYWORDS", data=df_final_keywords)
-                    
-                    # 7. PULIAMO LA CACHE DI STREAMLIT
-                    # Così la funzione get_custom_map() ricaricherà subito le nuove regole
-                    get_custom_map.clear()
-                    
-                    st.toast(f"🧠 Apprese {len(df_new_kw)} nuove regole di categorizzazione!")
-
-                except Exception as e:
-                    st.error(f"Errore nell'aggiornamento delle keywords: {e}")
+                        # Upsert per parola normalizzata (minuscolo, senza spazi): si scrivono solo le
+                        # righe nuove o con categoria cambiata, e i categorizzatori già compilati
+                        # imparano le nuove regole in place (niente rilettura del foglio)
+                        parole = get_parole()
+                        n_nuove, n_aggiornate = parole.impara((k["Parola"], k["Categoria"]) for k in keyword_list)
+                        if n_nuove or n_aggiornate:
+                            versioni.segnala_scrittura("DB_KEYWORDS")
+                            parole.segna_versione(versioni.token("DB_KEYWORDS"))
+
+                        st.toast(f"🧠 Apprese {n_nuove} nuove regole di categorizzazione ({n_aggiornate} aggiornate)!")
+
+                    except Exception as e:
+                        st.error(f"Errore nell'aggiornamento delle keywords: {e}")
        
-# ==============================================================================
-# TAB 5: STORICO (FIX FILTRO MESI)
-# ==============================================================================
-with tab_stor:
-    st.markdown("### 🗂 Storico Transazioni")
-    
-    # 1. Preparazione Dati
-    # Assicuriamoci che la data sia datetime reale
-    df_cloud["Data"] = pd.to_datetime(df_cloud["Data"], errors='coerce')
+    # ==============================================================================
+    # TAB 5: STORICO (FIX FILTRO MESI)
+    # ==============================================================================
+    if vista == VISTA_STOR:
+        st.markdown("### 🗂 Storico Transazioni")
     
-    # Creiamo colonne di appoggio sicure per i filtri
-    df_view = df_cloud.copy()
-    df_view["_Anno_Filtro"] = df_view["Data"].dt.year
-    df_view["_Mese_Num"] = df_view["Data"].dt.month
+        # 1. Preparazione Dati
+        # (i filtri usano l'indice costruito una volta per versione del registro; df_storico è
+        # condiviso tra sessioni e la selezione ne produce una copia). Indice e righe vengono
+        # dallo stesso snapshot: le maschere hanno sempre la lunghezza di df_storico.
+        snapshot_storico = get_vista()
+        _, df_storico = snapshot_storico
+        indice_ricerca = get_indice_ricerca(snapshot=snapshot_storico)
     
-    # ==========================================================================
-    # AREA FILTRI (BLOCCATA DENTRO UN FORM)
-    # ==========================================================================
-    with st.expander("🔍 FILTRI AVANZATI (Clicca per aprire)", expanded=True):
-        with st.form("form_filtri_storico"):
-            st.caption("Seleziona i filtri e premi 'Applica' per aggiornare la tabella.")
+        # ==========================================================================
+        # AREA FILTRI (BLOCCATA DENTRO UN FORM)
+        # ==========================================================================
+        with st.expander("🔍 FILTRI AVANZATI (Clicca per aprire)", expanded=True):
+            with st.form("form_filtri_storico"):
+                st.caption("Seleziona i filtri e premi 'Applica' per aggiornare la tabella.")
             
-            # Riga 1: Filtri Temporali e Tipo
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                # Anni disponibili (Numerici)
-                anni_opt = sorted(df_view["_Anno_Filtro"].dropna().unique().astype(int).tolist(), reverse=True)
-                # Se non ci sono anni, metti l'anno corrente
-                if not anni_opt: anni_opt = [datetime.now().year]
-                f_anni = st.multiselect("📅 Anno", anni_opt, default=anni_opt)
+                # Riga 1: Filtri Temporali e Tipo
+                c1, c2, c3 = st.columns(3)
+                with c1:
+                    # Anni disponibili (Numerici)
+                    anni_opt = sorted({int(a) for a in indice_ricerca.valori("Anno")}, reverse=True)
+                    # Se non ci sono anni, metti l'anno corrente
+                    if not anni_opt: anni_opt = [datetime.now().year]
+                    f_anni = st.multiselect("📅 Anno", anni_opt, default=anni_opt)
             
-            with c2:
-                # Mesi disponibili (Nomi italiani)
-                # MAP_MESI = {1: 'Gen', 2: 'Feb'...}
-                nomi_mesi = list(MAP_MESI.values()) 
-                f_mesi_nomi = st.multiselect("🗓️ Mese", nomi_mesi, default=nomi_mesi)
+                with c2:
+                    # Mesi disponibili (Nomi italiani)
+                    # MAP_MESI = {1: 'Gen', 2: 'Feb'...}
+                    nomi_mesi = list(MAP_MESI.values()) 
+                    f_mesi_nomi = st.multiselect("🗓️ Mese", nomi_mesi, default=nomi_mesi)
             
-            with c3:
-                # Tipo
-                f_tipo = st.multiselect("b Tipo", ["Entrata", "Uscita"], default=["Entrata", "Uscita"])
+                with c3:
+                    # Tipo
+                    f_tipo = st.multiselect("b Tipo", ["Entrata", "Uscita"], default=["Entrata", "Uscita"])
             
-            # Riga 2: Categoria e Ricerca
-            c4, c5 = st.columns([1, 2])
-            with c4:
-                cat_opt = sorted(LISTA_TUTTE)
-                f_cat = st.multiselect("🏷️ Categoria", cat_opt)
-            with c5:
-                f_txt = st.text_input("🔍 Cerca nel testo (es. Amazon, Stipendio)")
-
-            # BOTTONE PER APPLICARE I FILTRI
-            submitted_filters = st.form_submit_button("✅ APPLICA FILTRI", type="primary")
-
-    # ==========================================================================
-    # LOGICA DI FILTRAGGIO
-    # ==========================================================================
+                # Riga 2: Categoria e Ricerca
+                c4, c5 = st.columns([1, 2])
+                with c4:
+                    cat_opt = LISTA_TUTTE
+                    f_cat = st.multiselect("🏷️ Categoria", cat_opt)
+                with c5:
+                    f_txt = st.text_input("🔍 Cerca nel testo (es. Amazon, Stipendio)")
+                    f_prefisso = st.checkbox("Solo inizio parola", help="Es. 'farm' trova 'FARMACIA' ma 'arma' no")
+
+                # BOTTONE PER APPLICARE I FILTRI
+                submitted_filters = st.form_submit_button("✅ APPLICA FILTRI", type="primary")
+
+        # ==========================================================================
+        # LOGICA DI FILTRAGGIO
+        # ==========================================================================
     
-    # 1. Filtro Anno (Usa la colonna numerica sicura)
-    if f_anni:
-        df_view = df_view[df_view["_Anno_Filtro"].isin(f_anni)]
-    
-    # 2. Filtro Mese (Converto i nomi selezionati in numeri e filtro sul numero)
-    # Esempio: Se selezioni 'Gen', cerco il mese 1.
-    if f_mesi_nomi:
-        # Recupero i numeri dei mesi selezionati dalla mappa inversa
+        # Una maschera per filtro (lookup sui codici / trigrammi), combinate in AND
+        # Mesi: converto i nomi selezionati in numeri (es. 'Gen' -> 1)
         numeri_selezionati = [k for k, v in MAP_MESI.items() if v in f_mesi_nomi]
-        df_view = df_view[df_view["_Mese_Num"].isin(numeri_selezionati)]
-        
-    # 3. Filtro Tipo
-    if f_tipo:
-        df_view = df_view[df_view["Tipo"].isin(f_tipo)]
-        
-    # 4. Filtro Categoria
-    if f_cat:
-        df_view = df_view[df_view["Categoria"].isin(f_cat)]
-        
-    # 5. Filtro Testo
-    if f_txt:
-        df_view = df_view[df_view["Descrizione"].str.contains(f_txt, case=False, na=False)]
-
-    # ==========================================================================
-    # EDITOR DATI
-    # ==========================================================================
-    st.markdown(f"**Visualizzando {len(df_view)} transazioni**")
-
-    # Rimuoviamo le colonne di appoggio prima di mostrare l'editor
-    cols_to_show = ["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"]
-    # Filtriamo solo le colonne che esistono davvero
-    cols_exist = [c for c in cols_to_show if c in df_view.columns]
-    
-    df_editor_input = df_view[cols_exist].copy()
-
-    df_storico_edited = st.data_editor(
-        df_editor_input,
-        num_rows="dynamic",
-        use_container_width=True,
-        height=600,
-        column_config={
-            "Categoria": st.column_config.SelectboxColumn(options=sorted(LISTA_TUTTE), required=True),
-            "Tipo": st.column_config.SelectboxColumn(options=["Entrata", "Uscita"], required=True),
-            "Data": st.column_config.DateColumn(format="YYYY-MM-DD", required=True),
-            "Importo": st.column_config.NumberColumn(format="%.2f €"),
-            "Firma": st.column_config.TextColumn(disabled=True),
-            "Mese": st.column_config.TextColumn(disabled=True) # Meglio non modificare a mano il mese stringa
-        },
-        key="editor_storico_v3"
-    )
-    
-    st.divider()
-
-    # ==========================================================================
-    # BOTTONE SALVATAGGIO
-    # ==========================================================================
-    col_save, _ = st.columns([2, 8])
-    with col_save:
-        if st.button("💾 SALVA MODIFICHE AL DB", type="primary"):
-            try:
-                # 1. Carichiamo tutto il DB originale
-                df_full_original = df_cloud.copy()
-                df_full_original.set_index("Firma", inplace=True)
-                
-                # 2. Prepariamo le modifiche
-                if "Firma" in df_storico_edited.columns:
-                    df_edited_subset = df_storico_edited.set_index("Firma")
-                    
-                    # 3. Aggiorniamo
-                    df_full_original.update(df_edited_subset)
-                    
-                    # 4. Salviamo
-                    df_final_to_save = df_full_original.reset_index()
-                    df_final_to_save["Data"] = pd.to_datetime(df_final_to_save["Data"]).dt.strftime("%Y-%m-%d")
-                    
-                    # Ricalcoliamo le colonne Anno/MeseNum per sicurezza
-                    # (Non sono nel DB excel ma servono al codice se ricarica)
-                    
-                    conn.update(worksheet="DB_TRANSAZIONI", data=df_final_to_save)
-                    
-                    st.success("✅ Database aggiornato correttamente!")
-                    st.rerun()
-                else:
-                    st.error("Errore critico: Colonna 'Firma' mancante.")
-                    
-            except Exception as e:
-                st.error(f"Errore durante il salvataggio: {e}")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        maschera_storico = indice_ricerca.filtra(
+            anni=f_anni, mesi=numeri_selezionati, tipi=f_tipo, categorie=f_cat, testo=f_txt,
+            prefisso=f_prefisso,
+        )
+        df_view = df_storico[maschera_storico]
+
+        # ==========================================================================
+        # EDITOR DATI (PAGINATO)
+        # ==========================================================================
+        # All'editor arriva solo la pagina corrente: ordinamento e paginazione sono fatti qui
+        # in pandas. Le modifiche di ogni pagina restano in sospeso (bozze) anche cambiando
+        # pagina e vengono salvate tutte insieme in un unico change-set.
+        st.markdown(f"**Visualizzando {len(df_view)} transazioni**")
+
+        cp1, cp2, cp3, cp4 = st.columns(4)
+        with cp1:
+            col_ordine = st.selectbox("↕️ Ordina per", ["Data", "Importo", "Descrizione", "Categoria", "Tipo"], key="ord_stor")
+        with cp2:
+            decrescente = st.toggle("Decrescente", value=True, key="ord_desc_stor")
+        with cp3:
+            righe_pagina = st.selectbox("Righe per pagina", [50, 100, 250, 500], index=1, key="dim_pag_stor")
+        n_pagine = max(1, -(-len(df_view) // righe_pagina))
+        with cp4:
+            # Senza key: se cambiano i filtri (e quindi il numero di pagine) riparte dalla prima
+            pagina = st.number_input(f"Pagina (di {n_pagine})", min_value=1, max_value=n_pagine, value=1, step=1)
+
+        df_ordinato = df_view.sort_values(col_ordine, ascending=not decrescente, kind="stable")
+        inizio_pag = (pagina - 1) * righe_pagina
+
+        # Rimuoviamo le colonne di appoggio prima di mostrare l'editor
+        cols_to_show = ["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"]
+        # Filtriamo solo le colonne che esistono davvero
+        cols_exist = [c for c in cols_to_show if c in df_view.columns]
+
+        df_editor_input = df_ordinato.iloc[inizio_pag:inizio_pag + righe_pagina][cols_exist].copy()
+
+        # Bozze: firma della pagina (indici e Firme delle righe) -> {"originale", "chiavi", "modificato", "modifiche"}
+        # Le Firme nella firma della pagina: se il registro viene ricaricato e agli stessi indici
+        # corrispondono righe diverse, la pagina è un'altra e si apre un editor nuovo.
+        bozze = st.session_state.setdefault("bozze_storico", {})
+        impronta_pagina = hashlib.blake2b(df_editor_input.index.to_numpy().tobytes(), digest_size=8)
+        if "Firma" in df_editor_input.columns:
+            impronta_pagina.update("\x1f".join(df_editor_input["Firma"].astype(str)).encode())
+        firma_pagina = impronta_pagina.hexdigest()
+        # La base dell'editor resta lo stesso oggetto finché si rimane sulla pagina; rientrando
+        # in una pagina già modificata (o nella vista) si riparte dalla sua bozza con un editor nuovo.
+        # Le chiavi (Firma, occorrenza) delle righe sono risolte qui, sullo snapshot da cui viene
+        # la pagina, e restano quelle della bozza fino al salvataggio.
+        base = st.session_state.get("base_storico")
+        if base is None or base[0] != firma_pagina or f"editor_storico_{base[0]}_{base[2]}" not in st.session_state:
+            visita = st.session_state.get("visita_storico", 0) + 1
+            st.session_state["visita_storico"] = visita
+            if firma_pagina in bozze:
+                bozza = bozze[firma_pagina]
+                dati_editor, originale_pagina, chiavi_pagina = bozza["modificato"], bozza["originale"], bozza["chiavi"]
+            else:
+                dati_editor = originale_pagina = df_editor_input
+                chiavi_pagina = chiavi_righe(df_editor_input, df_storico) if "Firma" in df_editor_input.columns else {}
+            base = (firma_pagina, dati_editor, visita, originale_pagina, chiavi_pagina)
+            st.session_state["base_storico"] = base
+        _, _, _, originale_pagina, chiavi_pagina = base
+
+        df_storico_edited = st.data_editor(
+            base[1],
+            num_rows="dynamic",
+            use_container_width=True,
+            height=600,
+            column_config={
+                "Categoria": st.column_config.SelectboxColumn(options=LISTA_TUTTE, required=True),
+                "Tipo": st.column_config.SelectboxColumn(options=["Entrata", "Uscita"], required=True),
+                "Data": st.column_config.DateColumn(format="YYYY-MM-DD", required=True),
+                "Importo": st.column_config.NumberColumn(format="%.2f €"),
+                "Firma": st.column_config.TextColumn(disabled=True),
+                "Mese": st.column_config.TextColumn(disabled=True) # Meglio non modificare a mano il mese stringa
+            },
+            key=f"editor_storico_{firma_pagina}_{base[2]}"
+        )
 
+        # Aggiorna la bozza della pagina (solo se diversa dall'originale)
+        modifiche_pagina = (
+            calcola_modifiche(originale_pagina, df_storico_edited, chiavi=chiavi_pagina)
+            if "Firma" in df_storico_edited.columns else None
+        )
+        if modifiche_pagina:
+            bozze[firma_pagina] = {
+                "originale": originale_pagina, "chiavi": chiavi_pagina,
+                "modificato": df_storico_edited, "modifiche": modifiche_pagina,
+            }
+        else:
+            bozze.pop(firma_pagina, None)
 
+        # Al salvataggio valgono le chiavi fissate nelle bozze, non le posizioni nello snapshot attuale
+        modifiche = unisci_modifiche(b["modifiche"] for b in bozze.values())
+        if modifiche:
+            st.caption(f"✏️ Modifiche in sospeso su {len(bozze)} pagine: {modifiche.riepilogo()}")
 
+        st.divider()
 
+        # ==========================================================================
+        # BOTTONE SALVATAGGIO
+        # ==========================================================================
+        col_save, col_annulla, _ = st.columns([2, 2, 6])
+        with col_save:
+            if st.button("💾 SALVA MODIFICHE AL DB", type="primary"):
+                try:
+                    if "Firma" in df_storico_edited.columns:
+                        # Un solo change-set minimo (nuove, modificate, eliminate) per tutte le pagine
+                        # Scriviamo solo le righe/celle toccate
+                        if modifiche:
+                            # Con il registro diviso per anno ogni partizione riceve la sua parte
+                            registro.applica_modifiche(modifiche, df_storico)
+                            bozze.clear()
+                            st.session_state.pop("base_storico", None)
+                            st.success(f"✅ Database aggiornato correttamente! ({modifiche.riepilogo()})")
+                            st.rerun()
+                        else:
+                            st.info("Nessuna modifica da salvare.")
+                    else:
+                        st.error("Errore critico: Colonna 'Firma' mancante.")
+                    
+                except Exception as e:
+                    st.error(f"Errore durante il salvataggio: {e}")
+        with col_annulla:
+            if bozze and st.button("↩️ Annulla modifiche"):
+                bozze.clear()
+                st.session_state.pop("base_storico", None)
+                st.rerun()
+finally:
+    # Anche quando un ramo chiama st.rerun() o st.stop() (eccezioni di controllo di Streamlit)
+    # o fallisce: il profilo non resta attivo sul thread della sessione e viene sempre salvato
+    if profilo_rerun is not None:
+        profilo_rerun.disable()
+        st.session_state["ultimo_profilo"] = salva_profilo(profilo_rerun)
 
+# ==============================================================================
+# 7. TEMPO DI RERUN E PANNELLO PERFORMANCE (solo la vista attiva)
+# ==============================================================================
+durata_rerun = misuratore.durata_ms()
+st.sidebar.caption(f"⏱️ Rerun {vista}: {durata_rerun:.0f} ms")
+
+# Storico degli ultimi rerun della sessione, per confrontare le viste
+storico_rerun = st.session_state.setdefault("storico_rerun", [])
+storico_rerun.append({
+    "Ora": datetime.now().strftime("%H:%M:%S"),
+    "Vista": vista,
+    "Totale ms": round(durata_rerun, 1),
+    **{f"{fase} ms": round(ms, 1) for fase, ms in misuratore.per_fase().items()},
+})
+del storico_rerun[:-20]
+
+# Pannello nascosto: si apre con ?debug=1 nell'URL
+if st.query_params.get("debug") == "1":
+    with st.sidebar.expander("⏱️ Performance", expanded=True):
+        tracciato = misuratore.tracciato_ms()
+        st.caption(
+            f"Rerun: {durata_rerun:.0f} ms · Misurato: {tracciato:.0f} ms · "
+            f"Resto (widget, rendering): {max(durata_rerun - tracciato, 0):.0f} ms"
+        )
+        st.dataframe(
+            misuratore.riepilogo(),
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "Totale ms": st.column_config.NumberColumn(format="%.1f"),
+                "Max ms": st.column_config.NumberColumn(format="%.1f"),
+            },
+        )
+        st.caption("Ultimi rerun della sessione")
+        st.dataframe(pd.DataFrame(storico_rerun).fillna(0), hide_index=True, use_container_width=True)
+
+        if st.button("🔬 Profila il prossimo rerun"):
+            st.session_state["profila_rerun"] = True
+            st.rerun()
+        if "ultimo_profilo" in st.session_state:
+            percorso_prof, percorso_txt = st.session_state["ultimo_profilo"]
+            st.caption(f"Profilo salvato in {percorso_prof}")
+            try:
+                with open(percorso_prof, "rb") as f:
+                    st.download_button("💾 Scarica profilo (.prof)", f.read(), file_name=os.path.basename(percorso_prof))
+                with open(percorso_txt, encoding="utf-8") as f:
+                    st.download_button("📄 Scarica riepilogo (.txt)", f.read(), file_name=os.path.basename(percorso_txt))
+            except OSError:
+                st.session_state.pop("ultimo_profilo", None)
+
+with st.sidebar.expander("🐞 Debug cache grafici"):
+    stat_grafici = cache_grafici.statistiche()
+    st.caption(
+        f"Hit: {stat_grafici['hit']} · Miss: {stat_grafici['miss']} · "
+        f"Hit rate: {stat_grafici['hit_rate']:.0%}"
+    )
+    st.caption(f"Figure in cache: {stat_grafici['voci']} · Memoria: {stat_grafici['memoria_kb']:.0f} KB")
+    if st.button("Svuota cache grafici"):
+        cache_grafici.svuota()
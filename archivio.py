@@ -0,0 +1,634 @@
+"""Livello di persistenza: tutte le letture/scritture dei fogli passano da qui."""
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import date
+
+import pandas as pd
+
+from analisi import prepara_registro
+from prestazioni import byte_dataframe, byte_righe, span
+
+PERCORSO_ARCHIVIO_SQLITE = os.path.join(".bilancio_cache", "archivio.sqlite")
+
+# Colonne indicizzate per foglio nel backend SQLite
+INDICI_SQLITE = {"DB_TRANSAZIONI": ["Data", "Categoria", "Firma"]}
+
+COLONNE_REGISTRO = ["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"]
+
+
+def _valore_cella(v):
+    """Valore Python semplice per la cella (date come YYYY-MM-DD, numpy -> nativo)."""
+    if isinstance(v, (date, pd.Timestamp)):
+        return v.strftime("%Y-%m-%d")
+    return v.item() if hasattr(v, "item") else v
+
+
+def righe_per_foglio(df, colonne):
+    """Converte il DataFrame in liste di valori semplici, nell'ordine delle colonne del foglio."""
+    df = df.reindex(columns=colonne).astype(object)
+    df = df.where(df.notna(), "")
+    return [[_valore_cella(v) for v in riga] for riga in df.itertuples(index=False)]
+
+
+def lettera_colonna(n):
+    """Numero di colonna (1 = A) in notazione A1."""
+    lettere = ""
+    while n:
+        n, resto = divmod(n - 1, 26)
+        lettere = chr(65 + resto) + lettere
+    return lettere
+
+
+def posizioni_per_firma(firme):
+    """Mappa (firma, occorrenza) -> posizione della riga tra i dati (0 = prima riga dopo l'intestazione)."""
+    posizioni, contatori = {}, {}
+    for pos, firma in enumerate(firme):
+        firma = "" if pd.isna(firma) else str(firma).strip()
+        occ = contatori.get(firma, 0)
+        contatori[firma] = occ + 1
+        posizioni[(firma, occ)] = pos
+    return posizioni
+
+
+def aggiorna_dataframe(df, celle):
+    """Scrive le celle (posizione, colonna, valore) su una copia del foglio intero; restituisce (df, celle scritte)."""
+    df = df.astype(object)
+    colonne = list(df.columns)
+    scritte = 0
+    for pos, colonna, valore in celle:
+        if colonna in colonne:
+            df.iat[pos, colonne.index(colonna)] = valore
+            scritte += 1
+    return df, scritte
+
+
+def modifiche_dataframe(df, modifiche):
+    """
+    Applica il change-set a una copia del foglio intero, per i backend senza scritture
+    parziali. Restituisce (df, celle scritte).
+    """
+    posizioni = posizioni_per_firma(df["Firma"])
+    celle = [
+        (posizioni[(firma, occ)], colonna, valore)
+        for firma, occ, valori in modifiche.modificate
+        if (firma, occ) in posizioni
+        for colonna, valore in valori.items()
+    ]
+    df, scritte = aggiorna_dataframe(df, celle)
+    intestazione = list(df.columns)
+
+    da_eliminare = [posizioni[k] for k in modifiche.eliminate if k in posizioni]
+    df = df.drop(df.index[da_eliminare])
+
+    if len(modifiche.inserite):
+        righe = righe_per_foglio(modifiche.inserite, intestazione)
+        df = pd.concat([df, pd.DataFrame(righe, columns=intestazione)], ignore_index=True)
+        scritte += len(righe) * len(intestazione)
+    return df.reset_index(drop=True), scritte
+
+
+def colonne_compatibili(intestazione, colonne):
+    """Lo schema è invariato se tutte le colonne da scrivere esistono già nel foglio."""
+    return bool(intestazione) and set(colonne) <= set(intestazione)
+
+
+def righe_esistenti(df_esistente):
+    """Righe già nel foglio per accoda: il DataFrame o una funzione che lo carica solo se serve."""
+    return df_esistente() if callable(df_esistente) else df_esistente
+
+
+class Archivio:
+    """
+    Interfaccia comune dei backend. Ogni backend implementa:
+    versione, leggi, riscrivi, intestazione, accoda, aggiorna_celle, applica_modifiche.
+    conta_righe() ha una versione generica (lettura della prima colonna).
+    transazioni() e totali() hanno qui una versione generica (foglio intero + pandas);
+    i backend che sanno filtrare e aggregare alla fonte (SQLite) le sostituiscono e
+    impostano aggrega_alla_fonte, così il Registro le usa per le viste per anno e il cubo.
+    """
+
+    aggrega_alla_fonte = False
+
+    def transazioni(self, da=None, a=None, categorie=None, tipi=None, foglio="DB_TRANSAZIONI"):
+        """Righe del registro (colonne del foglio) con Data in [da, a] e le categorie/tipi indicati."""
+        df = self.leggi(foglio, usecols=list(range(len(COLONNE_REGISTRO))), ttl=0)
+        if df.empty:
+            return df
+        maschera = pd.Series(True, index=df.index)
+        giorni = pd.to_datetime(df["Data"], errors="coerce")
+        if da is not None:
+            maschera &= giorni >= pd.Timestamp(da)
+        if a is not None:
+            maschera &= giorni <= pd.Timestamp(a)
+        if categorie:
+            maschera &= df["Categoria"].astype(str).str.strip().isin(categorie)
+        if tipi:
+            maschera &= df["Tipo"].isin(tipi)
+        return df[maschera].reset_index(drop=True)
+
+    def crea(self, foglio, df):
+        """Crea un foglio nuovo con le righe di df (di default come una riscrittura)."""
+        self.riscrivi(foglio, df)
+
+    def conta_righe(self, foglio):
+        """Numero di righe di dati del foglio (intestazione esclusa)."""
+        return len(self.leggi(foglio, usecols=[0], ttl=0))
+
+    def totali(self, da=None, a=None, foglio="DB_TRANSAZIONI"):
+        """Somma degli importi per (Anno, MeseNum, Categoria, Tipo), come il cubo mensile."""
+        df = prepara_registro(self.transazioni(da, a, foglio=foglio))
+        if df.empty:
+            return pd.DataFrame(columns=["Anno", "MeseNum", "Categoria", "Tipo", "Importo"])
+        df = df.dropna(subset=["Data"])
+        totali = df.groupby(["Anno", "MeseNum", "Categoria", "Tipo"], as_index=False)["Importo"].sum()
+        return totali.astype({"Anno": "int64", "MeseNum": "int64"})
+
+
+class ArchivioFogli(Archivio):
+    """Backend Google Sheets (st-gsheets-connection + gspread per le scritture parziali)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._worksheets = {}
+        self._impronte = {}  # foglio -> (data di modifica del file, impronta del foglio)
+
+    def _worksheet(self, foglio):
+        """
+        Worksheet gspread sottostante, aperto una volta sola. È l'unico punto che usa l'API
+        privata di st-gsheets-connection (conn.client._select_worksheet, solo con account di
+        servizio): None se manca o fallisce, e i chiamanti ripiegano su conn.read/conn.update.
+        """
+        if foglio not in self._worksheets:
+            try:
+                self._worksheets[foglio] = self.conn.client._select_worksheet(worksheet=foglio)
+            except Exception:
+                return None
+        return self._worksheets[foglio]
+
+    def versione(self, foglio):
+        """
+        Token di versione del singolo foglio. La data di ultima modifica del file su Drive
+        (una richiesta, senza dati) cambia a ogni scrittura in qualunque foglio: solo quando
+        cambia si ricalcola l'impronta del foglio (vedi _impronta), così ad esempio scrivere
+        DB_KEYWORDS non invalida la cache di DB_TRANSAZIONI. None se il backend non la fornisce.
+        """
+        worksheet = self._worksheet(foglio)
+        if worksheet is None:
+            return None
+        try:
+            with span("fogli", f"versione {foglio}"):
+                spreadsheet = worksheet.spreadsheet
+                if hasattr(spreadsheet, "get_lastUpdateTime"):
+                    modificato = spreadsheet.get_lastUpdateTime()
+                else:
+                    # gspread 5: il valore è letto all'apertura, quindi riapriamo il file
+                    modificato = spreadsheet.client.open_by_key(spreadsheet.id).lastUpdateTime
+                voce = self._impronte.get(foglio)
+                if voce is None or voce[0] != modificato:
+                    voce = (modificato, self._impronta(worksheet))
+                    self._impronte[foglio] = voce
+                return voce[1]
+        except Exception:
+            return None
+
+    def _impronta(self, worksheet):
+        """
+        Numero di righe più checksum di tutte le celle: cambia con qualunque modifica al foglio,
+        anche fatta a mano su Sheets, da un altro processo o mentre l'app era spenta.
+        """
+        valori = ["\x1e".join(riga) for riga in worksheet.get_all_values()]
+        impronta = hashlib.blake2b("\x1f".join(valori).encode(), digest_size=8).hexdigest()
+        return f"{len(valori)}-{impronta}"
+
+    def leggi(self, foglio, **opzioni):
+        with span("fogli", f"leggi {foglio}") as misura:
+            df = self.conn.read(worksheet=foglio, **opzioni)
+            misura.celle = df.size
+            misura.byte = byte_dataframe(df)
+        return df
+
+    def riscrivi(self, foglio, df):
+        """Riscrive l'intero foglio."""
+        with span("fogli", f"riscrivi {foglio}", byte=byte_dataframe(df), celle=df.size):
+            self.conn.update(worksheet=foglio, data=df)
+
+    def crea(self, foglio, df):
+        """Aggiunge un worksheet al file (conn.update funziona solo su fogli esistenti)."""
+        with span("fogli", f"crea {foglio}", byte=byte_dataframe(df), celle=df.size):
+            self.conn.create(worksheet=foglio, data=df)
+
+    def intestazione(self, foglio):
+        ws = self._worksheet(foglio)
+        if ws is None:
+            return [str(c) for c in self.leggi(foglio, ttl=0).columns]
+        with span("fogli", f"intestazione {foglio}"):
+            return [str(c) for c in ws.row_values(1)]
+
+    def conta_righe(self, foglio):
+        """Righe di dati contate sulla colonna Firma (sempre valorizzata), senza leggere il foglio."""
+        ws = self._worksheet(foglio)
+        if ws is None:
+            return super().conta_righe(foglio)
+        with span("fogli", f"conta righe {foglio}") as misura:
+            intestazione = [str(c) for c in ws.row_values(1)]
+            colonna = intestazione.index("Firma") + 1 if "Firma" in intestazione else 1
+            righe = max(len(ws.col_values(colonna)) - 1, 0)
+            misura.celle = len(intestazione) + righe
+        return righe
+
+    def accoda(self, foglio, df_nuove, df_esistente):
+        """
+        Aggiunge in fondo al foglio solo le righe nuove. Se le righe hanno colonne che il
+        foglio non conosce (schema cambiato) o il worksheet gspread non è disponibile riscrive
+        tutto come prima: df_esistente può essere una funzione, chiamata solo in quel caso.
+        Restituisce True se è bastato l'append.
+        """
+        if df_nuove.empty:
+            return True
+        ws = self._worksheet(foglio)
+        intestazione = self.intestazione(foglio) if ws is not None else None
+        if not colonne_compatibili(intestazione, df_nuove.columns):
+            self.riscrivi(foglio, pd.concat([righe_esistenti(df_esistente), df_nuove], ignore_index=True))
+            return False
+        righe = righe_per_foglio(df_nuove, intestazione)
+        with span("fogli", f"accoda {foglio}", byte=byte_righe(righe), celle=len(righe) * len(intestazione)):
+            ws.append_rows(righe, value_input_option="USER_ENTERED")
+        return True
+
+    def aggiorna_celle(self, foglio, celle, intestazione=None):
+        """
+        Scrive in un'unica batch_update le celle indicate come (posizione riga, colonna, valore),
+        con posizione 0 = prima riga dopo l'intestazione. Colonne sconosciute vengono ignorate.
+        Senza worksheet gspread riscrive il foglio intero.
+        """
+        ws = self._worksheet(foglio)
+        if ws is None:
+            self.riscrivi(foglio, aggiorna_dataframe(self.leggi(foglio, ttl=0), celle)[0])
+            return
+        intestazione = intestazione or self.intestazione(foglio)
+        richieste = [
+            {"range": f"{lettera_colonna(intestazione.index(colonna) + 1)}{pos + 2}", "values": [[_valore_cella(valore)]]}
+            for pos, colonna, valore in celle
+            if colonna in intestazione
+        ]
+        if richieste:
+            byte = byte_righe(r["values"][0] for r in richieste)
+            with span("fogli", f"aggiorna celle {foglio}", byte=byte, celle=len(richieste)):
+                ws.batch_update(richieste, value_input_option="USER_ENTERED")
+
+    def applica_modifiche(self, foglio, modifiche):
+        """
+        Scrive solo il change-set: celle modificate in un'unica batch_update, righe eliminate
+        in un'unica richiesta deleteDimension (dal basso verso l'alto), righe nuove in append.
+        Senza worksheet gspread applica il change-set al foglio letto e lo riscrive intero.
+        """
+        ws = self._worksheet(foglio)
+        if ws is None:
+            self.riscrivi(foglio, modifiche_dataframe(self.leggi(foglio, ttl=0), modifiche)[0])
+            return
+        with span("fogli", f"leggi firme {foglio}") as misura:
+            intestazione = [str(c) for c in ws.row_values(1)]
+            firme = ws.col_values(intestazione.index("Firma") + 1)[1:]
+            misura.celle = len(intestazione) + len(firme)
+            misura.byte = byte_righe([intestazione, firme])
+        posizioni = posizioni_per_firma(firme)
+
+        celle = [
+            (posizioni[(firma, occ)], colonna, valore)
+            for firma, occ, valori in modifiche.modificate
+            if (firma, occ) in posizioni
+            for colonna, valore in valori.items()
+        ]
+        self.aggiorna_celle(foglio, celle, intestazione)
+
+        da_eliminare = sorted({posizioni[k] for k in modifiche.eliminate if k in posizioni}, reverse=True)
+        if da_eliminare:
+            with span("fogli", f"elimina righe {foglio}", celle=len(da_eliminare)):
+                ws.spreadsheet.batch_update({"requests": [
+                    {"deleteDimension": {"range": {
+                        "sheetId": ws.id, "dimension": "ROWS", "startIndex": pos + 1, "endIndex": pos + 2
+                    }}}
+                    for pos in da_eliminare
+                ]})
+
+        if len(modifiche.inserite):
+            righe = righe_per_foglio(modifiche.inserite, intestazione)
+            with span("fogli", f"accoda {foglio}", byte=byte_righe(righe), celle=len(righe) * len(intestazione)):
+                ws.append_rows(righe, value_input_option="USER_ENTERED")
+
+
+class ArchivioMemoria(Archivio):
+    """
+    Backend in memoria con la stessa interfaccia di ArchivioFogli, per sviluppo offline
+    e benchmark. Conta le celle scritte per confrontare i costi delle varie strategie.
+    """
+
+    def __init__(self, fogli=None):
+        self.fogli = {nome: df.copy() for nome, df in (fogli or {}).items()}
+        self.celle_scritte = 0
+        self.letture = 0
+        self._versioni = {}
+
+    def versione(self, foglio):
+        return self._versioni.get(foglio, 0)
+
+    def _modificato(self, foglio):
+        self._versioni[foglio] = self._versioni.get(foglio, 0) + 1
+
+    def leggi(self, foglio, usecols=None, **opzioni):
+        self.letture += 1
+        df = self.fogli.get(foglio, pd.DataFrame()).copy()
+        if usecols is not None:
+            df = df.iloc[:, [c for c in usecols if c < len(df.columns)]]
+        return df
+
+    def riscrivi(self, foglio, df):
+        self.fogli[foglio] = df.reset_index(drop=True).copy()
+        self.celle_scritte += df.size + len(df.columns)
+        self._modificato(foglio)
+
+    def intestazione(self, foglio):
+        return [str(c) for c in self.fogli.get(foglio, pd.DataFrame()).columns]
+
+    def accoda(self, foglio, df_nuove, df_esistente):
+        if df_nuove.empty:
+            return True
+        intestazione = self.intestazione(foglio)
+        if not colonne_compatibili(intestazione, df_nuove.columns):
+            self.riscrivi(foglio, pd.concat([righe_esistenti(df_esistente), df_nuove], ignore_index=True))
+            return False
+        righe = righe_per_foglio(df_nuove, intestazione)
+        nuove = pd.DataFrame(righe, columns=intestazione)
+        self.fogli[foglio] = pd.concat([self.fogli[foglio], nuove], ignore_index=True)
+        self.celle_scritte += len(righe) * len(intestazione)
+        self._modificato(foglio)
+        return True
+
+    def aggiorna_celle(self, foglio, celle, intestazione=None):
+        self.fogli[foglio], scritte = aggiorna_dataframe(self.fogli[foglio], celle)
+        self.celle_scritte += scritte
+        self._modificato(foglio)
+
+    def applica_modifiche(self, foglio, modifiche):
+        self.fogli[foglio], scritte = modifiche_dataframe(self.fogli[foglio], modifiche)
+        self.celle_scritte += scritte
+        self._modificato(foglio)
+
+
+def _nome_sql(nome):
+    """Identificatore SQL tra virgolette (nomi di colonna del foglio così come sono)."""
+    return '"' + str(nome).replace('"', '""') + '"'
+
+
+def colonne_uniche(colonne):
+    """Nomi di colonna validi e distinti (vuoti -> 'Unnamed: n', doppi -> 'nome.1'), come pandas."""
+    nomi, visti = [], {}
+    for i, c in enumerate(colonne):
+        nome = str(c).strip() or f"Unnamed: {i}"
+        if nome in visti:
+            visti[nome] += 1
+            nome = f"{nome}.{visti[nome]}"
+        visti.setdefault(nome, 0)
+        nomi.append(nome)
+    return nomi
+
+
+class ArchivioSQLite(Archivio):
+    """
+    Backend locale su un file SQLite: un foglio = una tabella con le stesse colonne, righe
+    nell'ordine di inserimento (rowid). Funziona senza rete (modalità offline) e indicizza
+    Data, Categoria e Firma del registro, così transazioni() e totali() filtrano e
+    aggregano in SQL invece di scaricare tutto il foglio.
+    La versione di ogni foglio è un contatore salvato nel file, incrementato a ogni scrittura.
+    """
+
+    aggrega_alla_fonte = True
+
+    def __init__(self, percorso=PERCORSO_ARCHIVIO_SQLITE, indici=INDICI_SQLITE):
+        self.percorso = percorso
+        self.indici = indici
+        self._lock = threading.Lock()
+        cartella = os.path.dirname(percorso)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with self._connetti() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS _fogli (foglio TEXT PRIMARY KEY, tabella TEXT, versione INTEGER)")
+
+    def _connetti(self):
+        return sqlite3.connect(self.percorso, timeout=30)
+
+    def _tabella(self, con, foglio):
+        riga = con.execute("SELECT tabella FROM _fogli WHERE foglio = ?", (foglio,)).fetchone()
+        return riga[0] if riga else None
+
+    def _colonne(self, con, tabella):
+        return [r[1] for r in con.execute(f"PRAGMA table_info({_nome_sql(tabella)})")]
+
+    def _modificato(self, con, foglio):
+        con.execute("UPDATE _fogli SET versione = versione + 1 WHERE foglio = ?", (foglio,))
+
+    def _posizioni_rowid(self, con, tabella):
+        """rowid di ogni riga in ordine: la posizione 0 è la prima riga dopo l'intestazione."""
+        return [r[0] for r in con.execute(f"SELECT rowid FROM {_nome_sql(tabella)} ORDER BY rowid")]
+
+    def _inserisci(self, con, tabella, colonne, righe):
+        segnaposto = ", ".join("?" * len(colonne))
+        con.executemany(
+            f"INSERT INTO {_nome_sql(tabella)} ({', '.join(_nome_sql(c) for c in colonne)}) VALUES ({segnaposto})",
+            righe,
+        )
+
+    def versione(self, foglio):
+        with self._connetti() as con:
+            riga = con.execute("SELECT versione FROM _fogli WHERE foglio = ?", (foglio,)).fetchone()
+        return riga[0] if riga else 0
+
+    def leggi(self, foglio, usecols=None, header=0, **opzioni):
+        """Come conn.read: header=None restituisce l'intestazione come prima riga di dati."""
+        with span("fogli", f"leggi {foglio}") as misura:
+            with self._connetti() as con:
+                tabella = self._tabella(con, foglio)
+                if tabella is None:
+                    # Foglio inesistente: vuoto, come ArchivioMemoria
+                    return pd.DataFrame()
+                colonne = self._colonne(con, tabella)
+                if usecols is not None:
+                    colonne = [colonne[c] for c in usecols if c < len(colonne)]
+                elenco = ", ".join(_nome_sql(c) for c in colonne)
+                df = pd.read_sql_query(f"SELECT {elenco} FROM {_nome_sql(tabella)} ORDER BY rowid", con)
+            if header is None:
+                df = pd.concat([pd.DataFrame([colonne], columns=colonne), df], ignore_index=True)
+                df.columns = range(len(colonne))
+            misura.celle = df.size
+        return df
+
+    def riscrivi(self, foglio, df):
+        """Ricrea la tabella del foglio con le colonne e le righe di df."""
+        colonne = colonne_uniche(df.columns)
+        righe = righe_per_foglio(df.set_axis(colonne, axis=1), colonne)
+        with span("fogli", f"riscrivi {foglio}", byte=byte_righe(righe), celle=len(righe) * len(colonne)):
+            with self._lock, self._connetti() as con:
+                tabella = self._tabella(con, foglio) or "foglio_" + "".join(c if c.isalnum() else "_" for c in foglio)
+                con.execute(f"DROP TABLE IF EXISTS {_nome_sql(tabella)}")
+                con.execute(f"CREATE TABLE {_nome_sql(tabella)} ({', '.join(_nome_sql(c) for c in colonne)})")
+                for colonna in self.indici.get(foglio, []):
+                    if colonna in colonne:
+                        con.execute(
+                            f"CREATE INDEX {_nome_sql(f'{tabella}_{colonna}')} "
+                            f"ON {_nome_sql(tabella)} ({_nome_sql(colonna)})"
+                        )
+                self._inserisci(con, tabella, colonne, righe)
+                con.execute(
+                    "INSERT INTO _fogli (foglio, tabella, versione) VALUES (?, ?, 1) "
+                    "ON CONFLICT(foglio) DO UPDATE SET versione = versione + 1",
+                    (foglio, tabella),
+                )
+
+    def intestazione(self, foglio):
+        with self._connetti() as con:
+            tabella = self._tabella(con, foglio)
+            return self._colonne(con, tabella) if tabella else []
+
+    def conta_righe(self, foglio):
+        with self._connetti() as con:
+            tabella = self._tabella(con, foglio)
+            return con.execute(f"SELECT COUNT(*) FROM {_nome_sql(tabella)}").fetchone()[0] if tabella else 0
+
+    def accoda(self, foglio, df_nuove, df_esistente):
+        if df_nuove.empty:
+            return True
+        intestazione = self.intestazione(foglio)
+        if not colonne_compatibili(intestazione, df_nuove.columns):
+            self.riscrivi(foglio, pd.concat([righe_esistenti(df_esistente), df_nuove], ignore_index=True))
+            return False
+        righe = righe_per_foglio(df_nuove, intestazione)
+        with span("fogli", f"accoda {foglio}", byte=byte_righe(righe), celle=len(righe) * len(intestazione)):
+            with self._lock, self._connetti() as con:
+                tabella = self._tabella(con, foglio)
+                self._inserisci(con, tabella, intestazione, righe)
+                self._modificato(con, foglio)
+        return True
+
+    def aggiorna_celle(self, foglio, celle, intestazione=None):
+        with span("fogli", f"aggiorna celle {foglio}", celle=len(celle)):
+            with self._lock, self._connetti() as con:
+                tabella = self._tabella(con, foglio)
+                intestazione = self._colonne(con, tabella)
+                rowid = self._posizioni_rowid(con, tabella)
+                for pos, colonna, valore in celle:
+                    if colonna in intestazione and pos < len(rowid):
+                        con.execute(
+                            f"UPDATE {_nome_sql(tabella)} SET {_nome_sql(colonna)} = ? WHERE rowid = ?",
+                            (_valore_cella(valore), rowid[pos]),
+                        )
+                self._modificato(con, foglio)
+
+    def applica_modifiche(self, foglio, modifiche):
+        """Change-set in un'unica transazione: UPDATE per cella, DELETE per rowid, INSERT in coda."""
+        with span("fogli", f"modifiche {foglio}") as misura:
+            with self._lock, self._connetti() as con:
+                tabella = self._tabella(con, foglio)
+                intestazione = self._colonne(con, tabella)
+                righe = con.execute(f"SELECT rowid, \"Firma\" FROM {_nome_sql(tabella)} ORDER BY rowid").fetchall()
+                rowid = [r[0] for r in righe]
+                posizioni = posizioni_per_firma([r[1] for r in righe])
+
+                for firma, occ, valori in modifiche.modificate:
+                    pos = posizioni.get((firma, occ))
+                    if pos is None:
+                        continue
+                    for colonna, valore in valori.items():
+                        if colonna in intestazione:
+                            con.execute(
+                                f"UPDATE {_nome_sql(tabella)} SET {_nome_sql(colonna)} = ? WHERE rowid = ?",
+                                (_valore_cella(valore), rowid[pos]),
+                            )
+                            misura.celle += 1
+
+                da_eliminare = [(rowid[posizioni[k]],) for k in modifiche.eliminate if k in posizioni]
+                con.executemany(f"DELETE FROM {_nome_sql(tabella)} WHERE rowid = ?", da_eliminare)
+
+                if len(modifiche.inserite):
+                    nuove = righe_per_foglio(modifiche.inserite, intestazione)
+                    self._inserisci(con, tabella, intestazione, nuove)
+                    misura.celle += len(nuove) * len(intestazione)
+                self._modificato(con, foglio)
+
+    # --- Filtri e aggregati calcolati da SQLite ---
+
+    def transazioni(self, da=None, a=None, categorie=None, tipi=None, foglio="DB_TRANSAZIONI"):
+        """Come Archivio.transazioni, ma il filtro usa gli indici su Data e Categoria."""
+        condizioni, parametri = [], []
+        if da is not None:
+            condizioni.append('"Data" >= ?')
+            parametri.append(pd.Timestamp(da).strftime("%Y-%m-%d"))
+        if a is not None:
+            # Le date possono avere anche l'ora: si confronta con il giorno successivo
+            condizioni.append('"Data" < ?')
+            parametri.append((pd.Timestamp(a) + pd.Timedelta(days=1)).strftime("%Y-%m-%d"))
+        if categorie:
+            condizioni.append(f'TRIM("Categoria") IN ({", ".join("?" * len(categorie))})')
+            parametri.extend(categorie)
+        if tipi:
+            condizioni.append(f'"Tipo" IN ({", ".join("?" * len(tipi))})')
+            parametri.extend(tipi)
+        dove = f"WHERE {' AND '.join(condizioni)}" if condizioni else ""
+        with span("fogli", f"transazioni {foglio}") as misura:
+            with self._connetti() as con:
+                tabella = self._tabella(con, foglio)
+                if tabella is None:
+                    return pd.DataFrame(columns=COLONNE_REGISTRO)
+                elenco = ", ".join(_nome_sql(c) for c in self._colonne(con, tabella)[:len(COLONNE_REGISTRO)])
+                df = pd.read_sql_query(
+                    f"SELECT {elenco} FROM {_nome_sql(tabella)} {dove} ORDER BY rowid", con, params=parametri
+                )
+            misura.celle = df.size
+        return df
+
+    def totali(self, da=None, a=None, foglio="DB_TRANSAZIONI"):
+        """Come Archivio.totali, calcolato con un GROUP BY senza trasferire le singole righe."""
+        # Date scritte dall'app: YYYY-MM-DD (eventualmente con l'ora)
+        condizioni, parametri = ["\"Data\" GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"], []
+        if da is not None:
+            condizioni.append('"Data" >= ?')
+            parametri.append(pd.Timestamp(da).strftime("%Y-%m-%d"))
+        if a is not None:
+            condizioni.append('"Data" < ?')
+            parametri.append((pd.Timestamp(a) + pd.Timedelta(days=1)).strftime("%Y-%m-%d"))
+        with span("fogli", f"totali {foglio}") as misura:
+            with self._connetti() as con:
+                tabella = self._tabella(con, foglio)
+                if tabella is None:
+                    return pd.DataFrame(columns=["Anno", "MeseNum", "Categoria", "Tipo", "Importo"])
+                df = pd.read_sql_query(
+                    f"""
+                    SELECT CAST(substr("Data", 1, 4) AS INTEGER) AS Anno,
+                           CAST(substr("Data", 6, 2) AS INTEGER) AS MeseNum,
+                           TRIM(CAST("Categoria" AS TEXT)) AS Categoria,
+                           "Tipo" AS Tipo,
+                           SUM(CASE WHEN typeof("Importo") IN ('integer', 'real') THEN "Importo"
+                                    ELSE CAST("Importo" AS REAL) END) AS Importo
+                    FROM {_nome_sql(tabella)}
+                    WHERE {' AND '.join(condizioni)}
+                    GROUP BY 1, 2, 3, 4
+                    ORDER BY 1, 2, 3, 4
+                    """,
+                    con,
+                    params=parametri,
+                )
+            misura.celle = df.size
+        return df
+
+    def importa(self, sorgente, fogli):
+        """Copia i fogli indicati da un altro backend (es. Google Sheets) per lavorare offline."""
+        copiati = []
+        for foglio in fogli:
+            try:
+                df = sorgente.leggi(foglio, ttl=0)
+            except Exception:
+                continue
+            self.riscrivi(foglio, df)
+            copiati.append(foglio)
+        return copiati
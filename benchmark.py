@@ -0,0 +1,765 @@
+"""
+Benchmark delle parti critiche dell'app su dati sintetici.
+Uso: python benchmark.py [--solo pipeline,ricerca] [--dimensioni 1000,10000] [--json risultati.json]
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import string
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from analisi import (
+    MESI_BUDGET, CuboBudget, CuboGiornaliero, CuboMensile, IndiceSaldi, Interrogazioni,
+    normalizza_budget, prepara_registro, tabella_kpi,
+)
+from archivio import Archivio, ArchivioFogli, ArchivioMemoria, ArchivioSQLite, lettera_colonna
+from cache_locale import CacheLocale, VersioniFogli
+from categorizzatore import Categorizzatore
+from firme import IndiceFirme
+from ingestione import CodaMail, LavoratoreMail, analizza_mail
+from modifiche import calcola_modifiche
+from parole_chiave import ArchivioParole
+from parser_banche import REGISTRO_BANCHE
+from partizioni import Registro, partiziona
+from posta import StatoSync
+from ricerca import IndiceRicerca
+
+CATEGORIE_BENCH = ["DA VERIFICARE", "CARBURANTE", "PRANZO", "VARIE", "SPOTIFY", "PERSONALE", "AUTO", "CASA"]
+# Estratto di MAPPA_KEYWORD (app.py non è importabile fuori da Streamlit)
+MAPPA_KEYWORD_BENCH = {"lidl": "PRANZO", "bar ": "PRANZO", "eni": "CARBURANTE", "amazon": "VARIE", "paypal": "PERSONALE"}
+
+
+# Un record per misura: {"benchmark": ..., parametri e metriche}
+RISULTATI = []
+
+
+def misura(funzione, ripetizioni):
+    """Restituisce il tempo medio (in microsecondi) di una chiamata."""
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        funzione()
+    return (time.perf_counter() - inizio) / ripetizioni * 1e6
+
+
+def registra(benchmark, **valori):
+    """Salva il record (per l'output JSON) e lo stampa su una riga."""
+    RISULTATI.append({"benchmark": benchmark, **valori})
+    campi = "  ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in valori.items())
+    print(f"{benchmark:<16} {campi}")
+
+
+def genera_keyword(n, rng):
+    """Genera n parole chiave casuali associate a categorie esistenti."""
+    return {
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 12))): rng.choice(CATEGORIE_BENCH)
+        for _ in range(n)
+    }
+
+
+def genera_descrizioni(n, rng):
+    """Genera descrizioni in stile Widiba (esercente + città)."""
+    esercenti = ["LIDL 1234", "AMAZON EU SARL", "ENI STATION 22", "PAYPAL *NETFLIX", "FARMACIA CENTRALE", "BAR DA MARIO"]
+    return [f"{rng.choice(esercenti)} {rng.randint(100, 999)} MILANO" for _ in range(n)]
+
+
+def genera_corpi_mail(n, rng):
+    """Genera un corpus di mail (mittente, corpo) in stile Widiba, con qualche mail non bancaria."""
+    modelli = [
+        ("notifiche@widiba.it", "Gentile Cliente, ti informiamo che è stato effettuato un pagamento con carta di {imp} euro presso {esc}. Widiba"),
+        ("notifiche@widiba.it", "Gentile Cliente, è stato disposto un bonifico di {imp} euro a favore di {esc}. IBAN IT77J0338501601100000720458."),
+        ("notifiche@widiba.it", "Widiba: hai ricevuto {imp} euro da {esc}. Saldo aggiornato."),
+        ("notifiche@widiba.it", "Ti confermiamo l'accredito per {esc} di {imp} euro sul tuo conto Widiba."),
+        ("newsletter@negozio.it", "Scopri le offerte della settimana su {esc}, sconti fino al 50%."),
+    ]
+    esercenti = ["LIDL MILANO", "AMAZON EU SARL", "ENI STATION 22", "PAYPAL EUROPE", "Mario Rossi", "ESSELUNGA"]
+    corpus = []
+    for _ in range(n):
+        mittente, modello = rng.choice(modelli)
+        importo = f"{rng.randint(1, 2500)},{rng.randint(0, 99):02d}"
+        corpus.append((mittente, modello.format(imp=importo, esc=rng.choice(esercenti))))
+    return corpus
+
+
+def genera_budget(anni, n_categorie, rng):
+    """Genera DB_BUDGET grezzo (12 mesi x categorie x anni) con i formati misti visti nel foglio."""
+    mesi = [["Gen", "gennaio", "1", "01"], ["Feb", "febbraio", "2"], ["Mar", "3"], ["Apr", "aprile"],
+            ["Mag", "5"], ["Giu", "giugno"], ["Lug", "7"], ["Ago", "agosto"], ["Set", "09"],
+            ["Ott", "10"], ["Nov", "novembre"], ["Dic", "12"]]
+    righe = []
+    for _ in range(anni):
+        for m in mesi:
+            for c in range(n_categorie):
+                tipo = rng.choice(["Uscite", "spesa", " USCITA"]) if c % 3 else rng.choice(["Entrate", "Ricavi"])
+                importo = rng.choice([f"{rng.randint(1, 9)}.{rng.randint(100, 999)},{rng.randint(0, 99):02d}",
+                                      f"{rng.randint(1, 999)},50", f"€{rng.randint(1, 999)}", float(rng.randint(1, 999))])
+                righe.append([f" {rng.choice(m)} ", f"CAT {c}", tipo, importo])
+    return pd.DataFrame(righe, columns=["Mese", "Categoria", "Tipo", "Importo"])
+
+
+def genera_registro(n, seed=3, anni=(2022, 2023, 2024, 2025, 2026)):
+    """Genera DB_TRANSAZIONI già ripulito (come dopo prepara_registro) con n transazioni."""
+    rng = np.random.default_rng(seed)
+    giorni = pd.Timestamp(f"{anni[0]}-01-01") + pd.to_timedelta(rng.integers(0, 365 * len(anni), n), unit="D")
+    descrizioni = genera_descrizioni(1_000, random.Random(seed))
+    tipo = rng.choice(["Entrata", "Uscita"], n, p=[0.2, 0.8])
+    df = pd.DataFrame({
+        "Data": giorni,
+        "Descrizione": np.array(descrizioni)[rng.integers(0, len(descrizioni), n)],
+        "Importo": rng.uniform(1, 800, n).round(2),
+        "Tipo": tipo,
+        "Categoria": np.array(CATEGORIE_BENCH)[rng.integers(0, len(CATEGORIE_BENCH), n)],
+        "Mese": giorni.strftime("%b-%y"),
+        "Firma": [f"BENCH-{i:08d}" for i in range(n)],
+    })
+    return prepara_registro(df)
+
+
+def foglio_registro(df_registro):
+    """DB_TRANSAZIONI come arriva dal foglio: 7 colonne, Data come testo."""
+    df = df_registro[["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"]].copy()
+    df["Data"] = df["Data"].dt.strftime("%Y-%m-%d")
+    return df
+
+
+# ==============================================================================
+# SOSTITUTO IN MEMORIA DI GSheetsConnection
+# ==============================================================================
+
+def _cella_a1(riferimento):
+    """'B12' -> (posizione riga dati, indice colonna), con riga 2 = prima riga di dati."""
+    lettere = "".join(c for c in riferimento if c.isalpha())
+    colonna = 0
+    for c in lettere:
+        colonna = colonna * 26 + ord(c.upper()) - 64
+    return int(riferimento[len(lettere):]) - 2, colonna - 1
+
+
+class FoglioMemoria:
+    """Worksheet gspread simulato: solo i metodi usati da ArchivioFogli."""
+
+    def __init__(self, conn, nome):
+        self.conn = conn
+        self.nome = nome
+        self.id = abs(hash(nome)) % 10_000
+        self.spreadsheet = self
+
+    @property
+    def _df(self):
+        return self.conn.fogli[self.nome]
+
+    def row_values(self, riga):
+        self.conn._chiamata()
+        return [str(c) for c in self._df.columns] if riga == 1 else [str(v) for v in self._df.iloc[riga - 2]]
+
+    def col_values(self, colonna):
+        self.conn._chiamata()
+        return [str(self._df.columns[colonna - 1])] + ["" if pd.isna(v) else str(v) for v in self._df.iloc[:, colonna - 1]]
+
+    def get_all_values(self):
+        self.conn._chiamata()
+        df = self._df.astype(object)
+        return [[str(c) for c in df.columns]] + [["" if pd.isna(v) else str(v) for v in riga] for riga in df.itertuples(index=False)]
+
+    def append_rows(self, righe, value_input_option=None):
+        self.conn._chiamata()
+        nuove = pd.DataFrame(righe, columns=self._df.columns)
+        self.conn._scrivi(self.nome, pd.concat([self._df, nuove], ignore_index=True), nuove.size)
+
+    def batch_update(self, celle, value_input_option=None):
+        self.conn._chiamata()
+        if isinstance(celle, dict):
+            # spreadsheet.batch_update: solo richieste deleteDimension
+            posizioni = [r["deleteDimension"]["range"]["startIndex"] - 1 for r in celle["requests"]]
+            self.conn._scrivi(self.nome, self._df.drop(self._df.index[posizioni]).reset_index(drop=True), len(posizioni))
+            return
+        df = self._df.astype(object)
+        for cella in celle:
+            riga, colonna = _cella_a1(cella["range"])
+            df.iat[riga, colonna] = cella["values"][0][0]
+        self.conn._scrivi(self.nome, df, len(celle))
+
+    def get_lastUpdateTime(self):
+        self.conn._chiamata()
+        return f"v{self.conn.versione_file}"
+
+
+class ConnessioneMemoria:
+    """
+    Sostituto di GSheetsConnection per benchmark e sviluppo offline: read/update sui
+    DataFrame in memoria più un client con _select_worksheet per le scritture parziali.
+    `latenza` (secondi) simula il tempo di rete di ogni chiamata.
+    """
+
+    def __init__(self, fogli=None, latenza=0.0):
+        self.fogli = {nome: df.copy() for nome, df in (fogli or {}).items()}
+        self.latenza = latenza
+        self.versione_file = 0
+        self.chiamate = 0
+        self.celle_lette = 0
+        self.celle_scritte = 0
+        self.client = self
+
+    def _chiamata(self):
+        self.chiamate += 1
+        if self.latenza:
+            time.sleep(self.latenza)
+
+    def _scrivi(self, foglio, df, celle):
+        self.fogli[foglio] = df
+        self.celle_scritte += celle
+        self.versione_file += 1
+
+    def read(self, worksheet, usecols=None, header=0, ttl=None, **opzioni):
+        self._chiamata()
+        df = self.fogli[worksheet]
+        if header is None:
+            df = pd.concat([pd.DataFrame([list(df.columns)], columns=df.columns), df], ignore_index=True)
+            df.columns = range(len(df.columns))
+        if usecols is not None:
+            df = df.iloc[:, [c for c in usecols if c < len(df.columns)]]
+        self.celle_lette += df.size
+        return df.copy()
+
+    def update(self, worksheet, data):
+        self._chiamata()
+        self._scrivi(worksheet, data.reset_index(drop=True).copy(), data.size + len(data.columns))
+
+    def create(self, worksheet, data):
+        self._chiamata()
+        self._scrivi(worksheet, data.reset_index(drop=True).copy(), data.size + len(data.columns))
+
+    def _select_worksheet(self, worksheet):
+        if worksheet not in self.fogli:
+            raise KeyError(worksheet)
+        return FoglioMemoria(self, worksheet)
+
+
+class MailMemoria:
+    """MailMessage di imap_tools simulato: solo gli attributi letti dall'app."""
+
+    def __init__(self, uid, mittente, soggetto, corpo, data):
+        self.uid = str(uid)
+        self.from_ = mittente
+        self.subject = soggetto
+        self.text = corpo
+        self.html = ""
+        self.date = data
+        self.headers = {"message-id": (f"<{uid}@bench>",)}
+        self.size = len(corpo)
+
+
+class CartellaMemoria:
+    def __init__(self, casella):
+        self.casella = casella
+
+    def status(self, cartella, voci):
+        self.casella._chiamata()
+        return {"MESSAGES": len(self.casella.mail), "UIDNEXT": self.casella.uid_prossimo, "UIDVALIDITY": 1}
+
+
+class CasellaMemoria:
+    """
+    Sostituto locale di MailBox (imap_tools) per provare la lettura mail senza server:
+    status, UID SEARCH (criteri FROM/SUBJECT/BODY in OR più l'intervallo UID n:*) e
+    UID FETCH. `latenza` (secondi) simula il tempo di rete di ogni comando.
+    """
+
+    def __init__(self, latenza=0.0):
+        self.mail = {}
+        self.uid_prossimo = 1
+        self.latenza = latenza
+        self.chiamate = 0
+        self.folder = CartellaMemoria(self)
+
+    def _chiamata(self):
+        self.chiamate += 1
+        if self.latenza:
+            time.sleep(self.latenza)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *errore):
+        return False
+
+    def arriva(self, mittente, corpo, data=None, soggetto="Notifica"):
+        """Consegna una mail nella casella; restituisce il suo UID."""
+        uid = self.uid_prossimo
+        self.uid_prossimo += 1
+        self.mail[uid] = MailMemoria(uid, mittente, soggetto, corpo, data or datetime.now(timezone.utc))
+        return uid
+
+    def uids(self, criteri):
+        self._chiamata()
+        testo = str(criteri)
+        intervallo = re.search(r"UID (\d+):\*", testo)
+        uid_min = int(intervallo.group(1)) if intervallo else 1
+        regole = [(campo, valore.lower()) for campo, valore in re.findall(r'(FROM|SUBJECT|BODY) "([^"]*)"', testo)]
+        campi = {"FROM": lambda m: m.from_, "SUBJECT": lambda m: m.subject, "BODY": lambda m: m.text}
+        # Come IMAP, "UID n:*" include sempre l'ultimo messaggio
+        candidati = [u for u in self.mail if u >= uid_min] or list(self.mail)[-1:]
+        return [
+            str(u) for u in candidati
+            if not regole or any(valore in campi[campo](self.mail[u]).lower() for campo, valore in regole)
+        ]
+
+    def fetch(self, uid_list, mark_seen=False, bulk=True):
+        self._chiamata()
+        return iter([self.mail[int(u)] for u in uid_list if int(u) in self.mail])
+
+
+def normalizza_budget_riga_per_riga(df_bud):
+    """Vecchia versione di get_budget_data (apply riga per riga), come riferimento."""
+    df_bud = df_bud.fillna(0)
+    for col in ["Mese", "Categoria", "Tipo"]:
+        df_bud[col] = df_bud[col].astype(str).str.strip()
+
+    def normalizza_mese(val):
+        v = str(val).strip().lower()
+        for i, pre in enumerate(["gen", "feb", "mar", "apr", "mag", "giu", "lug", "ago", "set", "ott", "nov", "dic"], 1):
+            if v.startswith(pre) or v in [str(i), f"{i:02d}"]:
+                return pre.capitalize()
+        return v.capitalize()
+
+    def normalizza_tipo(val):
+        v = str(val).strip().lower()
+        if 'usc' in v or 'spes' in v:
+            return 'Uscita'
+        if 'ent' in v or 'ric' in v:
+            return 'Entrata'
+        return v.capitalize()
+
+    def pulisci_numero(val):
+        s = str(val).strip().replace('€', '')
+        if '.' in s and ',' in s:
+            s = s.replace('.', '').replace(',', '.')
+        elif ',' in s:
+            s = s.replace(',', '.')
+        return s
+
+    df_bud["Mese"] = df_bud["Mese"].apply(normalizza_mese)
+    df_bud["Tipo"] = df_bud["Tipo"].apply(normalizza_tipo)
+    df_bud["Importo"] = pd.to_numeric(df_bud["Importo"].apply(pulisci_numero), errors='coerce').fillna(0)
+    return df_bud
+
+
+# ==============================================================================
+# BENCHMARK: trova_categoria_smart
+# ==============================================================================
+
+def bench_categorizzatore(dimensioni=(100, 1_000, 10_000, 50_000)):
+    """Costo per descrizione del categorizzatore compilato al crescere di DB_KEYWORDS."""
+    rng = random.Random(42)
+    descrizioni = genera_descrizioni(500, rng)
+    for n in dimensioni:
+        mappa = genera_keyword(n, rng)
+        inizio = time.perf_counter()
+        cat = Categorizzatore(mappa, CATEGORIE_BENCH, MAPPA_KEYWORD_BENCH)
+        build_ms = (time.perf_counter() - inizio) * 1000
+        us = misura(lambda: [cat.classifica(d) for d in descrizioni], 5) / len(descrizioni)
+        registra("categorizzatore", keyword=n, build_ms=build_ms, per_descrizione_us=us)
+
+
+def bench_apprendimento(dimensioni=(1_000, 10_000, 50_000), n_regole=20):
+    """Costo di un salvataggio che impara n_regole parole al crescere di DB_KEYWORDS."""
+    rng = random.Random(13)
+    for n in dimensioni:
+        mappa = genera_keyword(n, rng)
+        archivio = ArchivioMemoria({"DB_KEYWORDS": pd.DataFrame({"Parola": list(mappa), "Categoria": list(mappa.values())})})
+        parole = ArchivioParole(archivio)
+        parole.sincronizza(archivio.versione("DB_KEYWORDS"))
+        cat = parole.categorizzatore(CATEGORIE_BENCH, MAPPA_KEYWORD_BENCH)
+        archivio.celle_scritte = 0
+        regole = list(genera_keyword(n_regole // 2, rng).items()) + [(p, "CASA") for p in list(mappa)[:n_regole // 2]]
+        inizio = time.perf_counter()
+        parole.impara(regole)
+        impara_ms = (time.perf_counter() - inizio) * 1000
+        assert cat.classifica(f"x {regole[-1][0]} y") == "CASA"
+        registra("apprendimento", keyword=n, regole=n_regole, impara_ms=impara_ms, celle_scritte=archivio.celle_scritte)
+
+
+# ==============================================================================
+# BENCHMARK: parsing mail bancarie
+# ==============================================================================
+
+def bench_parser_mail(n_mail=5_000):
+    """Throughput (mail/secondo) di instradamento per mittente + parsing sul corpus sintetico."""
+    corpus = genera_corpi_mail(n_mail, random.Random(7))
+
+    def analizza_tutto():
+        for mittente, corpo in corpus:
+            parser = REGISTRO_BANCHE.trova(mittente, corpo)
+            if parser is not None:
+                parser.analizza(corpo)
+
+    us = misura(analizza_tutto, 3)
+    registra("parser_mail", mail=n_mail, mail_al_secondo=n_mail / (us / 1e6))
+
+
+def bench_ingestione(n_mail=2_000, lotti=5, lotto=50, latenza=0.02):
+    """
+    Lettura mail con il thread in background su CasellaMemoria: throughput di un ciclo
+    (status + search + fetch + analisi + coda), ritardo arrivo -> coda a regime e tempo
+    con cui IMPORTA legge le transazioni pronte.
+    """
+    rng = random.Random(11)
+    corpus = genera_corpi_mail(n_mail, rng)
+    bancarie = [m for m in corpus if "widiba" in m[0]]
+    cat = Categorizzatore(genera_keyword(1_000, rng), CATEGORIE_BENCH, MAPPA_KEYWORD_BENCH)
+    indice = IndiceFirme(pd.DataFrame(columns=["Firma"]))
+    casella = CasellaMemoria(latenza=latenza)
+    inizio_mail = datetime.now(timezone.utc) - timedelta(days=30)
+    for i, (mittente, corpo) in enumerate(corpus):
+        casella.arriva(mittente, corpo, inizio_mail + timedelta(minutes=i))
+
+    with tempfile.TemporaryDirectory() as cartella:
+        coda = CodaMail(f"{cartella}/coda.sqlite")
+        lavoratore = LavoratoreMail(
+            lambda: casella, lambda messaggi: analizza_mail(messaggi, lambda d, t: cat.classifica(d), lambda anno: indice),
+            coda, "bench", intervallo=0.1, percorso_stato=f"{cartella}/sync.json",
+        )
+        # Punto di ripresa sul primo UID: il ciclo legge tutte le altre mail della casella
+        StatoSync(lavoratore.percorso_stato).salva("bench", 1, 1)
+        inizio = time.perf_counter()
+        statistiche = lavoratore.ciclo()
+        ciclo_ms = (time.perf_counter() - inizio) * 1000
+        mail_al_secondo = lavoratore.metriche()["mail_al_secondo"]
+
+        # A regime: lotti di mail che arrivano mentre il thread legge ogni 0.1 s
+        lavoratore.avvia()
+        ritardi = []
+        for _ in range(lotti):
+            prima = len(coda)
+            arrivo = time.perf_counter()
+            for mittente, corpo in rng.sample(bancarie, lotto):
+                casella.arriva(mittente, corpo)
+            while len(coda) == prima and time.perf_counter() - arrivo < 5:
+                time.sleep(0.005)
+            ritardi.append((time.perf_counter() - arrivo) * 1000)
+        lavoratore.ferma(5)
+        metriche = lavoratore.metriche()
+        registra(
+            "ingestione", mail=n_mail, in_coda=statistiche["in_coda"], ciclo_ms=ciclo_ms,
+            mail_al_secondo=mail_al_secondo, ritardo_medio_ms=float(np.mean(ritardi)),
+            ritardo_max_ms=max(ritardi), errori=metriche["errori"],
+            pronte_ms=misura(coda.pronte, 5) / 1000, righe_pronte=len(coda),
+        )
+
+
+# ==============================================================================
+# BENCHMARK: caricamento budget
+# ==============================================================================
+
+def bench_budget(anni=10, n_categorie=50):
+    """Normalizzazione vettoriale di DB_BUDGET contro il vecchio apply riga per riga."""
+    grezzo = genera_budget(anni, n_categorie, random.Random(11))
+    vettoriale = normalizza_budget(grezzo.copy())
+    assert vettoriale.equals(normalizza_budget_riga_per_riga(grezzo.copy())), "risultati diversi"
+    us_vett = misura(lambda: normalizza_budget(grezzo.copy()), 10)
+    us_riga = misura(lambda: normalizza_budget_riga_per_riga(grezzo.copy()), 10)
+    registra("budget", righe=len(grezzo), vettoriale_ms=us_vett / 1000, riga_per_riga_ms=us_riga / 1000)
+
+
+# ==============================================================================
+# BENCHMARK: rerun con tutte le schede contro la sola vista attiva
+# ==============================================================================
+
+def calcoli_per_vista(df, df_budget):
+    """Parte dati (senza widget) di ogni vista dell'app, come funzioni senza argomenti."""
+    cubo, indice = CuboMensile(df), IndiceSaldi(df)
+    anno, mesi = int(df["Anno"].max()), [1, 2, 3]
+    mesi_nomi = ["Gen", "Feb", "Mar"]
+
+    def bilancio():
+        prev = df_budget[df_budget["Mese"].isin(mesi_nomi)].groupby(["Categoria", "Tipo"])["Importo"].sum()
+        pd.merge(prev.reset_index(), cubo.periodo(anno, mesi), on=["Categoria", "Tipo"], how="outer")
+        indice.saldo_apertura(anno, 1)
+
+    def kpi():
+        tabella_kpi(df, df_budget, 10_000.0, indice=indice)
+        per = df[(df["Anno"] == anno) & (df["MeseNum"].isin(mesi))]
+        per.groupby(["Data", "Tipo"])["Importo"].sum().unstack()
+
+    def grafica():
+        prev = df_budget[df_budget["Mese"].isin(mesi_nomi)].groupby(["Categoria", "Tipo"])["Importo"].sum()
+        pd.merge(prev.reset_index(), cubo.periodo(anno, mesi), on=["Categoria", "Tipo"], how="left")
+
+    def storico():
+        vista = df.copy()
+        vista["_Anno_Filtro"] = vista["Data"].dt.year
+        vista["_Mese_Num"] = vista["Data"].dt.month
+        vista = vista[vista["_Anno_Filtro"].isin([anno]) & vista["Tipo"].isin(["Uscita"])]
+        vista[vista["Descrizione"].str.contains("amazon", case=False, na=False)]
+
+    return {"bilancio": bilancio, "kpi": kpi, "grafica": grafica, "storico": storico}
+
+
+def bench_viste(dimensioni=(10_000, 100_000)):
+    """Latenza di un rerun: prima (st.tabs calcola tutto) e dopo (solo la vista mostrata)."""
+    df_budget = normalizza_budget(genera_budget(1, 30, random.Random(5)))
+    for n in dimensioni:
+        viste = calcoli_per_vista(genera_registro(n), df_budget)
+        tempi = {nome: misura(f, 5) / 1000 for nome, f in viste.items()}
+        registra("viste", righe=n, tutte_le_schede_ms=sum(tempi.values()), **{f"{nome}_ms": ms for nome, ms in tempi.items()})
+
+
+# ==============================================================================
+# BENCHMARK: filtri dello STORICO
+# ==============================================================================
+
+def bench_ricerca(n=500_000, query=("amazon", "lidl 12", "ma")):
+    """Ricerca testuale + filtri con l'indice contro str.contains/isin sull'intero registro."""
+    df = genera_registro(n)
+    inizio = time.perf_counter()
+    indice = IndiceRicerca(df)
+    build_ms = (time.perf_counter() - inizio) * 1000
+    anno = int(df["Anno"].max())
+    registra("ricerca", righe=n, build_ms=build_ms)
+    for q in query:
+        vecchio = (df["Anno"].isin([anno]) & df["Tipo"].isin(["Uscita"])
+                   & df["Descrizione"].str.contains(q, case=False, na=False)).to_numpy()
+        assert (indice.filtra(anni=[anno], tipi=["Uscita"], testo=q) == vecchio).all(), q
+        us_idx = misura(lambda: indice.filtra(anni=[anno], tipi=["Uscita"], testo=q), 10)
+        us_pd = misura(lambda: df["Anno"].isin([anno]) & df["Tipo"].isin(["Uscita"])
+                       & df["Descrizione"].str.contains(q, case=False, na=False), 3)
+        registra("ricerca", righe=n, query=q, indice_ms=us_idx / 1000, str_contains_ms=us_pd / 1000)
+
+
+# ==============================================================================
+# BENCHMARK: interrogazioni sui cubi contro le catene pandas sul registro
+# ==============================================================================
+
+def bilancio_pandas(df, df_bud, anno, mesi):
+    """Budget vs reale come lo calcolavano le viste: filtro sul registro, groupby e merge."""
+    nomi = [MESI_BUDGET[m - 1] for m in mesi]
+    reale = df[(df["Anno"] == anno) & df["MeseNum"].isin(mesi)].groupby(["Categoria", "Tipo"])["Importo"].sum()
+    budget = df_bud[df_bud["Mese"].isin(nomi)].groupby(["Categoria", "Tipo"])["Importo"].sum()
+    return pd.merge(
+        budget.reset_index().rename(columns={"Importo": "Budget"}),
+        reale.reset_index().rename(columns={"Importo": "Reale"}),
+        on=["Categoria", "Tipo"], how="outer",
+    ).fillna(0)
+
+
+def andamento_pandas(df, anno, mesi):
+    per = df[(df["Anno"] == anno) & df["MeseNum"].isin(mesi)]
+    giorni = per.groupby(["Data", "Tipo"])["Importo"].sum().unstack().fillna(0)
+    giorni["Netto"] = giorni["Entrata"] - giorni["Uscita"]
+    giorni["Saldo Cumulativo"] = giorni["Netto"].cumsum()
+    return giorni
+
+
+def bench_interrogazioni(n=1_000_000, n_categorie=50):
+    """Budget vs reale, ripartizioni e andamento: catene pandas sul registro contro Interrogazioni."""
+    df = genera_registro(n)
+    bud = normalizza_budget(genera_budget(1, n_categorie, random.Random(5)))
+    inizio = time.perf_counter()
+    interrogazioni = Interrogazioni(CuboMensile(df), CuboBudget(bud), CuboGiornaliero(df))
+    build_ms = (time.perf_counter() - inizio) * 1000
+    anno = int(df["Anno"].max())
+    registra("interrogazioni", righe=n, build_ms=build_ms)
+    for nome, mesi in (("mese", [3]), ("trimestre", [1, 2, 3]), ("anno", list(range(1, 13)))):
+        pd.testing.assert_frame_equal(
+            bilancio_pandas(df, bud, anno, mesi).sort_values(["Categoria", "Tipo"], ignore_index=True),
+            interrogazioni.budget_vs_reale(anno, mesi).sort_values(["Categoria", "Tipo"], ignore_index=True),
+            check_dtype=False,
+        )
+
+        def nuovo():
+            confronto = interrogazioni.budget_vs_reale(anno, mesi)
+            interrogazioni.totali_periodo(confronto)
+            interrogazioni.ripartizione(confronto, "Uscita")
+            interrogazioni.ripartizione(confronto, "Entrata")
+
+        registra(
+            "interrogazioni", righe=n, periodo=nome,
+            bilancio_pandas_ms=misura(lambda: bilancio_pandas(df, bud, anno, mesi), 3) / 1000,
+            bilancio_cubi_ms=misura(nuovo, 10) / 1000,
+            andamento_pandas_ms=misura(lambda: andamento_pandas(df, anno, mesi), 3) / 1000,
+            andamento_cubi_ms=misura(lambda: interrogazioni.andamento_giornaliero(anno, mesi), 10) / 1000,
+        )
+
+
+# ==============================================================================
+# BENCHMARK: archivio SQLite, filtri e aggregati calcolati in SQL
+# ==============================================================================
+
+def bench_sqlite(dimensioni=(10_000, 100_000)):
+    """
+    Sullo stesso file SQLite: foglio intero + filtro/groupby pandas (Archivio, come con
+    Google Sheets) contro transazioni()/totali() che filtrano e aggregano in SQL.
+    """
+    for n in dimensioni:
+        registro = foglio_registro(genera_registro(n))
+        with tempfile.TemporaryDirectory() as cartella:
+            sqlite = ArchivioSQLite(f"{cartella}/archivio.sqlite")
+            inizio = time.perf_counter()
+            sqlite.riscrivi("DB_TRANSAZIONI", registro)
+            import_ms = (time.perf_counter() - inizio) * 1000
+            mese = pd.Timestamp(registro["Data"].max()).replace(day=1)
+            fine = mese + pd.offsets.MonthEnd(0)
+            registra(
+                "sqlite", righe=n, import_ms=import_ms,
+                leggi_tutto_ms=misura(lambda: sqlite.leggi("DB_TRANSAZIONI"), 3) / 1000,
+                mese_pandas_ms=misura(lambda: Archivio.transazioni(sqlite, mese, fine), 3) / 1000,
+                mese_sql_ms=misura(lambda: sqlite.transazioni(mese, fine), 10) / 1000,
+                totali_pandas_ms=misura(lambda: prepara_registro(sqlite.leggi("DB_TRANSAZIONI")).groupby(
+                    ["Anno", "MeseNum", "Categoria", "Tipo"])["Importo"].sum(), 3) / 1000,
+                totali_sql_ms=misura(lambda: sqlite.totali(), 3) / 1000,
+            )
+
+
+def bench_partizioni(dimensioni=(100_000, 500_000), anni=(2020, 2021, 2022, 2023, 2024, 2025, 2026)):
+    """
+    Primo rerun a cache vuota passando da ArchivioFogli: registro unico (si scarica tutto)
+    contro registro diviso per anno (solo l'anno mostrato), più l'append di una riga.
+    """
+    for n in dimensioni:
+        registro = foglio_registro(genera_registro(n, anni=anni))
+        nuova = registro.tail(1).assign(Firma="BENCH-NUOVA")
+        tempi = {}
+        for modo in ("unico", "per_anno"):
+            conn = ConnessioneMemoria({"DB_TRANSAZIONI": registro})
+            archivio = ArchivioFogli(conn)
+            if modo == "per_anno":
+                partiziona(archivio)
+            with tempfile.TemporaryDirectory() as cartella:
+                reg = Registro(archivio, CacheLocale(f"{cartella}/fogli.sqlite"), VersioniFogli(archivio.versione, intervallo=0))
+                conn.celle_lette = 0
+                inizio = time.perf_counter()
+                _, df = reg.vista([anni[-1]])
+                CuboMensile(df)
+                tempi[f"{modo}_anno_ms"] = (time.perf_counter() - inizio) * 1000
+                tempi[f"{modo}_celle_lette"] = conn.celle_lette
+                inizio = time.perf_counter()
+                reg.accoda(nuova)
+                tempi[f"{modo}_append_ms"] = (time.perf_counter() - inizio) * 1000
+                inizio = time.perf_counter()
+                reg.vista()
+                tempi[f"{modo}_tutti_ms"] = (time.perf_counter() - inizio) * 1000
+        registra("partizioni", righe=n, anni=len(anni), **tempi)
+
+
+# ==============================================================================
+# BENCHMARK: pipeline completa sul sostituto di GSheetsConnection
+# ==============================================================================
+
+def bench_pipeline(dimensioni=(1_000, 10_000, 100_000), n_budget=50, n_keyword=5_000, n_mail=1_000):
+    """
+    Ogni fase dell'app con N transazioni, M righe di budget (12 mesi x n_budget categorie),
+    K parole imparate e un corpus di mail, passando da ArchivioFogli come nell'app.
+    """
+    rng = random.Random(17)
+    budget = genera_budget(1, n_budget, rng)
+    keyword = genera_keyword(n_keyword, rng)
+    corpus = genera_corpi_mail(n_mail, rng)
+    descrizioni = genera_descrizioni(500, rng)
+    for n in dimensioni:
+        registro = genera_registro(n)
+        conn = ConnessioneMemoria({
+            "DB_TRANSAZIONI": foglio_registro(registro),
+            "DB_BUDGET": budget,
+            "DB_KEYWORDS": pd.DataFrame({"Parola": list(keyword), "Categoria": list(keyword.values())}),
+        })
+        archivio = ArchivioFogli(conn)
+        tempi = {}
+
+        def carica_registro():
+            return prepara_registro(archivio.leggi("DB_TRANSAZIONI", usecols=list(range(7)), ttl=0))
+
+        tempi["caricamento_registro_ms"] = misura(carica_registro, 3) / 1000
+        with tempfile.TemporaryDirectory() as cartella:
+            cache = CacheLocale(f"{cartella}/fogli.sqlite")
+            inizio = time.perf_counter()
+            df = cache.carica("DB_TRANSAZIONI", "v1", carica_registro)
+            tempi["cache_fredda_ms"] = (time.perf_counter() - inizio) * 1000
+            tempi["cache_calda_ms"] = misura(lambda: cache.carica("DB_TRANSAZIONI", "v1", carica_registro), 10) / 1000
+            cache._memoria.clear()
+            tempi["cache_disco_ms"] = misura(lambda: (cache._memoria.clear(), cache.carica("DB_TRANSAZIONI", "v1", carica_registro)), 3) / 1000
+
+        bud = normalizza_budget(archivio.leggi("DB_BUDGET", usecols=list(range(4))))
+        tempi["budget_ms"] = misura(lambda: normalizza_budget(archivio.leggi("DB_BUDGET", usecols=list(range(4)))), 5) / 1000
+
+        cat = Categorizzatore(keyword, CATEGORIE_BENCH, MAPPA_KEYWORD_BENCH)
+        tempi["categoria_us"] = misura(lambda: [cat.classifica(d) for d in descrizioni], 3) / len(descrizioni)
+
+        def analizza_mail():
+            for mittente, corpo in corpus:
+                parser = REGISTRO_BANCHE.trova(mittente, corpo)
+                if parser is not None:
+                    parser.analizza(corpo)
+
+        tempi["parsing_mail_ms"] = misura(analizza_mail, 3) / 1000
+
+        viste = calcoli_per_vista(df, bud)
+        tempi["bilancio_ms"] = misura(viste["bilancio"], 5) / 1000
+        tempi["kpi_ms"] = misura(viste["kpi"], 5) / 1000
+
+        indice = IndiceRicerca(df)
+        anno = int(df["Anno"].max())
+
+        def storico():
+            vista = df[indice.filtra(anni=[anno], tipi=["Uscita"], testo="amazon")]
+            return vista.sort_values("Data", ascending=False, kind="stable").iloc[:100]
+
+        tempi["storico_filtri_ms"] = misura(storico, 5) / 1000
+
+        # Scritture: append di 20 righe e change-set di 10 celle
+        nuove = foglio_registro(genera_registro(20, seed=99))
+        conn.celle_scritte = 0
+        inizio = time.perf_counter()
+        archivio.accoda("DB_TRANSAZIONI", nuove, foglio_registro(df))
+        pagina = df.iloc[:10]
+        modificata = pagina.copy()
+        modificata["Categoria"] = "CASA"
+        archivio.applica_modifiche("DB_TRANSAZIONI", calcola_modifiche(pagina, modificata, df))
+        tempi["scritture_ms"] = (time.perf_counter() - inizio) * 1000
+
+        registra("pipeline", righe=n, budget=len(budget), keyword=n_keyword, mail=n_mail,
+                 chiamate_foglio=conn.chiamate, celle_scritte=conn.celle_scritte, **tempi)
+
+
+BENCHMARK = {
+    "categorizzatore": bench_categorizzatore,
+    "apprendimento": bench_apprendimento,
+    "parser_mail": bench_parser_mail,
+    "ingestione": bench_ingestione,
+    "budget": bench_budget,
+    "viste": bench_viste,
+    "ricerca": bench_ricerca,
+    "interrogazioni": bench_interrogazioni,
+    "sqlite": bench_sqlite,
+    "partizioni": bench_partizioni,
+    "pipeline": bench_pipeline,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--solo", help="benchmark da eseguire, separati da virgola (default: tutti)")
+    parser.add_argument("--dimensioni", help="numeri di transazioni per la pipeline, es. 1000,10000,100000")
+    parser.add_argument("--json", help="scrive i risultati in questo file (JSON)")
+    argomenti = parser.parse_args()
+
+    nomi = argomenti.solo.split(",") if argomenti.solo else list(BENCHMARK)
+    for nome in nomi:
+        if nome == "pipeline" and argomenti.dimensioni:
+            bench_pipeline([int(d) for d in argomenti.dimensioni.split(",")])
+        else:
+            BENCHMARK[nome]()
+
+    if argomenti.json:
+        with open(argomenti.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "data": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "risultati": RISULTATI,
+            }, f, indent=2, default=str)
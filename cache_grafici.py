@@ -0,0 +1,111 @@
+"""Cache delle figure Plotly: una figura si ricostruisce solo se cambiano dati o parametri."""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from prestazioni import misura_byte, span
+
+# Proprietà delle tracce che contengono le serie di dati
+_SERIE = ("x", "y", "z", "text", "hovertext", "customdata", "values", "labels", "ids", "parents")
+
+
+def impronta(valore):
+    """Impronta economica di un argomento: hash del contenuto per i DataFrame/Series, repr per il resto."""
+    if isinstance(valore, (pd.DataFrame, pd.Series)):
+        colonne = list(valore.columns) if isinstance(valore, pd.DataFrame) else [valore.name]
+        contenuto = pd.util.hash_pandas_object(valore, index=True).to_numpy().tobytes()
+        return f"{type(valore).__name__}{valore.shape}{colonne}:{hashlib.blake2b(contenuto, digest_size=16).hexdigest()}"
+    if isinstance(valore, (list, tuple)):
+        return "[" + ",".join(impronta(v) for v in valore) + "]"
+    return repr(valore)
+
+
+def _dimensione(figura):
+    """
+    Byte occupati, stimati senza serializzare la figura: circa 16 byte per valore delle
+    serie di ogni traccia più 1 KB per traccia e per il layout.
+    """
+    totale = 1024
+    for traccia in figura.data:
+        totale += 1024
+        for nome in _SERIE:
+            valore = traccia[nome] if nome in traccia else None
+            if valore is None or isinstance(valore, str) or not hasattr(valore, "__len__"):
+                continue
+            totale += 16 * int(getattr(valore, "size", len(valore)))
+    return totale
+
+
+def _byte_json(figura):
+    """Byte esatti del JSON della figura (solo per il pannello Performance)."""
+    try:
+        return len(figura.to_json(validate=False))
+    except Exception:
+        return 0
+
+
+class CacheFigure:
+    """
+    LRU di figure condivisa tra sessioni. La chiave è la funzione che costruisce la figura
+    più l'impronta dei suoi argomenti; si scartano le figure usate meno di recente quando
+    si supera il numero massimo di voci o il limite di memoria.
+    Le figure restituite sono condivise: vanno trattate in sola lettura.
+    """
+
+    def __init__(self, max_voci=64, max_byte=50 * 1024 * 1024):
+        self.max_voci = max_voci
+        self.max_byte = max_byte
+        self._voci = OrderedDict()  # chiave -> (figura, byte)
+        self._byte = 0
+        self.hit = 0
+        self.miss = 0
+        self._lock = threading.Lock()
+
+    def figura(self, costruisci, *args, **kwargs):
+        """Restituisce costruisci(*args, **kwargs), ricostruendola solo se gli input sono cambiati."""
+        chiave = "|".join(
+            [f"{costruisci.__module__}.{costruisci.__qualname__}"]
+            + [impronta(a) for a in args]
+            + [f"{k}={impronta(v)}" for k, v in sorted(kwargs.items())]
+        )
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None:
+                self._voci.move_to_end(chiave)
+                self.hit += 1
+                return voce[0]
+            self.miss += 1
+
+        with span("grafici", costruisci.__name__) as misura:
+            figura = costruisci(*args, **kwargs)
+            if figura is None:
+                return None
+            byte = _dimensione(figura)
+            misura.byte = _byte_json(figura) if misura_byte() else byte
+        with self._lock:
+            if chiave in self._voci:
+                self._byte -= self._voci[chiave][1]
+            self._voci[chiave] = (figura, byte)
+            self._byte += byte
+            while self._voci and (len(self._voci) > self.max_voci or self._byte > self.max_byte):
+                _, (_, scartata) = self._voci.popitem(last=False)
+                self._byte -= scartata
+        return figura
+
+    def statistiche(self):
+        with self._lock:
+            totale = self.hit + self.miss
+            return {
+                "hit": self.hit,
+                "miss": self.miss,
+                "hit_rate": self.hit / totale if totale else 0.0,
+                "voci": len(self._voci),
+                "memoria_kb": self._byte / 1024,
+            }
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            self._byte = 0
@@ -0,0 +1,197 @@
+"""Copia locale (SQLite) dei fogli, riscaricata solo quando il foglio cambia davvero."""
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from prestazioni import span
+
+PERCORSO_CACHE = os.path.join(".bilancio_cache", "fogli.sqlite")
+
+
+class CacheLocale:
+    """
+    Ogni foglio è salvato in una tabella SQLite insieme al suo token di versione
+    (es. modifiedTime del file su Drive). Se il token del server coincide con quello
+    salvato la lettura è tutta locale; senza token (backend che non lo supporta) si scarica sempre.
+    """
+
+    def __init__(self, percorso=PERCORSO_CACHE):
+        self.percorso = percorso
+        # Ultima copia già in memoria per foglio: (versione, DataFrame)
+        self._memoria = {}
+        # Strutture derivate dallo snapshot (cubo, indici): foglio -> (versione, {nome: struttura})
+        self._derivati = {}
+        # Una sola sessione alla volta ricarica: le altre aspettano e trovano la copia pronta
+        self._lock = threading.Lock()
+        cartella = os.path.dirname(percorso)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with self._connetti() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS _versioni (foglio TEXT PRIMARY KEY, versione TEXT, date TEXT)")
+
+    def _connetti(self):
+        return sqlite3.connect(self.percorso)
+
+    def _tabella(self, foglio):
+        return "foglio_" + "".join(c if c.isalnum() else "_" for c in foglio)
+
+    def versione_salvata(self, foglio):
+        with self._connetti() as con:
+            riga = con.execute("SELECT versione FROM _versioni WHERE foglio = ?", (foglio,)).fetchone()
+        return riga[0] if riga else None
+
+    def leggi(self, foglio):
+        with self._connetti() as con:
+            riga = con.execute("SELECT date FROM _versioni WHERE foglio = ?", (foglio,)).fetchone()
+            date = [c for c in (riga[0] or "").split(",") if c] if riga else []
+            return pd.read_sql(f'SELECT * FROM "{self._tabella(foglio)}"', con, parse_dates=date or None)
+
+    def salva(self, foglio, df, versione):
+        date = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+        with self._connetti() as con:
+            df.to_sql(self._tabella(foglio), con, if_exists="replace", index=False)
+            con.execute(
+                "INSERT OR REPLACE INTO _versioni (foglio, versione, date) VALUES (?, ?, ?)",
+                (foglio, versione, ",".join(date)),
+            )
+
+    def _salva_righe_nuove(self, foglio, df_nuove, versione):
+        """Aggiunge alla tabella locale le sole righe nuove e ne aggiorna il token di versione."""
+        with self._connetti() as con:
+            df_nuove.to_sql(self._tabella(foglio), con, if_exists="append", index=False)
+            con.execute("UPDATE _versioni SET versione = ? WHERE foglio = ?", (versione, foglio))
+
+    def carica(self, foglio, versione, scarica):
+        """
+        Restituisce il foglio dalla copia locale se la versione coincide, altrimenti
+        chiama scarica() (download + pulizia) e aggiorna la copia locale.
+        Il DataFrame restituito è condiviso tra sessioni: va trattato in sola lettura.
+        """
+        if versione is None:
+            return scarica()
+        versione = str(versione)
+        with self._lock:
+            in_memoria = self._memoria.get(foglio)
+            if in_memoria is not None and in_memoria[0] == versione:
+                return in_memoria[1]
+            df = None
+            if self.versione_salvata(foglio) == versione:
+                try:
+                    with span("cache", f"copia locale {foglio}"):
+                        df = self.leggi(foglio)
+                except Exception:
+                    df = None
+            if df is None:
+                with span("cache", f"scarica {foglio}"):
+                    df = scarica()
+                with span("cache", f"salva copia locale {foglio}"):
+                    self.salva(foglio, df, versione)
+            self._memoria[foglio] = (versione, df)
+            return df
+
+    def composto(self, nome, versione, componi):
+        """
+        Snapshot costruito da altri snapshot (es. più partizioni del registro unite), tenuto
+        solo in memoria: la versione è quella delle parti, che hanno già la loro copia locale.
+        Le strutture derivate si chiedono con derivato(nome, ...) come per un foglio.
+        """
+        if versione is None:
+            return componi()
+        with self._lock:
+            in_memoria = self._memoria.get(nome)
+            if in_memoria is not None and in_memoria[0] == versione:
+                return in_memoria[1]
+        # Fuori dal lock: componi() carica le parti con carica()
+        df = componi()
+        with self._lock:
+            self._memoria[nome] = (versione, df)
+        return df
+
+    def derivato(self, foglio, nome, costruisci, df_corrente):
+        """
+        Struttura calcolata dallo snapshot (es. cubo, indici), costruita una volta per versione
+        e condivisa. Se df_corrente non è lo snapshot in cache si costruisce al volo.
+        """
+        with self._lock:
+            in_memoria = self._memoria.get(foglio)
+            if in_memoria is None or in_memoria[1] is not df_corrente:
+                with span("aggregazione", nome):
+                    return costruisci(df_corrente)
+            derivati = self._derivati.get(foglio)
+            if derivati is None or derivati[0] != in_memoria[0]:
+                derivati = (in_memoria[0], {})
+                self._derivati[foglio] = derivati
+            if nome not in derivati[1]:
+                with span("aggregazione", nome):
+                    derivati[1][nome] = costruisci(df_corrente)
+            return derivati[1][nome]
+
+    def accoda(self, foglio, df_nuove, versione, precedente=None):
+        """
+        Dopo un append fatto dall'app: aggiunge le righe (già preparate) allo snapshot e
+        aggiorna in place le strutture derivate che hanno un metodo aggiungi(), senza
+        riscaricare il foglio. Le altre strutture derivate verranno ricostruite.
+        precedente è il token del foglio prima dell'append: se la copia in memoria è di
+        un'altra versione non la si aggiorna (verrà riscaricata alla prossima lettura).
+        """
+        if versione is None:
+            return
+        versione = str(versione)
+        with self._lock:
+            in_memoria = self._memoria.get(foglio)
+            if in_memoria is None or (precedente is not None and in_memoria[0] != str(precedente)):
+                return
+            # Le righe nuove prendono le posizioni successive a quelle esistenti
+            n = len(in_memoria[1])
+            df_nuove = df_nuove.set_axis(range(n, n + len(df_nuove)))
+            df = pd.concat([in_memoria[1], df_nuove])
+            # Se la copia su disco è quella in memoria basta accodare le righe nuove
+            if self.versione_salvata(foglio) == in_memoria[0] and list(df_nuove.columns) == list(in_memoria[1].columns):
+                self._salva_righe_nuove(foglio, df_nuove, versione)
+            else:
+                self.salva(foglio, df, versione)
+            self._memoria[foglio] = (versione, df)
+
+            derivati = self._derivati.get(foglio)
+            if derivati is not None and derivati[0] == in_memoria[0]:
+                aggiornati = {}
+                for nome, struttura in derivati[1].items():
+                    if hasattr(struttura, "aggiungi"):
+                        struttura.aggiungi(df_nuove)
+                        aggiornati[nome] = struttura
+                self._derivati[foglio] = (versione, aggiornati)
+
+
+class VersioniFogli:
+    """
+    Token di versione condiviso da tutte le sessioni. La versione remota viene chiesta al
+    backend al massimo ogni `intervallo` secondi; ogni scrittura fatta dall'app incrementa
+    un contatore locale, così le altre sessioni vedono subito il nuovo snapshot.
+    """
+
+    def __init__(self, leggi_versione, intervallo=30):
+        self.leggi_versione = leggi_versione
+        self.intervallo = intervallo
+        self._remote = {}
+        self._scritture = {}
+        self._lock = threading.Lock()
+
+    def token(self, foglio):
+        """Token corrente del foglio, oppure None se il backend non espone versioni."""
+        with self._lock:
+            voce = self._remote.get(foglio)
+            if voce is None or time.monotonic() - voce[1] > self.intervallo:
+                voce = (self.leggi_versione(foglio), time.monotonic())
+                self._remote[foglio] = voce
+            if voce[0] is None:
+                return None
+            return f"{voce[0]}#{self._scritture.get(foglio, 0)}"
+
+    def segnala_scrittura(self, foglio):
+        """Da chiamare dopo ogni scrittura: nuovo token e nuova lettura della versione remota."""
+        with self._lock:
+            self._scritture[foglio] = self._scritture.get(foglio, 0) + 1
+            self._remote.pop(foglio, None)
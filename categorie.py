@@ -0,0 +1,109 @@
+"""Categorie di entrata e uscita lette dal foglio del piano annuale, in cache per versione del foglio."""
+import threading
+import time
+
+import pandas as pd
+
+from categorizzatore import CATEGORIA_DEFAULT
+
+# Posizione degli elenchi nel foglio dell'anno: (colonna letta, prima riga dei dati)
+INIZIO_ENTRATE = (0, 3)
+INIZIO_USCITE = (1, 2)
+
+# Una cella che inizia così (maiuscole o minuscole) chiude l'elenco, es. "TOTALE USCITE"
+MARCATORI_FINE = ("TOTALE",)
+
+# Righe vuote consecutive che separano l'elenco dal blocco successivo (una sola si salta)
+RIGHE_SEPARATORE = 2
+
+
+def elenco_colonna(df, colonna, prima_riga, marcatori=MARCATORI_FINE, separatore=RIGHE_SEPARATORE):
+    """
+    Valori distinti (ordinati, senza spazi ai lati) del blocco che parte da `prima_riga`:
+    nessun limite fisso di righe. Il blocco finisce alla prima riga marcatore (`marcatori`)
+    o al primo gruppo di `separatore` righe vuote, così un altro elenco più in basso nella
+    stessa colonna non viene letto come categorie. Una cella vuota isolata si salta.
+    """
+    valori = df.iloc[prima_riga:, colonna]
+    testi = valori.astype(str).str.strip().where(valori.notna(), "")
+    fine = testi.str.upper().str.startswith(tuple(marcatori)).to_numpy(copy=True)
+    if separatore:
+        # Fine della prima finestra di `separatore` celle tutte vuote -> inizio del separatore
+        vuote = pd.Series((testi == "").to_numpy()).rolling(separatore).sum().to_numpy() == separatore
+        fine[:len(fine) - separatore + 1] |= vuote[separatore - 1:]
+    if fine.any():
+        testi = testi.iloc[:fine.argmax()]
+    return sorted(testi[testi != ""].unique().tolist())
+
+
+class Categorie:
+    """Elenchi pronti per selectbox ed editor più le tabelle di lookup in minuscolo."""
+
+    def __init__(self, entrate, uscite):
+        self.entrate = list(entrate)
+        self.uscite = list(uscite)
+        # Aggiunta Default se mancano
+        if CATEGORIA_DEFAULT not in self.entrate:
+            self.entrate.insert(0, CATEGORIA_DEFAULT)
+        if CATEGORIA_DEFAULT not in self.uscite:
+            self.uscite.insert(0, CATEGORIA_DEFAULT)
+        self.tutte = sorted(set(self.entrate + self.uscite))
+        # minuscolo -> nome nel foglio (il primo in caso di nomi uguali a meno delle maiuscole)
+        self.per_nome = {}
+        for c in self.entrate + self.uscite:
+            self.per_nome.setdefault(c.lower(), c)
+        self.entrate_min = frozenset(c.lower() for c in self.entrate)
+        self.uscite_min = frozenset(c.lower() for c in self.uscite)
+
+    @classmethod
+    def da_foglio(cls, df_cat):
+        """Dal foglio dell'anno letto con usecols=[0, 2], header=None."""
+        return cls(elenco_colonna(df_cat, *INIZIO_ENTRATE), elenco_colonna(df_cat, *INIZIO_USCITE))
+
+    def per_tipo(self, tipo):
+        return self.uscite if tipo == "Uscita" else self.entrate
+
+    def normalizza(self, nome):
+        """Nome della categoria come scritto nel foglio, oppure None se non esiste."""
+        return self.per_nome.get(str(nome).strip().lower())
+
+
+class RegistroCategorie:
+    """
+    Categorie per anno, lette una volta per versione del foglio e condivise tra sessioni.
+    Se il foglio dell'anno non esiste si usa quello dell'anno precedente più recente.
+    Senza token di versione (o dopo un errore) si rilegge al massimo ogni `ttl` secondi.
+    """
+
+    def __init__(self, archivio, anni_indietro=3, ttl=60):
+        self.archivio = archivio
+        self.anni_indietro = anni_indietro
+        self.ttl = ttl
+        self._cache = {}  # foglio -> (versione, letto_il, Categorie o None)
+        self._lock = threading.Lock()
+
+    def _leggi(self, foglio, versione):
+        voce = self._cache.get(foglio)
+        if voce is not None:
+            stessa_versione = versione is not None and voce[0] == versione and voce[2] is not None
+            recente = time.monotonic() - voce[1] <= self.ttl
+            if stessa_versione or ((versione is None or voce[2] is None) and recente):
+                return voce[2]
+        try:
+            df_cat = self.archivio.leggi(foglio, usecols=[0, 2], header=None, ttl=0)
+            # Foglio vuoto = anno non ancora impostato: si passa all'anno precedente
+            categorie = Categorie.da_foglio(df_cat) if not df_cat.empty else None
+        except Exception:
+            categorie = None
+        self._cache[foglio] = (versione, time.monotonic(), categorie)
+        return categorie
+
+    def categorie(self, anno, versione_di=lambda foglio: None):
+        """Categorie del foglio `anno` (o dell'anno disponibile più vicino prima di esso)."""
+        with self._lock:
+            for a in range(int(anno), int(anno) - self.anni_indietro - 1, -1):
+                categorie = self._leggi(str(a), versione_di(str(a)))
+                if categorie is not None:
+                    return categorie
+        # Fallback in caso di errore
+        return Categorie([], [])
@@ -0,0 +1,214 @@
+"""Categorizzatore compilato: un unico automa Aho-Corasick su tutte le parole chiave."""
+from collections import deque
+
+CATEGORIA_DEFAULT = "DA VERIFICARE"
+# Parole imparate tenute in un automa separato prima di ricompilare quello principale
+SOGLIA_RICOMPILA = 256
+
+
+# ==============================================================================
+# 1. AUTOMA AHO-CORASICK
+# ==============================================================================
+
+class AutomaAhoCorasick:
+    """Trova in un solo passaggio tutti i pattern contenuti in un testo."""
+
+    def __init__(self, pattern):
+        # Stato 0 = radice. Per ogni stato: transizioni, link di fallimento, output
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self._vuoti = ()
+
+        vuoti = []
+        for idx, p in enumerate(pattern):
+            if p == "":
+                # Il pattern vuoto è contenuto in qualsiasi testo
+                vuoti.append(idx)
+                continue
+            stato = 0
+            for ch in p:
+                prossimo = self._goto[stato].get(ch)
+                if prossimo is None:
+                    prossimo = len(self._goto)
+                    self._goto[stato][ch] = prossimo
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                stato = prossimo
+            self._out[stato] = self._out[stato] + (idx,)
+        self._vuoti = tuple(vuoti)
+
+        # Costruzione link di fallimento (BFS)
+        coda = deque(self._goto[0].values())
+        while coda:
+            stato = coda.popleft()
+            for ch, figlio in self._goto[stato].items():
+                coda.append(figlio)
+                f = self._fail[stato]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[figlio] = cand if cand != figlio else 0
+                self._out[figlio] = self._out[figlio] + self._out[self._fail[figlio]]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def trova(self, testo):
+        """Restituisce gli indici (insieme) dei pattern contenuti nel testo."""
+        goto, fail, out = self._goto, self._fail, self._out
+        trovati = set(self._vuoti)
+        stato = 0
+        for ch in testo:
+            while stato and ch not in goto[stato]:
+                stato = fail[stato]
+            stato = goto[stato].get(ch, 0)
+            if out[stato]:
+                trovati.update(out[stato])
+        return trovati
+
+
+# ==============================================================================
+# 2. CATEGORIZZATORE
+# ==============================================================================
+
+class Categorizzatore:
+    """
+    Versione compilata di trova_categoria_smart.
+    Priorità invariata: prima le parole imparate (nell'ordine di DB_KEYWORDS),
+    poi MAPPA_KEYWORD, poi il nome della categoria. La categoria di destinazione
+    di ogni parola viene risolta una sola volta alla costruzione.
+    Le parole imparate dopo la costruzione (impara) finiscono in un piccolo automa
+    separato, fuso in quello principale solo oltre SOGLIA_RICOMPILA parole.
+    """
+
+    def __init__(self, mappa_custom, lista_categorie, mappa_keyword):
+        self.lista_categorie = list(lista_categorie)
+        self._pattern = []
+        self._categorie = []
+        # Priorità (livello, ordine): vince il minimo tra i pattern trovati
+        self._priorita = []
+        self._ordine = 0
+        self._rango = {}
+        # Keyword fisse e nomi di categoria: pattern -> (categoria, priorità), anche quando
+        # una parola imparata li copre, per ripristinarli se la parola viene dimenticata
+        self._fisse = {}
+        # Parole dimenticate -> ordine che avevano: reimparate tornano nella stessa posizione
+        self._dimenticate = {}
+
+        # 0. Memoria imparata: la categoria deve esistere ancora (uguaglianza case-insensitive)
+        self._per_nome = {}
+        for c in self.lista_categorie:
+            self._per_nome.setdefault(c.lower(), c)
+        for parola, cat in mappa_custom.items():
+            self._aggiungi(parola, self._per_nome.get(str(cat).lower()), 0)
+
+        # 1. Keyword hardcoded: prima categoria che contiene il target
+        for parola, target in mappa_keyword.items():
+            target = target.lower()
+            risolta = next((c for c in self.lista_categorie if target in c.lower()), None)
+            self._fissa(parola, risolta, 1)
+
+        # 2. Nome categoria contenuto nella descrizione
+        for c in self.lista_categorie:
+            self._fissa(c.lower(), c, 2)
+
+        self._automa = AutomaAhoCorasick(self._pattern)
+        # Automa delle parole imparate dopo la costruzione + loro indici globali
+        self._delta = (None, [])
+
+    def _aggiungi(self, pattern, categoria, livello):
+        # Parole senza categoria valida vengono saltate (come nel ciclo originale), ma la loro
+        # posizione resta riservata: reimparate con una categoria valida tornano lì.
+        # A parità di pattern vince la prima occorrenza, cioè la più prioritaria
+        if pattern in self._rango:
+            return
+        ordine = self._dimenticate.pop(pattern, None)
+        if ordine is None:
+            ordine = self._prossimo_ordine()
+        if categoria is None:
+            self._dimenticate[pattern] = ordine
+            return
+        self._rango[pattern] = len(self._pattern)
+        self._pattern.append(pattern)
+        self._categorie.append(categoria)
+        self._priorita.append((livello, ordine))
+
+    def _fissa(self, pattern, categoria, livello):
+        if categoria is None or pattern in self._fisse:
+            return
+        priorita = (livello, self._prossimo_ordine())
+        self._fisse[pattern] = (categoria, priorita)
+        if pattern not in self._rango:
+            self._rango[pattern] = len(self._pattern)
+            self._pattern.append(pattern)
+            self._categorie.append(categoria)
+            self._priorita.append(priorita)
+
+    def _dimentica(self, parola):
+        """
+        Toglie una parola imparata, come se non fosse in DB_KEYWORDS: torna la keyword fissa
+        o il nome di categoria che copriva, altrimenti il pattern resta nell'automa ma
+        disattivato (priorità più bassa di tutte e categoria di default, come nessun match).
+        """
+        idx = self._rango.get(parola)
+        if idx is None or self._priorita[idx][0] != 0:
+            # Mai imparata: entra comunque in fondo a DB_KEYWORDS, se non ha già una posizione
+            self._dimenticate.setdefault(parola, self._prossimo_ordine())
+            return
+        self._dimenticate[parola] = self._priorita[idx][1]
+        if parola in self._fisse:
+            self._categorie[idx], self._priorita[idx] = self._fisse[parola]
+        else:
+            self._categorie[idx] = CATEGORIA_DEFAULT
+            self._priorita[idx] = (3, 0)
+
+    def _prossimo_ordine(self):
+        self._ordine += 1
+        return self._ordine
+
+    def __len__(self):
+        return len(self._pattern)
+
+    def impara(self, parola, categoria):
+        """
+        Aggiorna in place una parola imparata (chiave già normalizzata), con lo stesso esito
+        di una ricostruzione da DB_KEYWORDS con la parola in fondo al foglio.
+        Restituisce False se la categoria non esiste tra quelle del categorizzatore: come nella
+        ricostruzione, la parola smette di valere (anche se prima era imparata).
+        """
+        categoria = self._per_nome.get(str(categoria).lower())
+        if categoria is None:
+            self._dimentica(parola)
+            return False
+        idx = self._rango.get(parola)
+        if idx is not None:
+            # Già nota: si aggiorna la categoria; una keyword fissa o un nome di categoria
+            # diventa parola imparata (priorità più alta, dopo quelle già presenti)
+            if self._priorita[idx][0] != 0:
+                ordine = self._dimenticate.pop(parola, None)
+                self._priorita[idx] = (0, ordine if ordine is not None else self._prossimo_ordine())
+            self._categorie[idx] = categoria
+            return True
+
+        idx = len(self._pattern)
+        self._aggiungi(parola, categoria, 0)
+        indici = self._delta[1] + [idx]
+        if len(indici) > SOGLIA_RICOMPILA:
+            self._automa = AutomaAhoCorasick(self._pattern)
+            self._delta = (None, [])
+        else:
+            self._delta = (AutomaAhoCorasick([self._pattern[i] for i in indici]), indici)
+        return True
+
+    def classifica(self, descrizione):
+        """Restituisce la categoria suggerita per la descrizione."""
+        testo = descrizione.lower().strip()
+        trovati = self._automa.trova(testo)
+        automa_delta, indici_delta = self._delta
+        if automa_delta is not None:
+            trovati.update(indici_delta[i] for i in automa_delta.trova(testo))
+        if not trovati:
+            return CATEGORIA_DEFAULT
+        return self._categorie[min(trovati, key=self._priorita.__getitem__)]
@@ -0,0 +1 @@
+"""I test importano i moduli dalla radice del progetto (python -m pytest)."""
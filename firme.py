@@ -0,0 +1,45 @@
+"""Firme delle transazioni importate dalla mail e indice delle firme per la deduplicazione."""
+import hashlib
+
+
+def firma_mail(message_id, data, importo, tipo, descrizione):
+    """
+    Firma di una transazione letta da una mail: data leggibile + hash del Message-ID e di
+    tutti i campi estratti. La stessa mail riletta dà la stessa firma; due acquisti uguali
+    nello stesso giorno (mail diverse) danno firme diverse.
+    """
+    contenuto = "\x1f".join([message_id or "", data.strftime("%Y-%m-%d"), f"{importo:.2f}", tipo, descrizione])
+    return f"{data.strftime('%Y%m%d')}-{hashlib.blake2b(contenuto.encode(), digest_size=8).hexdigest()}"
+
+
+def firma_legacy(data, importo, descrizione):
+    """Vecchio formato (data + importo + primi 10 caratteri), ancora presente nel registro."""
+    return f"{data.strftime('%Y%m%d')}-{importo}-{descrizione[:10]}"
+
+
+class IndiceFirme:
+    """
+    Insieme delle Firme del registro: verifica O(1) per ogni candidata. È una struttura
+    derivata dello snapshot in cache (ricostruita per versione, aggiornata in place dopo
+    un append), quindi persiste insieme alla copia locale del registro.
+    """
+
+    def __init__(self, df_registro):
+        self._firme = set()
+        self.aggiungi(df_registro)
+
+    def __len__(self):
+        return len(self._firme)
+
+    def aggiungi(self, df_nuove):
+        if "Firma" in df_nuove.columns:
+            # Senza strip: le firme legacy possono finire con uno spazio (descrizione[:10])
+            self._firme.update(df_nuove["Firma"].dropna().astype(str))
+
+    def contiene(self, *firme):
+        """True se almeno una delle firme (es. nuova e legacy) è già nel registro."""
+        return any(f in self._firme for f in firme)
+
+    def maschera_nuove(self, serie_firme):
+        """Maschera delle righe la cui Firma non è ancora nel registro."""
+        return ~serie_firme.astype(str).isin(self._firme)
@@ -0,0 +1,264 @@
+"""Importazione delle mail in background: un thread legge IMAP a intervalli e prepara le transazioni in una coda locale."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from firme import firma_legacy, firma_mail
+from parser_banche import REGISTRO_BANCHE
+from posta import PERCORSO_STATO_SYNC, REGOLE_FILTRO_BANCHE, StatoSync, scarica_nuove_mail
+from prestazioni import span
+
+# Coda delle transazioni pronte da confermare (sopravvive ai riavvii dell'app)
+PERCORSO_CODA = os.path.join(".bilancio_cache", "coda_mail.sqlite")
+
+# Secondi tra due letture della casella
+INTERVALLO_LETTURA = 300
+
+COLONNE_TRANSAZIONE = ["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"]
+
+
+def analizza_mail(messaggi, categorizza, indice_firme):
+    """
+    Riconosce banca e transazione di ogni mail e scarta quelle già nel registro.
+    categorizza(descrizione, tipo) suggerisce la categoria; indice_firme(anno) restituisce
+    l'IndiceFirme della partizione dell'anno (chiesto una volta per anno).
+    Restituisce (transazioni, scartate, statistiche): liste di dict con le colonne del registro.
+    """
+    transazioni = []
+    scartate = []
+    statistiche = {"scartate_client": 0, "duplicate": 0}
+    indici = {}
+    firme_viste = set()
+
+    for msg in messaggi:
+        soggetto = msg.subject
+        corpo = msg.text or msg.html
+        corpo_clean = " ".join(corpo.split())
+
+        # Parser della banca scelto dal mittente (rete di sicurezza sul filtro del server)
+        parser = REGISTRO_BANCHE.trova(msg.from_, f"{soggetto} {corpo_clean}")
+        if parser is None:
+            statistiche["scartate_client"] += 1
+            continue
+
+        with span("parsing", f"mail {parser.nome}"):
+            risultato = parser.analizza(corpo_clean)
+        message_id = msg.headers.get("message-id", ("",))[0].strip() or f"uid-{msg.uid}"
+        if risultato is None:
+            # Firma stabile per mail: rileggerla non duplica la riga scartata in coda
+            impronta = hashlib.blake2b(message_id.encode(), digest_size=3).hexdigest()
+            scartate.append({
+                "Data": msg.date.strftime("%Y-%m-%d"),
+                "Descrizione": soggetto,
+                "Importo": 0.0,
+                "Tipo": "Uscita",
+                "Categoria": "DA VERIFICARE",
+                "Mese": msg.date.strftime('%b-%y'),
+                "Firma": f"ERR-{msg.date.strftime('%Y%m%d')}-{impronta}",
+            })
+            continue
+
+        importo, tipo, descrizione = risultato["importo"], risultato["tipo"], risultato["descrizione"]
+        categoria = risultato["categoria"]
+        if not categoria:
+            with span("parsing", "categoria"):
+                categoria = categorizza(descrizione, tipo)
+
+        firma_univoca = firma_mail(message_id, msg.date, importo, tipo, descrizione)
+        # Il controllo sul vecchio formato evita di reimportare mail salvate prima
+        if msg.date.year not in indici:
+            indici[msg.date.year] = indice_firme(msg.date.year)
+        if firma_univoca in firme_viste or indici[msg.date.year].contiene(
+            firma_univoca, firma_legacy(msg.date, importo, descrizione)
+        ):
+            statistiche["duplicate"] += 1
+            continue
+        firme_viste.add(firma_univoca)
+        transazioni.append({
+            "Data": msg.date.strftime("%Y-%m-%d"),
+            "Descrizione": descrizione,
+            "Importo": importo,
+            "Tipo": tipo,
+            "Categoria": categoria,
+            "Mese": msg.date.strftime('%b-%y'),
+            "Firma": firma_univoca,
+        })
+
+    return transazioni, scartate, statistiche
+
+
+class CodaMail:
+    """
+    Transazioni lette dalle mail e non ancora salvate nel registro, su SQLite locale.
+    La Firma è la chiave: rileggere una mail già in coda non la duplica.
+    """
+
+    def __init__(self, percorso=PERCORSO_CODA):
+        self.percorso = percorso
+        self._lock = threading.Lock()
+        cartella = os.path.dirname(percorso)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with self._connetti() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS coda (Firma TEXT PRIMARY KEY, Data TEXT, Descrizione TEXT, "
+                "Importo REAL, Tipo TEXT, Categoria TEXT, Mese TEXT, scartata INTEGER, pronta_il REAL)"
+            )
+
+    def _connetti(self):
+        return sqlite3.connect(self.percorso, timeout=30)
+
+    def __len__(self):
+        with self._connetti() as con:
+            return con.execute("SELECT COUNT(*) FROM coda WHERE scartata = 0").fetchone()[0]
+
+    def aggiungi(self, transazioni, scartate=()):
+        """Mette in coda le transazioni (e le mail non riconosciute); restituisce quante transazioni sono nuove."""
+        adesso = time.time()
+        sql = (
+            f"INSERT OR IGNORE INTO coda ({', '.join(COLONNE_TRANSAZIONE)}, scartata, pronta_il) "
+            f"VALUES ({', '.join('?' * (len(COLONNE_TRANSAZIONE) + 2))})"
+        )
+        with self._lock, self._connetti() as con:
+            prima = con.total_changes
+            con.executemany(sql, [tuple(t[c] for c in COLONNE_TRANSAZIONE) + (0, adesso) for t in transazioni])
+            nuove = con.total_changes - prima
+            con.executemany(sql, [tuple(t[c] for c in COLONNE_TRANSAZIONE) + (1, adesso) for t in scartate])
+            return nuove
+
+    def _leggi(self, scartata):
+        with self._connetti() as con:
+            return pd.read_sql(
+                f"SELECT {', '.join(COLONNE_TRANSAZIONE)} FROM coda WHERE scartata = ? ORDER BY rowid",
+                con, params=(scartata,),
+            )
+
+    def pronte(self):
+        """Transazioni pronte da confermare (colonne del registro, Data come testo)."""
+        return self._leggi(0)
+
+    def scartate(self):
+        """Mail della banca in cui non è stata riconosciuta una transazione."""
+        return self._leggi(1)
+
+    def rimuovi(self, firme):
+        """Toglie dalla coda le righe salvate nel registro (o recuperate a mano)."""
+        firme = [str(f) for f in firme]
+        if not firme:
+            return 0
+        with self._lock, self._connetti() as con:
+            prima = con.total_changes
+            con.executemany("DELETE FROM coda WHERE Firma = ?", [(f,) for f in firme])
+            return con.total_changes - prima
+
+
+class LavoratoreMail:
+    """
+    Thread che ogni `intervallo` secondi legge le mail nuove e mette le transazioni nella
+    coda, così IMPORTA le mostra subito senza aspettare IMAP. apri_casella() restituisce
+    una casella già autenticata (MailBox di imap_tools o un sostituto in memoria);
+    analizza(messaggi) restituisce (transazioni, scartate, statistiche) come analizza_mail.
+    Un ciclo alla volta: la lettura chiesta dall'utente aspetta quella in background.
+    """
+
+    def __init__(self, apri_casella, analizza, coda, chiave, regole=REGOLE_FILTRO_BANCHE,
+                 intervallo=INTERVALLO_LETTURA, percorso_stato=PERCORSO_STATO_SYNC):
+        self.apri_casella = apri_casella
+        self.analizza = analizza
+        self.coda = coda
+        self.chiave = chiave
+        self.regole = regole
+        self.intervallo = intervallo
+        self.percorso_stato = percorso_stato
+        self._ciclo_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._ferma = threading.Event()
+        self._sveglia = threading.Event()
+        self._thread = None
+        self._metriche = {
+            "cicli": 0, "errori": 0, "mail_lette": 0, "transazioni": 0, "ultimo_errore": None,
+            "ultimo_ciclo": None, "durata_ms": 0.0, "mail_al_secondo": 0.0, "ritardo_s": None,
+        }
+
+    def ciclo(self, completo=False):
+        """
+        Una lettura della casella: mail nuove -> analisi -> coda. Restituisce le statistiche
+        di scarica_nuove_mail e analizza_mail più "in_coda" (transazioni nuove in coda).
+        Il punto di ripresa avanza solo dopo che le mail sono in coda.
+        """
+        with self._ciclo_lock:
+            inizio = time.perf_counter()
+            # Stato riletto a ogni ciclo: la stessa casella può essere letta anche da "Cerca Mail"
+            stato = StatoSync(self.percorso_stato)
+            with self.apri_casella() as mailbox:
+                messaggi, statistiche, punto = scarica_nuove_mail(
+                    mailbox, stato, self.chiave, completo=completo, regole=self.regole
+                )
+            transazioni, scartate, stat_analisi = self.analizza(messaggi)
+            statistiche.update(stat_analisi)
+            statistiche["in_coda"] = self.coda.aggiungi(transazioni, scartate)
+            stato.salva(self.chiave, *punto)
+            durata = time.perf_counter() - inizio
+
+            # Ritardo: dall'arrivo della mail (Date) al momento in cui è pronta in coda
+            adesso = time.time()
+            ritardi = [adesso - msg.date.timestamp() for msg in messaggi]
+            with self._lock:
+                m = self._metriche
+                m["cicli"] += 1
+                m["mail_lette"] += len(messaggi)
+                m["transazioni"] += statistiche["in_coda"]
+                m["ultimo_ciclo"] = adesso
+                m["durata_ms"] = durata * 1000
+                if ritardi:
+                    m["mail_al_secondo"] = len(messaggi) / durata
+                    m["ritardo_s"] = max(ritardi)
+            return statistiche
+
+    def _esegui(self):
+        while not self._ferma.is_set():
+            try:
+                self.ciclo()
+            except Exception as e:
+                with self._lock:
+                    self._metriche["errori"] += 1
+                    self._metriche["ultimo_errore"] = f"{type(e).__name__}: {e}"
+            self._sveglia.wait(self.intervallo)
+            self._sveglia.clear()
+
+    def avvia(self):
+        """Avvia il thread in background (una sola volta)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._ferma.clear()
+            self._thread = threading.Thread(target=self._esegui, name="lavoratore-mail", daemon=True)
+            self._thread.start()
+        return self
+
+    def ferma(self, attesa=None):
+        self._ferma.set()
+        self._sveglia.set()
+        if self._thread is not None:
+            self._thread.join(attesa)
+
+    def sveglia(self):
+        """Anticipa la prossima lettura senza aspettare l'intervallo."""
+        self._sveglia.set()
+
+    def attivo(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def metriche(self):
+        """
+        Cicli, errori, mail lette e transazioni messe in coda dall'avvio; durata dell'ultimo
+        ciclo; throughput (mail/s) e ritardo massimo arrivo -> coda dell'ultimo ciclo con
+        mail; secondi dall'ultima lettura e righe in attesa di conferma.
+        """
+        with self._lock:
+            m = dict(self._metriche)
+        m["dall_ultimo_ciclo_s"] = time.time() - m["ultimo_ciclo"] if m["ultimo_ciclo"] else None
+        m["in_attesa"] = len(self.coda)
+        return m
@@ -0,0 +1,98 @@
+"""Confronto tra la vista originale e quella modificata nell'editor: insert, update, delete per Firma."""
+import uuid
+
+import pandas as pd
+
+
+class InsiemeModifiche:
+    """Change-set minimo: righe nuove, celle modificate e righe eliminate."""
+
+    def __init__(self, inserite, modificate, eliminate):
+        # inserite: DataFrame delle righe nuove
+        # modificate: lista di (firma, occorrenza, {colonna: nuovo_valore})
+        # eliminate: lista di (firma, occorrenza)
+        self.inserite = inserite
+        self.modificate = modificate
+        self.eliminate = eliminate
+
+    def __bool__(self):
+        return bool(len(self.inserite) or self.modificate or self.eliminate)
+
+    def riepilogo(self):
+        return f"{len(self.inserite)} nuove, {len(self.modificate)} modificate, {len(self.eliminate)} eliminate"
+
+
+def _normalizza(df, colonne):
+    """Valori nel formato in cui finiscono sul foglio, per confronti affidabili."""
+    df = df.reindex(columns=colonne).copy()
+    if "Data" in df.columns:
+        df["Data"] = pd.to_datetime(df["Data"], errors="coerce").dt.strftime("%Y-%m-%d")
+    df = df.astype(object)
+    return df.where(df.notna(), "")
+
+
+def chiavi_righe(df_originale, df_completo=None):
+    """
+    Chiave (Firma, occorrenza) di ogni riga della vista. L'occorrenza è contata sull'intero
+    registro, così le Firme duplicate restano distinguibili anche in una vista filtrata.
+    Va calcolata sullo snapshot da cui è stata presa la vista: dopo una ricarica del
+    registro gli stessi indici possono indicare righe diverse.
+    """
+    base = df_originale if df_completo is None else df_completo
+    firme = base["Firma"].fillna("").astype(str).str.strip()
+    occ = firme.groupby(firme).cumcount()
+    return {idx: (firme.at[idx], int(occ.at[idx])) for idx in df_originale.index}
+
+
+def calcola_modifiche(df_originale, df_modificato, df_completo=None, colonne=None, chiavi=None):
+    """
+    Confronta le righe mostrate nell'editor (df_originale, sottoinsieme con lo stesso indice di
+    df_completo) con quelle restituite. L'editor conserva l'indice delle righe esistenti:
+    righe con indice nuovo sono inserimenti, quelle sparite sono eliminazioni, quelle presenti
+    in entrambe con valori diversi sono aggiornamenti delle sole celle cambiate.
+    Le modifiche sono indirizzate per (Firma, occorrenza); righe senza Firma vengono ignorate.
+    chiavi (da chiavi_righe) evita di risolverle di nuovo su uno snapshot più recente.
+    """
+    colonne = [c for c in (colonne or df_modificato.columns) if c != "Firma"]
+    if chiavi is None:
+        chiavi = chiavi_righe(df_originale, df_completo)
+
+    # Inserimenti
+    mask_nuove = [idx not in chiavi for idx in df_modificato.index]
+    inserite = df_modificato[mask_nuove].copy()
+    if not inserite.empty:
+        firme = inserite["Firma"].fillna("").astype(str).str.strip() if "Firma" in inserite.columns else [""] * len(inserite)
+        inserite["Firma"] = [f if f else f"MAN-{uuid.uuid4().hex[:6]}" for f in firme]
+        if "Data" in inserite.columns and "Mese" in inserite.columns:
+            inserite["Mese"] = pd.to_datetime(inserite["Data"], errors="coerce").dt.strftime('%b-%y')
+
+    # Eliminazioni
+    rimaste = set(df_modificato.index)
+    eliminate = [k for idx, k in chiavi.items() if idx not in rimaste and k[0]]
+
+    # Aggiornamenti (solo celle cambiate)
+    modificate = []
+    comuni = [idx for idx in df_modificato.index if idx in chiavi and chiavi[idx][0]]
+    if comuni:
+        a = _normalizza(df_originale.loc[comuni], colonne)
+        b = _normalizza(df_modificato.loc[comuni], colonne)
+        diverse = a.ne(b)
+        for idx in a.index[diverse.any(axis=1)]:
+            cambiate = diverse.columns[diverse.loc[idx]]
+            firma, occ = chiavi[idx]
+            modificate.append((firma, occ, {c: b.at[idx, c] for c in cambiate}))
+
+    return InsiemeModifiche(inserite, modificate, eliminate)
+
+
+def unisci_modifiche(insiemi):
+    """Unisce i change-set di più pagine dell'editor in uno solo (le pagine sono disgiunte)."""
+    insiemi = [m for m in insiemi if m]
+    if not insiemi:
+        return InsiemeModifiche(pd.DataFrame(), [], [])
+    inserite = [m.inserite for m in insiemi if len(m.inserite)]
+    return InsiemeModifiche(
+        pd.concat(inserite, ignore_index=True) if inserite else pd.DataFrame(),
+        [x for m in insiemi for x in m.modificate],
+        [x for m in insiemi for x in m.eliminate],
+    )
@@ -0,0 +1,126 @@
+"""Archivio delle parole imparate (DB_KEYWORDS): upsert incrementali e categorizzatori aggiornati in place."""
+import threading
+import time
+
+import pandas as pd
+
+from categorizzatore import Categorizzatore
+
+COLONNE_PAROLE = ["Parola", "Categoria"]
+
+
+def chiave_parola(parola):
+    """Chiave normalizzata di una parola (come get_custom_map: minuscolo, senza spazi ai lati)."""
+    return str(parola).lower().strip()
+
+
+class ArchivioParole:
+    """
+    Copia in memoria di DB_KEYWORDS, letta una volta per versione del foglio.
+    impara() applica gli upsert per chiave normalizzata scrivendo solo le celle cambiate e
+    le righe nuove, e aggiorna in place i categorizzatori già compilati: il costo dipende
+    dal numero di regole nuove, non dalla dimensione del foglio.
+    """
+
+    def __init__(self, archivio, foglio="DB_KEYWORDS", ttl=60):
+        self.archivio = archivio
+        self.foglio = foglio
+        # Senza token di versione si rilegge al massimo ogni `ttl` secondi
+        self.ttl = ttl
+        self._versione = None
+        self._caricato_il = None
+        self._righe = []        # [parola, categoria] nell'ordine del foglio
+        self._posizioni = {}    # chiave -> posizioni delle righe con quella chiave
+        self._categorizzatori = {}
+        self._lock = threading.Lock()
+
+    def _carica(self):
+        try:
+            df = self.archivio.leggi(self.foglio, usecols=[0, 1], ttl=0)
+            if df.empty or "Parola" not in df.columns:
+                df = pd.DataFrame(columns=COLONNE_PAROLE)
+        except Exception:
+            # Foglio mancante o illeggibile: si parte da zero
+            df = pd.DataFrame(columns=COLONNE_PAROLE)
+        self._righe = [[p, c] for p, c in zip(df.iloc[:, 0], df.iloc[:, 1])]
+        self._posizioni = {}
+        for pos, (parola, _) in enumerate(self._righe):
+            self._posizioni.setdefault(chiave_parola(parola), []).append(pos)
+        self._categorizzatori = {}
+        self._caricato_il = time.monotonic()
+
+    def sincronizza(self, versione):
+        """Rilegge il foglio solo se la sua versione è cambiata (es. modifiche fatte a mano)."""
+        with self._lock:
+            if (
+                self._caricato_il is None
+                or (versione is not None and versione != self._versione)
+                or (versione is None and time.monotonic() - self._caricato_il > self.ttl)
+            ):
+                self._carica()
+                self._versione = versione
+
+    def mappa(self):
+        """{chiave: categoria} con la stessa semantica di dict(zip(...)) sul foglio."""
+        with self._lock:
+            return {chiave_parola(p): c for p, c in self._righe}
+
+    def __len__(self):
+        return len(self._posizioni)
+
+    def categorizzatore(self, lista_categorie, mappa_keyword):
+        """Categorizzatore compilato per la lista di categorie, condiviso e tenuto aggiornato."""
+        with self._lock:
+            chiave = tuple(lista_categorie)
+            if chiave not in self._categorizzatori:
+                mappa = {chiave_parola(p): c for p, c in self._righe}
+                self._categorizzatori[chiave] = Categorizzatore(mappa, chiave, mappa_keyword)
+            return self._categorizzatori[chiave]
+
+    def impara(self, regole):
+        """
+        Upsert di (parola, categoria): a parità di chiave vince l'ultima regola. Le parole
+        già presenti aggiornano le proprie celle, le nuove vengono accodate al foglio.
+        Restituisce (nuove, aggiornate).
+        """
+        with self._lock:
+            ultime = {}
+            for parola, categoria in regole:
+                ultime[chiave_parola(parola)] = (parola, categoria)
+
+            celle, nuove = [], []
+            for chiave, (parola, categoria) in ultime.items():
+                posizioni = self._posizioni.get(chiave)
+                if posizioni is None:
+                    nuove.append((chiave, parola, categoria))
+                    continue
+                for pos in posizioni:
+                    if self._righe[pos][1] != categoria:
+                        celle.append((pos, "Categoria", categoria))
+                    if self._righe[pos][0] != parola:
+                        celle.append((pos, "Parola", parola))
+
+            if celle:
+                self.archivio.aggiorna_celle(self.foglio, celle)
+            if nuove:
+                df_nuove = pd.DataFrame([(p, c) for _, p, c in nuove], columns=COLONNE_PAROLE)
+                self.archivio.accoda(self.foglio, df_nuove, pd.DataFrame(self._righe, columns=COLONNE_PAROLE))
+
+            # Stato in memoria e categorizzatori compilati
+            for pos, colonna, valore in celle:
+                self._righe[pos][COLONNE_PAROLE.index(colonna)] = valore
+            for chiave, parola, categoria in nuove:
+                self._posizioni[chiave] = [len(self._righe)]
+                self._righe.append([parola, categoria])
+            aggiornate = {chiave_parola(self._righe[pos][0]) for pos, _, _ in celle}
+            for cat in self._categorizzatori.values():
+                for chiave in aggiornate:
+                    cat.impara(chiave, ultime[chiave][1])
+                for chiave, _, categoria in nuove:
+                    cat.impara(chiave, categoria)
+            return len(nuove), len(aggiornate)
+
+    def segna_versione(self, versione):
+        """Dopo una scrittura fatta da impara(): la nuova versione del foglio è già in memoria."""
+        with self._lock:
+            self._versione = versione
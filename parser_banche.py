@@ -0,0 +1,117 @@
+"""Registro dei parser delle mail bancarie, instradati per mittente."""
+import re
+
+
+class ParserBanca:
+    """
+    Parser di una singola banca. Le regex di uscite ed entrate (con i gruppi nominati
+    'importo' e 'desc') sono compilate in un'unica alternanza ancorata: la prima
+    alternativa che trova un match vince, come nel vecchio ciclo re.search in ordine.
+    """
+
+    def __init__(self, nome, mittenti, parole, uscite, entrate, override=()):
+        self.nome = nome
+        self.mittenti = [m.lower() for m in mittenti]
+        self.parole = [p.lower() for p in parole]
+        self.override = list(override)
+
+        self._tipi = []
+        alternative = []
+        for tipo, lista in (("Uscita", uscite), ("Entrata", entrate)):
+            for rx in lista:
+                i = len(self._tipi)
+                rx = rx.replace("(?P<importo>", f"(?P<r{i}_importo>").replace("(?P<desc>", f"(?P<r{i}_desc>")
+                alternative.append(f".*?(?:{rx})")
+                self._tipi.append(tipo)
+        self._regex = re.compile("^(?:" + "|".join(alternative) + ")", re.IGNORECASE)
+
+    def analizza(self, corpo_clean):
+        """Restituisce {'tipo', 'importo', 'descrizione', 'categoria'} oppure None."""
+        match = self._regex.match(corpo_clean)
+        if not match:
+            return None
+        i = next(i for i in range(len(self._tipi)) if match.group(f"r{i}_importo") is not None)
+        try:
+            importo = float(match.group(f"r{i}_importo").replace('.', '').replace(',', '.'))
+        except ValueError:
+            return None
+
+        risultato = {
+            "tipo": self._tipi[i],
+            "importo": importo,
+            "descrizione": match.group(f"r{i}_desc").strip(),
+            "categoria": None,
+        }
+
+        # Regole specifiche della banca (es. IBAN della rata -> descrizione fissa)
+        corpo_lower = corpo_clean.lower()
+        for regola in self.override:
+            if regola["tipo"] != risultato["tipo"] or regola["contiene"].lower() not in corpo_lower:
+                continue
+            if "descrizione" in regola:
+                risultato["descrizione"] = regola["descrizione"]
+            if "prefisso" in regola:
+                risultato["descrizione"] = regola["prefisso"] + risultato["descrizione"]
+            if "categoria" in regola:
+                risultato["categoria"] = regola["categoria"]
+        return risultato
+
+
+class RegistroParser:
+    """Instrada ogni mail al parser della sua banca con una lookup sul dominio del mittente."""
+
+    def __init__(self, parsers=()):
+        self._per_dominio = {}
+        self._parsers = []
+        for p in parsers:
+            self.registra(p)
+
+    def registra(self, parser):
+        self._parsers.append(parser)
+        for dominio in parser.mittenti:
+            self._per_dominio[dominio] = parser
+
+    def trova(self, mittente, testo=""):
+        """
+        Parser per il mittente (dominio esatto o dominio padre). Per mittenti sconosciuti
+        (es. mail inoltrate) ripiega sulle parole chiave della banca presenti nel testo.
+        """
+        dominio = (mittente or "").rsplit("@", 1)[-1].strip(" >").lower()
+        while dominio:
+            parser = self._per_dominio.get(dominio)
+            if parser is not None:
+                return parser
+            dominio = dominio.partition(".")[2]
+
+        testo = testo.lower()
+        for parser in self._parsers:
+            if any(p in testo for p in parser.parole):
+                return parser
+        return None
+
+
+# ==============================================================================
+# BANCHE REGISTRATE
+# ==============================================================================
+
+PARSER_WIDIBA = ParserBanca(
+    nome="Widiba",
+    mittenti=["widiba.it"],
+    parole=["widiba"],
+    uscite=[
+        r'(?:pagamento|prelievo|addebito|bonifico).*?di\s+(?P<importo>[\d.,]+)\s+euro.*?(?:presso|per|a favore di|su)\s+(?P<desc>.*?)(?:\.|$)',
+        r'ha\s+prelevato\s+(?P<importo>[\d.,]+)\s+euro.*?(?:presso)\s+(?P<desc>.*?)(?:\.|$)',
+    ],
+    entrate=[
+        r'(?:accredito|bonifico).*?di\s+(?P<importo>[\d.,]+)\s+euro.*?(?:per|da|a favore di)\s+(?P<desc>.*?)(?:\.|$)',
+        r'accredito\s+per\s+(?P<desc>.*?)\s+di\s+(?P<importo>[\d.,]+)\s+euro',
+        r'hai\s+ricevuto\s+(?P<importo>[\d.,]+)\s+euro\s+da\s+(?P<desc>.*?)(?:\.|$)',
+    ],
+    override=[
+        # Bonifico verso l'IBAN della rata auto (aggiungere "categoria": "AUTO" per assegnarla in automatico)
+        {"tipo": "Uscita", "contiene": "IT77J0338501601100000720458", "descrizione": "Rata Auto"},
+        {"tipo": "Entrata", "contiene": "paypal", "prefisso": "PayPal - "},
+    ],
+)
+
+REGISTRO_BANCHE = RegistroParser([PARSER_WIDIBA])
@@ -0,0 +1,332 @@
+"""Registro diviso per anno (un foglio per anno + manifesto), caricato solo per gli anni che servono."""
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+
+from analisi import prepara_registro
+from archivio import COLONNE_REGISTRO
+from modifiche import InsiemeModifiche
+from prestazioni import span
+
+FOGLIO_REGISTRO = "DB_TRANSAZIONI"
+FOGLIO_MANIFESTO = "DB_PARTIZIONI"
+COLONNE_MANIFESTO = ["Anno", "Foglio", "Righe"]
+
+# Righe con una data non valida: partizione a parte, inclusa solo nelle viste su tutti gli anni
+ANNO_SENZA_DATA = 0
+
+
+def foglio_anno(anno):
+    """Nome del foglio della partizione di un anno."""
+    if anno == ANNO_SENZA_DATA:
+        return f"{FOGLIO_REGISTRO}_SENZA_DATA"
+    return f"{FOGLIO_REGISTRO}_{int(anno)}"
+
+
+def anno_partizione(date):
+    """Anno di partizione di ogni riga (ANNO_SENZA_DATA se la data non è valida)."""
+    return pd.to_datetime(pd.Series(date), errors="coerce").dt.year.fillna(ANNO_SENZA_DATA).astype(int)
+
+
+def per_foglio(df):
+    """Righe nel formato del foglio: le 7 colonne del registro, Data come YYYY-MM-DD."""
+    df = df.reindex(columns=COLONNE_REGISTRO).copy()
+    df["Data"] = pd.to_datetime(df["Data"], errors="coerce").dt.strftime("%Y-%m-%d")
+    return df
+
+
+def registro_vuoto():
+    return prepara_registro(pd.DataFrame(columns=COLONNE_REGISTRO))
+
+
+def nome_vista(anni, prefisso=FOGLIO_REGISTRO):
+    """Nome dello snapshot di più anni (es. DB_TRANSAZIONI[2024,2025]) per CacheLocale."""
+    return f"{prefisso}[{','.join(str(a) for a in anni)}]"
+
+
+def dividi_modifiche(modifiche, df_completo):
+    """
+    Divide un change-set calcolato sulla vista di più anni in un change-set per partizione.
+    Le occorrenze (Firma, n) sono ricontate dentro la partizione; una riga a cui cambia
+    l'anno della Data viene eliminata dalla sua partizione e inserita in quella nuova.
+    Restituisce {anno: InsiemeModifiche}.
+    """
+    toccate = {k[0] for k in modifiche.eliminate} | {m[0] for m in modifiche.modificate}
+    posizione = {}
+    if toccate:
+        firme = df_completo["Firma"].fillna("").astype(str).str.strip()
+        righe = df_completo[firme.isin(toccate)]
+        firme = firme[righe.index]
+        anni = anno_partizione(righe["Data"]).set_axis(righe.index)
+        occ_tot = firme.groupby(firme).cumcount()
+        occ_part = firme.groupby([firme, anni]).cumcount()
+        # Le righe escluse dal filtro hanno Firme diverse: le occorrenze restano quelle del registro
+        posizione = {
+            (f, int(o)): (int(a), int(op), idx)
+            for idx, f, o, a, op in zip(righe.index, firme, occ_tot, anni, occ_part)
+        }
+
+    parti = {}
+
+    def parte(anno):
+        if anno not in parti:
+            parti[anno] = ([], [], [])
+        return parti[anno]
+
+    for firma, occ in modifiche.eliminate:
+        if (firma, occ) in posizione:
+            anno, occ_p, _ = posizione[(firma, occ)]
+            parte(anno)[2].append((firma, occ_p))
+
+    for firma, occ, valori in modifiche.modificate:
+        if (firma, occ) not in posizione:
+            continue
+        anno, occ_p, idx = posizione[(firma, occ)]
+        nuovo_anno = int(anno_partizione([valori["Data"]]).iloc[0]) if "Data" in valori else anno
+        if nuovo_anno == anno:
+            parte(anno)[1].append((firma, occ_p, valori))
+        else:
+            riga = df_completo.loc[idx].reindex(COLONNE_REGISTRO).to_dict()
+            riga.update(valori)
+            parte(anno)[2].append((firma, occ_p))
+            parte(nuovo_anno)[0].append(pd.DataFrame([riga]))
+
+    if len(modifiche.inserite):
+        inserite = modifiche.inserite
+        for anno, gruppo in inserite.groupby(anno_partizione(inserite["Data"]).set_axis(inserite.index)):
+            parte(int(anno))[0].append(gruppo)
+
+    return {
+        anno: InsiemeModifiche(
+            per_foglio(pd.concat(inserite, ignore_index=True)) if inserite else pd.DataFrame(columns=COLONNE_REGISTRO),
+            modificate,
+            eliminate,
+        )
+        for anno, (inserite, modificate, eliminate) in parti.items()
+    }
+
+
+def partiziona(archivio, foglio=FOGLIO_REGISTRO):
+    """
+    Divide il registro in un foglio per anno e scrive il manifesto. Il foglio originale
+    resta com'è (copia di sicurezza) ma da qui in poi l'app legge e scrive le partizioni.
+    Restituisce il manifesto scritto.
+    """
+    df = archivio.leggi(foglio, usecols=list(range(len(COLONNE_REGISTRO))), ttl=0)
+    voci = []
+    for anno, gruppo in df.groupby(anno_partizione(df["Data"]).set_axis(df.index)):
+        nome = foglio_anno(anno)
+        archivio.crea(nome, gruppo.reset_index(drop=True))
+        voci.append((int(anno), nome, len(gruppo)))
+    manifesto = pd.DataFrame(voci, columns=COLONNE_MANIFESTO)
+    archivio.crea(FOGLIO_MANIFESTO, manifesto)
+    return manifesto
+
+
+class Registro:
+    """
+    Accesso al registro per anni. Con il manifesto (DB_PARTIZIONI) ogni anno è un foglio
+    a sé: le viste chiedono solo gli anni che mostrano e ogni partizione ha la sua copia
+    locale e il suo token di versione; le viste su più anni (es. STORICO) uniscono le
+    partizioni già in cache. Senza manifesto tutto resta sul foglio unico DB_TRANSAZIONI.
+    vista() restituisce (nome, DataFrame): il nome identifica lo snapshot per le strutture
+    derivate di CacheLocale.
+    """
+
+    def __init__(self, archivio, cache_fogli, versioni, intervallo=30):
+        self.archivio = archivio
+        self.cache_fogli = cache_fogli
+        self.versioni = versioni
+        # Senza token (es. DB_PARTIZIONI non esiste) il manifesto si rilegge al massimo ogni `intervallo` secondi
+        self.intervallo = intervallo
+        # (token, {anno: (foglio, righe)}, istante): anche l'assenza del manifesto resta in cache
+        self._manifesto = None
+        self._lock = threading.Lock()
+
+    def manifesto(self):
+        """{anno: (foglio, righe)}; vuoto se il registro non è partizionato."""
+        token = self.versioni.token(FOGLIO_MANIFESTO)
+        with self._lock:
+            if self._manifesto is not None and self._manifesto[0] == token and (
+                token is not None or time.monotonic() - self._manifesto[2] < self.intervallo
+            ):
+                return dict(self._manifesto[1])
+            try:
+                df = self.archivio.leggi(FOGLIO_MANIFESTO, ttl=0)
+            except Exception:
+                df = pd.DataFrame()
+            voci = {}
+            if not df.empty and set(COLONNE_MANIFESTO) <= set(df.columns):
+                df = df.dropna(subset=["Anno", "Foglio"])
+                voci = {
+                    int(a): (str(f), int(r) if pd.notna(r) else 0)
+                    for a, f, r in zip(df["Anno"], df["Foglio"], df["Righe"])
+                }
+            self._manifesto = (token, voci, time.monotonic())
+            return dict(voci)
+
+    def partizionato(self):
+        return bool(self.manifesto())
+
+    def partiziona(self):
+        """Divide il registro (vedi partiziona) e rilegge subito il nuovo manifesto."""
+        manifesto = partiziona(self.archivio)
+        self.versioni.segnala_scrittura(FOGLIO_MANIFESTO)
+        with self._lock:
+            self._manifesto = None
+        return manifesto
+
+    def _scarica(self, foglio):
+        def scarica():
+            df = self.archivio.leggi(foglio, usecols=list(range(len(COLONNE_REGISTRO))), ttl=0)
+            with span("parsing", "prepara registro"):
+                return prepara_registro(df)
+        return scarica
+
+    def _carica(self, foglio):
+        return self.cache_fogli.carica(foglio, self.versioni.token(foglio), self._scarica(foglio))
+
+    def _versione(self, fogli):
+        """Token di uno snapshot composto da più fogli (None se uno non ce l'ha)."""
+        token = [self.versioni.token(f) for f in fogli]
+        return None if None in token else "|".join(str(t) for t in token)
+
+    def anni(self):
+        """Anni del registro, dal più recente (dal manifesto, senza scaricare le partizioni)."""
+        manifesto = self.manifesto()
+        if manifesto:
+            # Le partizioni svuotate restano nel manifesto (il foglio esiste) ma non sono anni del registro
+            return sorted(
+                (a for a, (_, righe) in manifesto.items() if a != ANNO_SENZA_DATA and righe > 0), reverse=True
+            )
+        if self.archivio.aggrega_alla_fonte:
+            _, totali = self.totali()
+            return sorted({int(a) for a in totali["Anno"]}, reverse=True)
+        df = self._carica(FOGLIO_REGISTRO)
+        return sorted({int(a) for a in df["Anno"].dropna()}, reverse=True)
+
+    def _transazioni(self, anni):
+        """Righe degli anni indicati filtrate dal backend (indice su Data), già preparate."""
+        df = prepara_registro(self.archivio.transazioni(date(anni[0], 1, 1), date(anni[-1], 12, 31)))
+        return df[df["Anno"].isin(anni)].reset_index(drop=True)
+
+    def vista(self, anni=None):
+        """(nome, snapshot) con le righe degli anni indicati (None = tutti). Sola lettura."""
+        manifesto = self.manifesto()
+        if not manifesto:
+            if anni is not None and self.archivio.aggrega_alla_fonte:
+                # Backend SQL: si leggono solo le righe degli anni chiesti
+                scelti = sorted({int(a) for a in anni})
+                if not scelti:
+                    return f"{FOGLIO_REGISTRO}[]", registro_vuoto()
+                nome = nome_vista(scelti)
+                return nome, self.cache_fogli.composto(
+                    nome, self.versioni.token(FOGLIO_REGISTRO), lambda: self._transazioni(scelti)
+                )
+            # Registro unico: le viste filtrano per anno sul foglio intero
+            return FOGLIO_REGISTRO, self._carica(FOGLIO_REGISTRO)
+        scelti = sorted(manifesto) if anni is None else sorted({int(a) for a in anni} & set(manifesto))
+        if not scelti:
+            return f"{FOGLIO_REGISTRO}[]", registro_vuoto()
+        fogli = [manifesto[a][0] for a in scelti]
+        if len(fogli) == 1:
+            return fogli[0], self._carica(fogli[0])
+        nome = nome_vista(scelti)
+        return nome, self.cache_fogli.composto(
+            nome, self._versione(fogli), lambda: pd.concat([self._carica(f) for f in fogli], ignore_index=True)
+        )
+
+    def totali(self, anni=None):
+        """
+        (nome, totali per Anno, MeseNum, Categoria, Tipo) calcolati dal backend con un GROUP BY,
+        senza trasferire le transazioni: il cubo mensile si costruisce da qui.
+        None se il backend non aggrega alla fonte (Google Sheets): il cubo parte dalla vista.
+        """
+        if not self.archivio.aggrega_alla_fonte:
+            return None
+        manifesto = self.manifesto()
+        if manifesto:
+            scelti = sorted(manifesto) if anni is None else sorted({int(a) for a in anni} & set(manifesto))
+            fogli = [manifesto[a][0] for a in scelti]
+        else:
+            scelti = None if anni is None else sorted({int(a) for a in anni})
+            fogli = [FOGLIO_REGISTRO]
+        nome = nome_vista(scelti if scelti is not None else ["tutti"], f"{FOGLIO_REGISTRO}#totali")
+
+        def calcola():
+            da, a = (None, None) if not scelti else (date(scelti[0], 1, 1), date(scelti[-1], 12, 31))
+            parti = [self.archivio.totali(da, a, foglio=f) for f in fogli]
+            if not parti:
+                return pd.DataFrame(columns=["Anno", "MeseNum", "Categoria", "Tipo", "Importo"])
+            totali = pd.concat(parti, ignore_index=True)
+            if scelti is not None:
+                totali = totali[totali["Anno"].isin(scelti)].reset_index(drop=True)
+            return totali
+
+        return nome, self.cache_fogli.composto(nome, self._versione(fogli), calcola)
+
+    def _salva_manifesto(self, manifesto):
+        df = pd.DataFrame(
+            [(a, f, r) for a, (f, r) in sorted(manifesto.items())], columns=COLONNE_MANIFESTO
+        )
+        self.archivio.riscrivi(FOGLIO_MANIFESTO, df)
+        self.versioni.segnala_scrittura(FOGLIO_MANIFESTO)
+        with self._lock:
+            self._manifesto = (self.versioni.token(FOGLIO_MANIFESTO), dict(manifesto), time.monotonic())
+
+    def _accoda_foglio(self, foglio, nuove):
+        """Append sul foglio e aggiornamento in place della sua copia in cache (se è bastato l'append)."""
+        # Le righe esistenti si caricano solo se lo schema è cambiato e il foglio va riscritto
+        precedente = self.versioni.token(foglio)
+        solo_append = self.archivio.accoda(foglio, nuove, lambda: per_foglio(self._carica(foglio)))
+        self.versioni.segnala_scrittura(foglio)
+        if solo_append:
+            self.cache_fogli.accoda(
+                foglio, prepara_registro(nuove.reindex(columns=COLONNE_REGISTRO)),
+                self.versioni.token(foglio), precedente,
+            )
+
+    def accoda(self, nuove):
+        """
+        Aggiunge righe nuove (formato del foglio) alle partizioni dei loro anni. Le righe
+        del manifesto si ricontano sul foglio scritto, così restano giuste anche dopo
+        modifiche fatte a mano o da un altro processo.
+        """
+        manifesto = self.manifesto()
+        if not manifesto:
+            self._accoda_foglio(FOGLIO_REGISTRO, nuove)
+            return
+        for anno, gruppo in nuove.groupby(anno_partizione(nuove["Data"]).set_axis(nuove.index)):
+            anno = int(anno)
+            if anno in manifesto:
+                foglio = manifesto[anno][0]
+                self._accoda_foglio(foglio, gruppo)
+            else:
+                foglio = foglio_anno(anno)
+                self.archivio.crea(foglio, per_foglio(gruppo))
+                self.versioni.segnala_scrittura(foglio)
+            manifesto[anno] = (foglio, self.archivio.conta_righe(foglio))
+        self._salva_manifesto(manifesto)
+
+    def applica_modifiche(self, modifiche, df_completo):
+        """
+        Scrive il change-set calcolato su una vista (df_completo) nelle partizioni coinvolte
+        e riconta le loro righe per il manifesto (vedi accoda).
+        """
+        manifesto = self.manifesto()
+        if not manifesto:
+            self.archivio.applica_modifiche(FOGLIO_REGISTRO, modifiche)
+            self.versioni.segnala_scrittura(FOGLIO_REGISTRO)
+            return
+        for anno, parte in dividi_modifiche(modifiche, df_completo).items():
+            if anno in manifesto:
+                foglio = manifesto[anno][0]
+                self.archivio.applica_modifiche(foglio, parte)
+            else:
+                foglio = foglio_anno(anno)
+                self.archivio.crea(foglio, parte.inserite)
+            self.versioni.segnala_scrittura(foglio)
+            manifesto[anno] = (foglio, self.archivio.conta_righe(foglio))
+        self._salva_manifesto(manifesto)
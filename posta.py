@@ -0,0 +1,114 @@
+"""Sincronizzazione IMAP incrementale: scarica solo le mail bancarie successive all'ultimo UID visto."""
+import json
+import os
+
+from imap_tools import AND, OR, U
+
+from prestazioni import span
+
+# File locale con il punto di ripresa di ogni casella (UIDVALIDITY + ultimo UID)
+PERCORSO_STATO_SYNC = os.path.join(".bilancio_cache", "sync_imap.json")
+
+# Numero di mail lette quando non c'è un punto di ripresa valido
+LIMITE_RESYNC = 50
+
+# Regole (campo, valore) valutate dal server con IMAP SEARCH: basta che una sia vera.
+# Campi ammessi: "from", "subject", "body" (ricerca per sottostringa, case-insensitive)
+REGOLE_FILTRO_BANCHE = [
+    ("from", "widiba"),
+    ("subject", "widiba"),
+    ("body", "widiba"),
+]
+_CAMPI_SEARCH = {"from": "from_", "subject": "subject", "body": "body"}
+
+
+class StatoSync:
+    """Punto di ripresa per casella, salvato su un piccolo file JSON."""
+
+    def __init__(self, percorso=PERCORSO_STATO_SYNC):
+        self.percorso = percorso
+        try:
+            with open(percorso, encoding="utf-8") as f:
+                self._dati = json.load(f)
+        except (OSError, ValueError):
+            self._dati = {}
+
+    def leggi(self, chiave):
+        """Restituisce (uidvalidity, ultimo_uid) oppure (None, 0) se mai sincronizzata."""
+        voce = self._dati.get(chiave) or {}
+        return voce.get("uidvalidity"), int(voce.get("ultimo_uid", 0))
+
+    def salva(self, chiave, uidvalidity, ultimo_uid):
+        self._dati[chiave] = {"uidvalidity": uidvalidity, "ultimo_uid": int(ultimo_uid)}
+        cartella = os.path.dirname(self.percorso)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with open(self.percorso, "w", encoding="utf-8") as f:
+            json.dump(self._dati, f, indent=2)
+
+
+def chiave_casella(user, server, cartella="INBOX"):
+    """Chiave univoca della casella nel file di stato."""
+    return f"{user}@{server}/{cartella}"
+
+
+def criteri_search(regole):
+    """Traduce le regole (campo, valore) in un criterio IMAP SEARCH in OR."""
+    condizioni = [AND(**{_CAMPI_SEARCH[campo]: valore}) for campo, valore in regole]
+    if len(condizioni) == 1:
+        return condizioni[0]
+    return OR(*condizioni)
+
+
+def scarica_nuove_mail(mailbox, stato, chiave, cartella="INBOX", completo=False, regole=REGOLE_FILTRO_BANCHE):
+    """
+    Restituisce (messaggi, statistiche, punto) con le sole mail bancarie arrivate dopo
+    l'ultimo UID salvato. Il filtro gira sul server (UID SEARCH) e i corpi dei soli
+    candidati arrivano con un unico UID FETCH.
+    Se UIDVALIDITY è cambiato (o non c'è stato, o completo=True) rilegge le ultime
+    LIMITE_RESYNC mail bancarie. Se non c'è nulla di nuovo costa un solo comando STATUS.
+    Il punto di ripresa non viene salvato qui: punto = (uidvalidity, ultimo_uid) va passato
+    a stato.salva(chiave, *punto) solo dopo aver messo al sicuro le mail (coda o registro),
+    così un errore nell'analisi o nel salvataggio non le fa saltare alla lettura successiva.
+    """
+    with span("imap", "status"):
+        info = mailbox.folder.status(cartella, ["MESSAGES", "UIDNEXT", "UIDVALIDITY"])
+    uidvalidity = info.get("UIDVALIDITY")
+    uidnext = info.get("UIDNEXT")
+    validity_salvata, ultimo_uid = stato.leggi(chiave)
+    resync = completo or validity_salvata != uidvalidity or not ultimo_uid
+    statistiche = {"esaminate": 0, "candidate": 0, "scartate_server": 0}
+
+    if not resync and uidnext is not None and uidnext <= ultimo_uid + 1:
+        messaggi = []
+    else:
+        filtro = criteri_search(regole)
+        if resync:
+            uid_min = 0
+            esaminate = info.get("MESSAGES", 0)
+        else:
+            # "UID n:*" restituisce sempre almeno l'ultimo messaggio: filtriamo gli UID già visti
+            uid_min = ultimo_uid
+            filtro = AND(filtro, uid=U(ultimo_uid + 1, "*"))
+            esaminate = max((uidnext or 0) - 1 - ultimo_uid, 0)
+
+        with span("imap", "search"):
+            candidati = sorted((int(u) for u in mailbox.uids(filtro) if int(u) > uid_min))
+        statistiche["esaminate"] = max(esaminate, len(candidati))
+        statistiche["scartate_server"] = statistiche["esaminate"] - len(candidati)
+        if resync:
+            candidati = candidati[-LIMITE_RESYNC:]
+        statistiche["candidate"] = len(candidati)
+
+        messaggi = []
+        if candidati:
+            with span("imap", "fetch") as misura:
+                messaggi = list(mailbox.fetch(uid_list=[str(u) for u in candidati], mark_seen=False, bulk=True))
+                misura.byte = sum(msg.size for msg in messaggi)
+            messaggi.sort(key=lambda msg: int(msg.uid), reverse=True)
+
+    uid_visti = [int(msg.uid) for msg in messaggi if msg.uid]
+    nuovo_ultimo = max(uid_visti + [ultimo_uid if validity_salvata == uidvalidity else 0])
+    if uidnext:
+        nuovo_ultimo = max(nuovo_ultimo, uidnext - 1)
+    return messaggi, statistiche, (uidvalidity, nuovo_ultimo)
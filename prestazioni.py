@@ -0,0 +1,134 @@
+"""Misure dei tempi per fase (fogli, IMAP, parsing, aggregazioni, grafici) di un singolo rerun."""
+import cProfile
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+import pandas as pd
+
+CARTELLA_PROFILI = os.path.join(".bilancio_cache", "profili")
+
+# Misuratore del rerun in corso: ogni sessione Streamlit gira nel proprio thread
+_attivo = ContextVar("misuratore", default=None)
+
+
+class Misura:
+    """Un intervallo misurato; byte e celle si possono valorizzare dentro il blocco."""
+
+    __slots__ = ("fase", "nome", "livello", "ms", "byte", "celle")
+
+    def __init__(self, fase, nome, livello=0, byte=0, celle=0):
+        self.fase = fase
+        self.nome = nome
+        self.livello = livello
+        self.ms = 0.0
+        self.byte = byte
+        self.celle = celle
+
+
+class Misuratore:
+    """
+    Raccoglie le misure di un rerun. Le misure annidate (es. la lettura del foglio dentro
+    il caricamento del registro) hanno livello > 0 e non si sommano al tempo tracciato.
+    """
+
+    def __init__(self, dettagli=False):
+        self.inizio = time.perf_counter()
+        self.misure = []
+        self._livello = 0
+        # Byte trasferiti solo se qualcuno li guarda (pannello Performance): costano O(celle)
+        self.dettagli = dettagli
+
+    def durata_ms(self):
+        return (time.perf_counter() - self.inizio) * 1000
+
+    def tracciato_ms(self):
+        return sum(m.ms for m in self.misure if m.livello == 0)
+
+    def riepilogo(self):
+        """Una riga per (fase, operazione): chiamate, tempo totale e massimo, byte e celle."""
+        if not self.misure:
+            return pd.DataFrame(columns=["Fase", "Operazione", "Chiamate", "Totale ms", "Max ms", "Byte", "Celle"])
+        df = pd.DataFrame(
+            [(m.fase, m.nome, m.ms, m.byte, m.celle) for m in self.misure],
+            columns=["Fase", "Operazione", "ms", "Byte", "Celle"],
+        )
+        riepilogo = df.groupby(["Fase", "Operazione"], sort=False).agg(
+            Chiamate=("ms", "size"), **{"Totale ms": ("ms", "sum"), "Max ms": ("ms", "max")},
+            Byte=("Byte", "sum"), Celle=("Celle", "sum"),
+        )
+        return riepilogo.reset_index().sort_values("Totale ms", ascending=False, ignore_index=True)
+
+    def per_fase(self):
+        """{fase: ms} delle sole misure di primo livello."""
+        totali = {}
+        for m in self.misure:
+            if m.livello == 0:
+                totali[m.fase] = totali.get(m.fase, 0.0) + m.ms
+        return totali
+
+
+def attiva(misuratore):
+    """Rende `misuratore` quello corrente per il thread del rerun."""
+    _attivo.set(misuratore)
+    return misuratore
+
+
+@contextmanager
+def span(fase, nome, byte=0, celle=0):
+    """
+    Misura il blocco e lo registra nel misuratore del rerun in corso (se c'è).
+    Uso: with span("fogli", "leggi DB_BUDGET") as m: ...; m.celle = df.size
+    """
+    misuratore = _attivo.get()
+    misura = Misura(fase, nome, misuratore._livello if misuratore else 0, byte, celle)
+    if misuratore is not None:
+        misuratore._livello += 1
+    inizio = time.perf_counter()
+    try:
+        yield misura
+    finally:
+        misura.ms = (time.perf_counter() - inizio) * 1000
+        if misuratore is not None:
+            misuratore._livello -= 1
+            misuratore.misure.append(misura)
+
+
+def misura_byte():
+    """True se il rerun in corso registra i byte (misuratore con dettagli attivi)."""
+    misuratore = _attivo.get()
+    return misuratore is not None and misuratore.dettagli
+
+
+def byte_dataframe(df):
+    """Stima dei byte trasferiti per un DataFrame letto o scritto (testo delle celle); 0 senza dettagli."""
+    if not df.size or not misura_byte():
+        return 0
+    return int(sum(df[c].astype(str).str.len().sum() for c in df.columns))
+
+
+def byte_righe(righe):
+    """Byte del testo delle celle in una lista di righe (payload di append/batch_update); 0 senza dettagli."""
+    if not misura_byte():
+        return 0
+    return sum(len(str(v)) for riga in righe for v in riga)
+
+
+def salva_profilo(profilo, cartella=CARTELLA_PROFILI, prefisso="rerun"):
+    """Scrive il profilo cProfile (.prof, apribile con snakeviz) e il riepilogo testuale; restituisce i percorsi."""
+    os.makedirs(cartella, exist_ok=True)
+    base = os.path.join(cartella, f"{prefisso}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    profilo.dump_stats(base + ".prof")
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        pstats.Stats(profilo, stream=f).sort_stats("cumulative").print_stats(60)
+    return base + ".prof", base + ".txt"
+
+
+def nuovo_profilo():
+    """Profilo cProfile già avviato sul thread corrente."""
+    profilo = cProfile.Profile()
+    profilo.enable()
+    return profilo
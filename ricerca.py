@@ -0,0 +1,112 @@
+"""Indice di ricerca sul registro: trigrammi su Descrizione e codici per i filtri dello STORICO."""
+import numpy as np
+import pandas as pd
+
+COLONNE_FILTRO = ["Anno", "MeseNum", "Tipo", "Categoria"]
+
+
+def _trigrammi(testo):
+    return {testo[i:i + 3] for i in range(len(testo) - 2)}
+
+
+class ColonnaCodificata:
+    """
+    Colonna a valori discreti come array di codici interi (uno per riga, -1 = mancante)
+    più l'elenco dei valori distinti. Una selezione di valori diventa una maschera booleana
+    con una sola lookup vettoriale, senza confronti sulle stringhe.
+    """
+
+    def __init__(self):
+        self.valori = []
+        self._codice = {}
+        self.codici = np.empty(0, dtype=np.int32)
+
+    def aggiungi(self, serie):
+        """Accoda le righe nuove; restituisce i codici dei valori mai visti prima."""
+        codici_locali, distinti = pd.factorize(serie)
+        nuovi = []
+        mappa = np.empty(len(distinti), dtype=np.int32)
+        for i, valore in enumerate(distinti):
+            codice = self._codice.get(valore)
+            if codice is None:
+                codice = len(self.valori)
+                self._codice[valore] = codice
+                self.valori.append(valore)
+                nuovi.append(codice)
+            mappa[i] = codice
+        codici = np.where(codici_locali >= 0, mappa[np.maximum(codici_locali, 0)], -1).astype(np.int32)
+        self.codici = np.concatenate([self.codici, codici])
+        return nuovi
+
+    def maschera_codici(self, codici):
+        # Un elemento in più (sempre False) per le righe mancanti: codice -1 = ultimo elemento
+        selezione = np.zeros(len(self.valori) + 1, dtype=bool)
+        selezione[list(codici)] = True
+        return selezione[self.codici]
+
+    def maschera(self, valori):
+        return self.maschera_codici([self._codice[v] for v in valori if v in self._codice])
+
+
+class IndiceRicerca:
+    """
+    Indice del registro per lo STORICO, costruito una volta per versione del foglio e
+    aggiornato in place dopo un append. Le maschere sono allineate per posizione alle
+    righe dello snapshot.
+    - Descrizione: trigrammi -> descrizioni distinte (in minuscolo) che li contengono; una
+      ricerca interseca le liste dei trigrammi della query e verifica solo i candidati.
+    - Anno, MeseNum, Tipo, Categoria: colonne codificate (vedi ColonnaCodificata).
+    """
+
+    def __init__(self, df_registro):
+        self._testi = ColonnaCodificata()
+        self._trigrammi = {}
+        self._colonne = {c: ColonnaCodificata() for c in COLONNE_FILTRO}
+        self.aggiungi(df_registro)
+
+    def __len__(self):
+        return len(self._testi.codici)
+
+    def aggiungi(self, df_nuove):
+        testi = df_nuove["Descrizione"].fillna("").astype(str).str.lower()
+        for codice in self._testi.aggiungi(testi):
+            for trigramma in _trigrammi(self._testi.valori[codice]):
+                self._trigrammi.setdefault(trigramma, set()).add(codice)
+        for nome, colonna in self._colonne.items():
+            colonna.aggiungi(df_nuove[nome])
+
+    def valori(self, colonna):
+        """Valori distinti presenti nella colonna (es. gli anni per il filtro)."""
+        return [v for v in self._colonne[colonna].valori if not pd.isna(v)]
+
+    def cerca(self, testo, prefisso=False):
+        """
+        Maschera delle righe la cui Descrizione contiene `testo` (senza distinzione tra
+        maiuscole e minuscole). Con prefisso=True il testo deve essere l'inizio di una parola.
+        Gli spazi fanno parte della ricerca (es. "bar " non trova "barista"), come nelle
+        keyword: solo un testo fatto di soli spazi non filtra.
+        """
+        query = testo.lower()
+        if not query.strip():
+            return np.ones(len(self), dtype=bool)
+        if len(query) >= 3:
+            liste = sorted((self._trigrammi.get(t, set()) for t in _trigrammi(query)), key=len)
+            candidati = set.intersection(*liste)
+        else:
+            candidati = range(len(self._testi.valori))
+        valori = self._testi.valori
+        if prefisso:
+            trovati = [c for c in candidati if valori[c].startswith(query) or f" {query}" in valori[c]]
+        else:
+            trovati = [c for c in candidati if query in valori[c]]
+        return self._testi.maschera_codici(trovati)
+
+    def filtra(self, anni=None, mesi=None, tipi=None, categorie=None, testo="", prefisso=False):
+        """Maschera combinata dei filtri; un filtro vuoto (None o lista vuota) non filtra."""
+        maschera = np.ones(len(self), dtype=bool)
+        for nome, selezione in (("Anno", anni), ("MeseNum", mesi), ("Tipo", tipi), ("Categoria", categorie)):
+            if selezione:
+                maschera &= self._colonne[nome].maschera(selezione)
+        if testo:
+            maschera &= self.cerca(testo, prefisso)
+        return maschera
@@ -0,0 +1,120 @@
+"""Backend SQLite: stesse letture/scritture degli altri backend, filtri e totali calcolati in SQL."""
+import pandas as pd
+import pytest
+
+from analisi import CuboMensile, prepara_registro
+from archivio import Archivio, ArchivioMemoria, ArchivioSQLite
+from benchmark import foglio_registro, genera_registro
+from cache_locale import CacheLocale, VersioniFogli
+from modifiche import InsiemeModifiche
+from partizioni import Registro
+
+CHIAVI = ["Anno", "MeseNum", "Categoria", "Tipo"]
+
+
+@pytest.fixture
+def registro():
+    return foglio_registro(genera_registro(2_000, anni=(2024, 2025, 2026)))
+
+
+@pytest.fixture
+def sqlite(tmp_path, registro):
+    archivio = ArchivioSQLite(str(tmp_path / "archivio.sqlite"))
+    archivio.riscrivi("DB_TRANSAZIONI", registro)
+    return archivio
+
+
+def test_leggi_con_intestazione_come_prima_riga(sqlite, registro):
+    df = sqlite.leggi("DB_TRANSAZIONI", usecols=[0, 2], header=None)
+    assert list(df.columns) == [0, 1]
+    assert list(df.iloc[0]) == ["Data", "Importo"]
+    assert len(df) == len(registro) + 1
+    assert sqlite.leggi("NON_ESISTE").empty
+
+
+def test_accoda_righe_e_schema_nuovo(sqlite, registro):
+    versione = sqlite.versione("DB_TRANSAZIONI")
+    nuove = registro.head(3).assign(Firma=["N-1", "N-2", "N-3"])
+    assert sqlite.accoda("DB_TRANSAZIONI", nuove, lambda: pytest.fail("righe esistenti lette"))
+    df = sqlite.leggi("DB_TRANSAZIONI")
+    assert len(df) == len(registro) + 3
+    assert list(df["Firma"].tail(3)) == ["N-1", "N-2", "N-3"]
+    assert sqlite.versione("DB_TRANSAZIONI") == versione + 1
+
+    assert not sqlite.accoda("DB_TRANSAZIONI", nuove.assign(Note="x"), lambda: df)
+    df = sqlite.leggi("DB_TRANSAZIONI")
+    assert "Note" in df.columns and len(df) == len(registro) + 6
+
+
+def test_applica_modifiche_con_firme_duplicate(tmp_path):
+    righe = pd.DataFrame({
+        "Data": ["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-04"],
+        "Descrizione": ["CAFFE", "CAFFE", "AFFITTO", "CAFFE"],
+        "Importo": [1.5, 1.5, 700.0, 1.5],
+        "Tipo": ["Uscita"] * 4,
+        "Categoria": ["BAR", "BAR", "CASA", "BAR"],
+        "Mese": ["Jan-25"] * 4,
+        "Firma": ["DUP", "DUP", "A", "DUP"],
+    })
+    modifiche = InsiemeModifiche(
+        pd.DataFrame([["2025-02-01", "NUOVA", 3.0, "Uscita", "BAR", "Feb-25", "N"]], columns=righe.columns),
+        [("DUP", 1, {"Importo": 2.0}), ("DUP", 2, {"Categoria": "CIBO"})],
+        [("DUP", 0)],
+    )
+    sqlite = ArchivioSQLite(str(tmp_path / "archivio.sqlite"))
+    sqlite.riscrivi("DB_TRANSAZIONI", righe)
+    memoria = ArchivioMemoria({"DB_TRANSAZIONI": righe})
+    sqlite.applica_modifiche("DB_TRANSAZIONI", modifiche)
+    memoria.applica_modifiche("DB_TRANSAZIONI", modifiche)
+
+    df = sqlite.leggi("DB_TRANSAZIONI")
+    assert list(df["Data"]) == ["2025-01-02", "2025-01-03", "2025-01-04", "2025-02-01"]
+    assert list(df["Importo"]) == [2.0, 700.0, 1.5, 3.0]
+    assert list(df["Categoria"]) == ["BAR", "CASA", "CIBO", "BAR"]
+    pd.testing.assert_frame_equal(df, memoria.fogli["DB_TRANSAZIONI"], check_dtype=False)
+
+
+def test_totali_come_groupby_pandas(sqlite, registro):
+    attesi = prepara_registro(registro.copy()).groupby(CHIAVI, as_index=False)["Importo"].sum()
+    totali = sqlite.totali()
+    assert list(totali.columns) == CHIAVI + ["Importo"]
+    pd.testing.assert_frame_equal(
+        totali.sort_values(CHIAVI, ignore_index=True), attesi.sort_values(CHIAVI, ignore_index=True),
+        check_dtype=False,
+    )
+    # Con il filtro sulle date come la versione generica
+    pd.testing.assert_frame_equal(
+        sqlite.totali("2025-03-01", "2025-05-31"), Archivio.totali(sqlite, "2025-03-01", "2025-05-31"),
+        check_dtype=False,
+    )
+
+
+def test_transazioni_come_filtro_pandas(sqlite):
+    filtri = dict(da="2025-01-01", a="2025-06-30", categorie=["CIBO", "CASA"], tipi=["Uscita"])
+    pd.testing.assert_frame_equal(sqlite.transazioni(**filtri), Archivio.transazioni(sqlite, **filtri))
+
+
+def test_registro_usa_filtri_e_totali_sql(sqlite, tmp_path, monkeypatch):
+    registro = Registro(sqlite, CacheLocale(str(tmp_path / "cache.sqlite")), VersioniFogli(sqlite.versione))
+    _, tutto = registro.vista()
+    cubo_atteso = CuboMensile(tutto)
+
+    def leggi_tutto(*args, **kwargs):
+        raise AssertionError("foglio letto per intero")
+
+    monkeypatch.setattr(sqlite, "leggi", leggi_tutto)
+    assert registro.anni() == [2026, 2025, 2024]
+    nome, anno = registro.vista([2025])
+    assert nome == "DB_TRANSAZIONI[2025]"
+    pd.testing.assert_frame_equal(anno, tutto[tutto["Anno"] == 2025].reset_index(drop=True))
+
+    _, totali = registro.totali([2025])
+    assert set(totali["Anno"]) == {2025}
+    cubo = CuboMensile(totali)
+    for mesi in ([1], [1, 2, 3], list(range(1, 13))):
+        ordina = ["Categoria", "Tipo"]
+        pd.testing.assert_frame_equal(
+            cubo.periodo(2025, mesi).sort_values(ordina, ignore_index=True),
+            cubo_atteso.periodo(2025, mesi).sort_values(ordina, ignore_index=True),
+            check_dtype=False,
+        )
@@ -0,0 +1,38 @@
+"""Copia locale dei fogli: un append dell'app aggiunge righe alla tabella SQLite senza riscriverla."""
+import pandas as pd
+import pytest
+
+from analisi import prepara_registro
+from benchmark import foglio_registro, genera_registro
+from cache_locale import CacheLocale
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = CacheLocale(str(tmp_path / "fogli.sqlite"))
+    cache.carica("DB_TRANSAZIONI", "v1", lambda: prepara_registro(foglio_registro(genera_registro(1_000))))
+    return cache
+
+
+def nuove(n):
+    return prepara_registro(foglio_registro(genera_registro(n, seed=9)))
+
+
+def test_accoda_aggiunge_solo_le_righe_nuove(cache, monkeypatch):
+    def riscrittura(*args):
+        raise AssertionError("tabella riscritta")
+
+    monkeypatch.setattr(cache, "salva", riscrittura)
+    cache.accoda("DB_TRANSAZIONI", nuove(5), "v2", "v1")
+    assert cache.versione_salvata("DB_TRANSAZIONI") == "v2"
+
+    in_memoria = cache.carica("DB_TRANSAZIONI", "v2", lambda: pytest.fail("riscaricato"))
+    su_disco = cache.leggi("DB_TRANSAZIONI")
+    assert len(in_memoria) == len(su_disco) == 1_005
+    pd.testing.assert_frame_equal(su_disco, in_memoria.reset_index(drop=True), check_dtype=False)
+
+
+def test_accoda_su_copia_in_memoria_vecchia_non_aggiorna(cache):
+    cache.accoda("DB_TRANSAZIONI", nuove(5), "v3", "v2")
+    assert cache.versione_salvata("DB_TRANSAZIONI") == "v1"
+    assert len(cache.carica("DB_TRANSAZIONI", "v1", lambda: pytest.fail("riscaricato"))) == 1_000
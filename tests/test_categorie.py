@@ -0,0 +1,43 @@
+"""Elenchi delle categorie dal foglio del piano annuale (letto con usecols=[0, 2], header=None)."""
+import pandas as pd
+
+from categorie import Categorie, elenco_colonna
+from categorizzatore import CATEGORIA_DEFAULT
+
+
+def foglio_piano(entrate, uscite):
+    """Foglio dell'anno: entrate dalla riga 3 della prima colonna, uscite dalla riga 2 della seconda."""
+    righe = max(3 + len(entrate), 2 + len(uscite))
+    col_entrate = [None, "PIANO", "ENTRATE"] + list(entrate)
+    col_uscite = [None, "USCITE"] + list(uscite)
+    return pd.DataFrame({
+        0: col_entrate + [None] * (righe - len(col_entrate)),
+        2: col_uscite + [None] * (righe - len(col_uscite)),
+    })
+
+
+def test_riga_vuota_in_mezzo_non_tronca_l_elenco():
+    df = foglio_piano(["STIPENDIO", None, " BONUS ", ""], ["CASA", "CIBO", None, "AUTO", float("nan"), "SVAGO"])
+    assert elenco_colonna(df, 0, 3) == ["BONUS", "STIPENDIO"]
+    assert elenco_colonna(df, 1, 2) == ["AUTO", "CASA", "CIBO", "SVAGO"]
+
+
+def test_elenco_finisce_al_marcatore():
+    df = foglio_piano(["STIPENDIO"], ["CASA", None, "CIBO", "Totale uscite", "NOTE"])
+    assert elenco_colonna(df, 1, 2) == ["CASA", "CIBO"]
+
+
+def test_elenco_oltre_venti_righe():
+    uscite = [f"CAT{i:02d}" for i in range(40)]
+    categorie = Categorie.da_foglio(foglio_piano(["STIPENDIO"], uscite))
+    assert categorie.uscite == [CATEGORIA_DEFAULT] + uscite
+    assert categorie.entrate == [CATEGORIA_DEFAULT, "STIPENDIO"]
+
+
+def test_elenco_finisce_alle_righe_vuote_di_separazione():
+    # Sotto le uscite, dopo due righe vuote, un altro blocco (senza TOTALE) nella stessa colonna
+    df = foglio_piano(["STIPENDIO"], ["CASA", None, "CIBO", None, "", "RIEPILOGO", "1200"])
+    assert elenco_colonna(df, 1, 2) == ["CASA", "CIBO"]
+    # Separatore e marcatori configurabili per fogli con un altro formato
+    assert elenco_colonna(df, 1, 2, separatore=0) == ["1200", "CASA", "CIBO", "RIEPILOGO"]
+    assert elenco_colonna(df, 1, 2, marcatori=("CIBO",), separatore=0) == ["CASA"]
@@ -0,0 +1,42 @@
+"""Categorizzatore aggiornato in place con impara(): stesso esito di una ricostruzione da DB_KEYWORDS."""
+import random
+
+import pytest
+
+from categorizzatore import CATEGORIA_DEFAULT, Categorizzatore
+
+CATEGORIE = ["CIBO", "CASA", "BAR", "Carburante", "SVAGO"]
+MAPPA_KEYWORD = {"esselunga": "cibo", "enel": "casa", "bar ": "bar", "eni": "carburante"}
+PAROLE = ["esselunga", "enel", "bar ", "eni", "casa", "cibo", "coop", "netflix", "amazon", "lunga", "cinema"]
+TESTI = [
+    "PAGAMENTO ESSELUNGA MILANO", "BOLLETTA ENEL ENERGIA", "BAR CENTRALE", "BARISTA", "ENI STATION",
+    "COOP LOMBARDIA", "NETFLIX.COM", "AMAZON EU", "CINEMA ODEON", "AFFITTO CASA", "SPESA CIBO", "ALTRO",
+]
+
+
+def esiti(categorizzatore):
+    return [categorizzatore.classifica(t) for t in TESTI]
+
+
+def test_categoria_non_valida_dimentica_la_parola_imparata():
+    cat = Categorizzatore({"netflix": "SVAGO", "esselunga": "CASA"}, CATEGORIE, MAPPA_KEYWORD)
+    assert cat.classifica("NETFLIX.COM") == "SVAGO"
+    assert not cat.impara("netflix", "ABBONAMENTI")
+    assert cat.classifica("NETFLIX.COM") == CATEGORIA_DEFAULT
+    # Una keyword fissa coperta dalla parola imparata torna a valere
+    assert not cat.impara("esselunga", "SPESA")
+    assert cat.classifica("PAGAMENTO ESSELUNGA") == "CIBO"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_impara_come_ricostruzione(seed):
+    rng = random.Random(seed)
+    categorie_regole = CATEGORIE + ["cibo", "ABBONAMENTI", "SPESA"]  # le ultime due non esistono
+    mappa = {p: rng.choice(categorie_regole) for p in rng.sample(PAROLE, 4)}
+    cat = Categorizzatore(mappa, CATEGORIE, MAPPA_KEYWORD)
+    for _ in range(30):
+        parola, categoria = rng.choice(PAROLE), rng.choice(categorie_regole)
+        cat.impara(parola, categoria)
+        # Upsert su DB_KEYWORDS: le parole note restano al loro posto, le nuove vanno in fondo
+        mappa[parola] = categoria
+        assert esiti(cat) == esiti(Categorizzatore(mappa, CATEGORIE, MAPPA_KEYWORD)), (parola, categoria)
@@ -0,0 +1,57 @@
+"""Lettura mail: il punto di ripresa IMAP avanza solo quando le mail sono in coda."""
+import random
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+from benchmark import CasellaMemoria, genera_corpi_mail
+from firme import IndiceFirme
+from ingestione import CodaMail, LavoratoreMail, analizza_mail
+from posta import StatoSync, scarica_nuove_mail
+
+
+@pytest.fixture
+def casella():
+    casella = CasellaMemoria()
+    inizio = datetime.now(timezone.utc) - timedelta(days=2)
+    bancarie = [m for m in genera_corpi_mail(200, random.Random(3)) if "widiba" in m[0]][:20]
+    for i, (mittente, corpo) in enumerate(bancarie):
+        casella.arriva(mittente, corpo, inizio + timedelta(minutes=i))
+    return casella
+
+
+def analizza(messaggi):
+    indice = IndiceFirme(pd.DataFrame(columns=["Firma"]))
+    return analizza_mail(messaggi, lambda descrizione, tipo: "DA VERIFICARE", lambda anno: indice)
+
+
+def test_scarica_nuove_mail_non_salva_il_punto(casella, tmp_path):
+    stato = StatoSync(str(tmp_path / "sync.json"))
+    messaggi, _, punto = scarica_nuove_mail(casella, stato, "test")
+    assert len(messaggi) == 20
+    assert punto[1] == 20
+    assert stato.leggi("test") == (None, 0)
+    assert StatoSync(stato.percorso).leggi("test") == (None, 0)
+
+
+def test_errore_prima_della_coda_non_perde_mail(casella, tmp_path):
+    percorso = str(tmp_path / "sync.json")
+    coda = CodaMail(str(tmp_path / "coda.sqlite"))
+
+    def analisi_rotta(messaggi):
+        raise RuntimeError("parser non disponibile")
+
+    lavoratore = LavoratoreMail(lambda: casella, analisi_rotta, coda, "test", percorso_stato=percorso)
+    with pytest.raises(RuntimeError):
+        lavoratore.ciclo()
+    assert StatoSync(percorso).leggi("test") == (None, 0)
+    assert len(coda) == 0
+
+    # Al ciclo successivo le stesse mail vengono rilette e finiscono in coda
+    lavoratore.analizza = analizza
+    statistiche = lavoratore.ciclo()
+    assert statistiche["candidate"] == 20
+    assert len(coda) == statistiche["in_coda"] > 0
+    assert StatoSync(percorso).leggi("test")[1] == 20
+    assert lavoratore.ciclo()["candidate"] == 0
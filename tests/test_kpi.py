@@ -0,0 +1,119 @@
+"""tabella_kpi contro le formule scalari originali del tab KPI (un anno e un periodo alla volta)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from analisi import GRANULARITA_KPI, mesi_del_periodo, prepara_registro, tabella_kpi
+from benchmark import genera_registro
+
+KPI = ["ROE", "IER", "Growth", "IAT", "IER Periodo", "IER Giornaliero", "IPP", "Burn Rate"]
+
+
+def kpi_scalari(df_cloud, bud_g, target_patrimoniale, anno_k, l_num_k):
+    """Le formule del vecchio tab KPI, copiate così com'erano."""
+    df_kpi_per = df_cloud[(df_cloud["Anno"] == anno_k) & (df_cloud["MeseNum"].isin(l_num_k))]
+    df_kpi_anno = df_cloud[df_cloud["Anno"] == anno_k]
+
+    saldo_ini_anno = 0.0
+    if not bud_g.empty:
+        mask_saldo = (bud_g["Mese"] == "Gen") & (bud_g["Categoria"] == "SALDO INIZIALE")
+        if mask_saldo.any():
+            saldo_ini_anno = bud_g[mask_saldo]["Importo"].sum()
+
+    ent_tot_anno = df_kpi_anno[(df_kpi_anno["Tipo"] == "Entrata") & (df_kpi_anno["Categoria"] != "SALDO INIZIALE")]["Importo"].sum()
+    usc_tot_anno = df_kpi_anno[df_kpi_anno["Tipo"] == "Uscita"]["Importo"].sum()
+    utile_anno = ent_tot_anno - usc_tot_anno
+    saldo_fin_anno = saldo_ini_anno + utile_anno
+    risorse_disp_anno = saldo_ini_anno + ent_tot_anno
+
+    ent_periodo = df_kpi_per[(df_kpi_per["Tipo"] == "Entrata") & (df_kpi_per["Categoria"] != "SALDO INIZIALE")]["Importo"].sum()
+    usc_periodo = df_kpi_per[df_kpi_per["Tipo"] == "Uscita"]["Importo"].sum()
+    utile_periodo = ent_periodo - usc_periodo
+
+    roe = (saldo_fin_anno - saldo_ini_anno) / risorse_disp_anno * 100 if risorse_disp_anno > 0 else 0
+    ier = utile_anno / ent_tot_anno * 100 if ent_tot_anno > 0 else 0
+    growth = (saldo_fin_anno - saldo_ini_anno) / saldo_ini_anno * 100 if saldo_ini_anno > 0 else 0
+    delta_target = target_patrimoniale - saldo_ini_anno
+    iat = (saldo_fin_anno - saldo_ini_anno) / delta_target * 100 if delta_target > 0 else 0
+    ier_periodo = utile_periodo / ent_periodo * 100 if ent_periodo > 0 else 0
+    ier_giornaliero = saldo_fin_anno / risorse_disp_anno * 100 if risorse_disp_anno > 0 else 0
+    term_iat = (saldo_fin_anno - saldo_ini_anno) / delta_target if delta_target > 0 else 0
+    term_eff = saldo_fin_anno / risorse_disp_anno if risorse_disp_anno > 0 else 0
+    ipp = term_iat * term_eff * 100
+    giorni_periodo = 30 * len(l_num_k)
+    burn_rate = usc_periodo / giorni_periodo if giorni_periodo > 0 else 0
+
+    return {
+        "ROE": roe, "IER": ier, "Growth": growth, "IAT": iat, "IER Periodo": ier_periodo,
+        "IER Giornaliero": ier_giornaliero, "IPP": ipp, "Burn Rate": burn_rate,
+    }
+
+
+def budget(saldo_iniziale):
+    return pd.DataFrame({
+        "Mese": ["Gen", "Gen", "Feb"],
+        "Categoria": ["SALDO INIZIALE", "CASA", "SALDO INIZIALE"],
+        "Tipo": ["Entrata", "Uscita", "Entrata"],
+        "Importo": [saldo_iniziale, 500.0, 999.0],
+    })
+
+
+def registro(righe):
+    """righe: (data, tipo, categoria, importo)."""
+    df = pd.DataFrame(righe, columns=["Data", "Tipo", "Categoria", "Importo"])
+    df["Descrizione"] = "x"
+    df["Mese"] = ""
+    df["Firma"] = [f"T-{i}" for i in range(len(df))]
+    return prepara_registro(df)
+
+
+def confronta(df, df_budget, target):
+    tabella = tabella_kpi(df, df_budget, target)
+    anni = sorted(df["Anno"].dropna().astype(int).unique())
+    assert sorted(tabella["Anno"].unique()) == anni
+    for anno in anni:
+        for granularita, passo in GRANULARITA_KPI.items():
+            for periodo in range(1, 12 // passo + 1):
+                riga = tabella[(tabella["Anno"] == anno) & (tabella["Granularita"] == granularita) & (tabella["Periodo"] == periodo)]
+                assert len(riga) == 1
+                atteso = kpi_scalari(df, df_budget, target, anno, mesi_del_periodo(granularita, periodo))
+                for kpi in KPI:
+                    assert riga[kpi].iloc[0] == pytest.approx(atteso[kpi], rel=1e-9, abs=1e-9), (anno, granularita, periodo, kpi)
+
+
+@pytest.mark.parametrize("saldo_iniziale, target", [(10_000.0, 50_000.0), (0.0, 20_000.0), (-3_000.0, 5_000.0), (80_000.0, 50_000.0)])
+def test_registro_sintetico(saldo_iniziale, target):
+    confronta(genera_registro(3_000, anni=(2024, 2025)), budget(saldo_iniziale), target)
+
+
+def test_budget_vuoto():
+    confronta(genera_registro(500, anni=(2025,)), pd.DataFrame(columns=["Mese", "Categoria", "Tipo", "Importo"]), 10_000.0)
+
+
+def test_nessuna_entrata_e_mesi_vuoti():
+    # Solo uscite, tutte a marzo: entrate nulle (IER = 0) e periodi senza movimenti
+    df = registro([("2025-03-05", "Uscita", "CASA", 120.0), ("2025-03-20", "Uscita", "AUTO", 80.0)])
+    confronta(df, budget(1_000.0), 5_000.0)
+    tabella = tabella_kpi(df, budget(1_000.0), 5_000.0)
+    mensile = tabella[tabella["Granularita"] == "Mensile"].set_index("Periodo")
+    assert (tabella["IER"] == 0).all()
+    assert mensile.loc[3, "Burn Rate"] == pytest.approx(200.0 / 30)
+    assert (mensile.drop(index=3)[["Burn Rate", "IER Periodo", "Uscite Periodo"]] == 0).all().all()
+
+
+def test_saldo_iniziale_nel_registro_non_e_entrata():
+    df = registro([
+        ("2025-01-01", "Entrata", "SALDO INIZIALE", 5_000.0),
+        ("2025-01-10", "Entrata", "STIPENDIO", 2_000.0),
+        ("2025-02-10", "Uscita", "CASA", 700.0),
+    ])
+    confronta(df, budget(5_000.0), 20_000.0)
+    assert tabella_kpi(df, budget(5_000.0), 20_000.0)["Entrate Anno"].iloc[0] == 2_000.0
+
+
+def test_risorse_negative():
+    # Saldo iniziale negativo maggiore delle entrate: ROE, IER Giornaliero e IPP restano a 0
+    df = registro([("2025-04-01", "Entrata", "STIPENDIO", 1_000.0), ("2025-04-02", "Uscita", "CASA", 3_000.0)])
+    confronta(df, budget(-5_000.0), 10_000.0)
+    tabella = tabella_kpi(df, budget(-5_000.0), 10_000.0)
+    assert np.allclose(tabella[["ROE", "Growth", "IER Giornaliero", "IPP"]].to_numpy(), 0)
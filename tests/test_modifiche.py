@@ -0,0 +1,46 @@
+"""Bozze dello STORICO: le chiavi (Firma, occorrenza) fissate alla creazione valgono anche dopo una ricarica."""
+import pandas as pd
+
+from archivio import ArchivioMemoria
+from modifiche import calcola_modifiche, chiavi_righe
+
+
+def registro(righe):
+    return pd.DataFrame(righe, columns=["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"])
+
+
+RIGHE = [
+    ["2026-01-05", "AFFITTO", 700.0, "Uscita", "CASA", "Jan-26", "F-A"],
+    ["2026-01-07", "CAFFE", 1.5, "Uscita", "BAR", "Jan-26", "F-DUP"],
+    ["2026-01-07", "CAFFE", 1.5, "Uscita", "BAR", "Jan-26", "F-DUP"],
+    ["2026-01-09", "SPESA", 45.0, "Uscita", "CIBO", "Jan-26", "F-C"],
+]
+# Riga salvata da un'altra sessione tra la modifica e il salvataggio: gli indici scorrono
+NUOVA = ["2026-01-01", "STIPENDIO", 2000.0, "Entrata", "STIPENDIO", "Jan-26", "F-X"]
+
+
+def test_chiavi_contano_le_occorrenze_sul_registro_intero():
+    df = registro(RIGHE)
+    assert chiavi_righe(df.iloc[[2, 3]], df) == {2: ("F-DUP", 1), 3: ("F-C", 0)}
+
+
+def test_bozza_applicata_alle_righe_su_cui_e_stata_creata():
+    snapshot = registro(RIGHE)
+    archivio = ArchivioMemoria({"DB_TRANSAZIONI": snapshot})
+
+    # Bozza: pagina con la seconda occorrenza di F-DUP e con F-C; F-DUP modificata, F-C eliminata
+    pagina = snapshot.iloc[[2, 3]].copy()
+    chiavi = chiavi_righe(pagina, snapshot)
+    modificata = pagina.drop(index=[3])
+    modificata.loc[2, "Importo"] = 2.0
+
+    # Ricarica prima del salvataggio: lo snapshot attuale ha indici diversi
+    archivio.fogli["DB_TRANSAZIONI"] = registro([NUOVA] + RIGHE)
+    modifiche = calcola_modifiche(pagina, modificata, chiavi=chiavi)
+    assert modifiche.modificate == [("F-DUP", 1, {"Importo": 2.0})]
+    assert modifiche.eliminate == [("F-C", 0)]
+
+    archivio.applica_modifiche("DB_TRANSAZIONI", modifiche)
+    dopo = archivio.fogli["DB_TRANSAZIONI"]
+    assert list(dopo["Firma"]) == ["F-X", "F-A", "F-DUP", "F-DUP"]
+    assert list(dopo["Importo"]) == [2000.0, 700.0, 1.5, 2.0]
@@ -0,0 +1,146 @@
+"""Registro per anno: letture dei fogli con e senza manifesto."""
+import pandas as pd
+import pytest
+
+from archivio import ArchivioFogli
+from benchmark import ConnessioneMemoria, foglio_registro, genera_registro
+from cache_locale import CacheLocale, VersioniFogli
+from modifiche import InsiemeModifiche, chiavi_righe
+from partizioni import FOGLIO_MANIFESTO, Registro, dividi_modifiche, foglio_anno
+
+
+class ConnessioneContata(ConnessioneMemoria):
+    """ConnessioneMemoria che registra ogni read (anche quelle fallite)."""
+
+    def __init__(self, fogli):
+        super().__init__(fogli)
+        self.letture = []
+
+    def read(self, worksheet, **opzioni):
+        self.letture.append(worksheet)
+        return super().read(worksheet, **opzioni)
+
+
+@pytest.fixture
+def registro_fogli(tmp_path):
+    conn = ConnessioneContata({"DB_TRANSAZIONI": foglio_registro(genera_registro(500, anni=(2024, 2025)))})
+    archivio = ArchivioFogli(conn)
+    registro = Registro(archivio, CacheLocale(str(tmp_path / "cache.sqlite")), VersioniFogli(archivio.versione))
+    return conn, registro
+
+
+def test_senza_manifesto_il_foglio_mancante_si_legge_una_volta(registro_fogli):
+    conn, registro = registro_fogli
+    for _ in range(5):
+        registro.vista()
+        registro.vista([2025])
+        registro.anni()
+        registro.manifesto()
+    assert conn.letture.count(FOGLIO_MANIFESTO) == 1
+    assert conn.letture.count("DB_TRANSAZIONI") == 1
+
+
+def test_manifesto_assente_riletto_dopo_intervallo(registro_fogli):
+    conn, registro = registro_fogli
+    registro.intervallo = 0
+    registro.manifesto()
+    registro.manifesto()
+    assert conn.letture.count(FOGLIO_MANIFESTO) == 2
+
+
+def test_partiziona_e_vista_di_un_anno(registro_fogli):
+    conn, registro = registro_fogli
+    registro.manifesto()
+    registro.partiziona()
+    assert registro.partizionato()
+    conn.letture.clear()
+    nome, df = registro.vista([2025])
+    assert nome == foglio_anno(2025)
+    assert set(df["Anno"]) == {2025}
+    assert conn.letture == [foglio_anno(2025)]
+    _, tutto = registro.vista()
+    assert len(tutto) == 500
+    assert pd.Series(tutto["Anno"]).isin([2024, 2025]).all()
+
+
+def righe_nuove(**colonne):
+    return foglio_registro(genera_registro(3, seed=5, anni=(2025,))).assign(**colonne)
+
+
+def test_accoda_non_legge_il_foglio_se_lo_schema_non_cambia(registro_fogli):
+    conn, registro = registro_fogli
+    registro.manifesto()
+    conn.letture.clear()
+    registro.accoda(righe_nuove())
+    assert "DB_TRANSAZIONI" not in conn.letture
+    assert len(conn.fogli["DB_TRANSAZIONI"]) == 503
+
+
+def test_accoda_con_colonna_nuova_riscrive_il_foglio(registro_fogli):
+    conn, registro = registro_fogli
+    registro.manifesto()
+    conn.letture.clear()
+    registro.accoda(righe_nuove(Note="x"))
+    assert conn.letture == ["DB_TRANSAZIONI"]
+    assert len(conn.fogli["DB_TRANSAZIONI"]) == 503
+    assert "Note" in conn.fogli["DB_TRANSAZIONI"].columns
+
+
+def test_dividi_modifiche_per_anno():
+    df = pd.DataFrame({
+        "Data": ["2024-01-05", "2025-02-01", "2025-03-01", "2024-06-01"],
+        "Descrizione": ["A", "B", "A bis", "C"],
+        "Importo": [1.0, 2.0, 3.0, 4.0],
+        "Tipo": ["Uscita"] * 4,
+        "Categoria": ["CIBO"] * 4,
+        "Mese": ["Jan-24", "Feb-25", "Mar-25", "Jun-24"],
+        "Firma": ["A", "B", "A", "C"],
+    })
+    nuova = df.iloc[[0]].assign(Descrizione="NUOVA", Firma="N")
+    modifiche = InsiemeModifiche(
+        nuova,
+        [("A", 1, {"Importo": 5.0}), ("C", 0, {"Data": "2025-07-01"})],
+        [("B", 0)],
+    )
+    parti = dividi_modifiche(modifiche, df)
+
+    assert set(parti) == {2024, 2025}
+    # La seconda A è la prima (e unica) A della partizione 2025
+    assert parti[2025].modificate == [("A", 0, {"Importo": 5.0})]
+    assert parti[2025].eliminate == [("B", 0)]
+    # C cambia anno: esce dal 2024 ed entra nel 2025 con le altre colonne invariate
+    assert parti[2024].eliminate == [("C", 0)]
+    spostata = parti[2025].inserite
+    assert list(spostata["Firma"]) == ["C"] and list(spostata["Data"]) == ["2025-07-01"]
+    assert spostata["Importo"].iloc[0] == 4.0
+    assert list(parti[2024].inserite["Firma"]) == ["N"]
+    assert parti[2024].modificate == []
+
+
+def test_manifesto_riconta_le_righe_e_salta_gli_anni_vuoti(registro_fogli):
+    conn, registro = registro_fogli
+    registro.manifesto()
+    registro.partiziona()
+    _, vista = registro.vista()
+    chiavi = chiavi_righe(vista)
+    anni = vista["Anno"]
+    spostata = vista.index[anni == 2025][0]
+    # Una riga cambiata a mano sul foglio 2025 (fuori dall'app): il conteggio si riallinea comunque
+    foglio_2025 = conn.fogli[foglio_anno(2025)]
+    conn._scrivi(foglio_anno(2025), foglio_2025.iloc[:-1], 0)
+
+    registro.applica_modifiche(
+        InsiemeModifiche(
+            pd.DataFrame(columns=vista.columns),
+            [(*chiavi[spostata], {"Data": "2023-05-01"})],
+            [chiavi[i] for i in vista.index[anni == 2024]],
+        ),
+        vista,
+    )
+
+    manifesto = registro.manifesto()
+    for anno, (foglio, righe) in manifesto.items():
+        assert righe == len(conn.fogli[foglio]), anno
+    assert manifesto[2024][1] == 0
+    assert manifesto[2023][1] == 1
+    assert registro.anni() == [2025, 2023]
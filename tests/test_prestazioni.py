@@ -0,0 +1,53 @@
+"""Misure del rerun: i byte si calcolano solo con il pannello Performance attivo."""
+import contextvars
+
+import plotly.graph_objects as go
+
+from archivio import ArchivioFogli
+from benchmark import ConnessioneMemoria, foglio_registro, genera_registro
+from cache_grafici import CacheFigure
+from prestazioni import Misuratore, attiva, byte_dataframe
+
+
+def in_rerun(dettagli, funzione):
+    """Esegue funzione con un misuratore attivo in un contesto isolato (come un rerun)."""
+    def esegui():
+        misuratore = attiva(Misuratore(dettagli=dettagli))
+        funzione()
+        return misuratore
+    return contextvars.copy_context().run(esegui)
+
+
+def test_byte_letture_solo_con_dettagli():
+    archivio = ArchivioFogli(ConnessioneMemoria({"DB_TRANSAZIONI": foglio_registro(genera_registro(200))}))
+    senza = in_rerun(False, lambda: archivio.leggi("DB_TRANSAZIONI"))
+    con = in_rerun(True, lambda: archivio.leggi("DB_TRANSAZIONI"))
+    assert [m.byte for m in senza.misure] == [0]
+    assert [m.celle for m in senza.misure] == [m.celle for m in con.misure]
+    assert con.misure[0].byte > 0
+    # Fuori da un rerun (es. thread delle mail) non c'è misuratore
+    assert byte_dataframe(archivio.leggi("DB_TRANSAZIONI")) == 0
+
+
+class FiguraContata(go.Figure):
+    serializzazioni = 0
+
+    def to_json(self, *args, **kwargs):
+        FiguraContata.serializzazioni += 1
+        return super().to_json(*args, **kwargs)
+
+
+def grafico(n):
+    return FiguraContata([go.Bar(x=list(range(n)), y=list(range(n)))])
+
+
+def test_cache_grafici_non_serializza_senza_dettagli():
+    cache = CacheFigure()
+    FiguraContata.serializzazioni = 0
+    in_rerun(False, lambda: [cache.figura(grafico, n) for n in (10, 1000)])
+    assert FiguraContata.serializzazioni == 0
+    assert cache.statistiche()["memoria_kb"] > 0
+
+    misuratore = in_rerun(True, lambda: cache.figura(grafico, 50))
+    assert FiguraContata.serializzazioni == 1
+    assert misuratore.misure[0].byte == len(grafico(50).to_json(validate=False))
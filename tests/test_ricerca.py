@@ -0,0 +1,33 @@
+"""Ricerca sulla Descrizione dell'indice dello STORICO, confrontata con str.contains."""
+import pandas as pd
+import pytest
+
+from ricerca import IndiceRicerca
+
+DESCRIZIONI = ["BAR CENTRALE", "BARISTA MARIO", "PAGAMENTO BAR ", "AMAZON EU", "LIDL 123", None]
+
+
+@pytest.fixture
+def registro():
+    return pd.DataFrame({
+        "Descrizione": DESCRIZIONI,
+        "Anno": [2025] * 6,
+        "MeseNum": [1] * 6,
+        "Tipo": ["Uscita"] * 6,
+        "Categoria": ["BAR"] * 6,
+    })
+
+
+@pytest.mark.parametrize("query", ["bar ", "bar", " bar", "lidl 12", "AMA", "zz", "a"])
+def test_cerca_come_str_contains(registro, query):
+    atteso = registro["Descrizione"].fillna("").str.lower().str.contains(query.lower(), regex=False)
+    assert list(IndiceRicerca(registro).cerca(query)) == list(atteso)
+
+
+def test_spazi_finali_contano(registro):
+    trovate = registro["Descrizione"][IndiceRicerca(registro).cerca("bar ")]
+    assert list(trovate) == ["BAR CENTRALE", "PAGAMENTO BAR "]
+
+
+def test_solo_spazi_non_filtra(registro):
+    assert IndiceRicerca(registro).cerca("  ").all()
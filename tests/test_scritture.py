@@ -0,0 +1,111 @@
+"""Celle scritte dai salvataggi di IMPORTA su backend finti: append del registro e upsert delle parole."""
+import pandas as pd
+import pytest
+
+from archivio import ArchivioFogli, ArchivioMemoria
+from benchmark import ConnessioneMemoria, foglio_registro, genera_registro
+from modifiche import InsiemeModifiche
+from parole_chiave import ArchivioParole
+
+COLONNE = ["Data", "Descrizione", "Importo", "Tipo", "Categoria", "Mese", "Firma"]
+
+
+def righe_nuove(n):
+    return pd.DataFrame({
+        "Data": ["2026-03-01"] * n,
+        "Descrizione": [f"NUOVA {i}" for i in range(n)],
+        "Importo": [10.0] * n,
+        "Tipo": ["Uscita"] * n,
+        "Categoria": ["VARIE"] * n,
+        "Mese": ["Mar-26"] * n,
+        "Firma": [f"N-{i}" for i in range(n)],
+    })
+
+
+def parole(n):
+    return pd.DataFrame({"Parola": [f"parola{i}" for i in range(n)], "Categoria": ["VARIE"] * n})
+
+
+@pytest.mark.parametrize("storico", [100, 10_000])
+def test_accoda_registro_scrive_solo_le_righe_nuove(storico):
+    registro = foglio_registro(genera_registro(storico))
+    conn = ConnessioneMemoria({"DB_TRANSAZIONI": registro})
+    archivio = ArchivioFogli(conn)
+
+    assert archivio.accoda("DB_TRANSAZIONI", righe_nuove(3), registro)
+    assert conn.celle_scritte == 3 * len(COLONNE)
+    assert len(conn.fogli["DB_TRANSAZIONI"]) == storico + 3
+    assert list(conn.fogli["DB_TRANSAZIONI"]["Firma"].tail(3)) == ["N-0", "N-1", "N-2"]
+
+
+def test_accoda_registro_riscrive_se_cambia_lo_schema():
+    registro = foglio_registro(genera_registro(100))
+    conn = ConnessioneMemoria({"DB_TRANSAZIONI": registro})
+    nuove = righe_nuove(2).assign(Note="x")
+
+    assert not ArchivioFogli(conn).accoda("DB_TRANSAZIONI", nuove, registro)
+    assert len(conn.fogli["DB_TRANSAZIONI"]) == 102
+    assert "Note" in conn.fogli["DB_TRANSAZIONI"].columns
+
+
+@pytest.mark.parametrize("n_parole", [100, 20_000])
+@pytest.mark.parametrize("backend", ["memoria", "fogli"])
+def test_impara_scrive_celle_proporzionali_alle_regole(n_parole, backend):
+    if backend == "memoria":
+        archivio = contatore = ArchivioMemoria({"DB_KEYWORDS": parole(n_parole)})
+    else:
+        contatore = ConnessioneMemoria({"DB_KEYWORDS": parole(n_parole)})
+        archivio = ArchivioFogli(contatore)
+    archivio_parole = ArchivioParole(archivio)
+    archivio_parole.sincronizza(archivio.versione("DB_KEYWORDS"))
+    contatore.celle_scritte = 0
+
+    # 5 parole nuove + 5 esistenti con categoria cambiata (una scritta in maiuscolo)
+    regole = [(f"nuova{i}", "CASA") for i in range(5)] + [(f"parola{i}", "AUTO") for i in range(4)] + [("PAROLA4", "AUTO")]
+    assert archivio_parole.impara(regole) == (5, 5)
+
+    # 5 righe nuove (2 celle) + 4 categorie + parola e categoria di PAROLA4, qualunque sia il foglio
+    assert contatore.celle_scritte == 5 * 2 + 4 + 2
+    foglio = contatore.fogli["DB_KEYWORDS"]
+    assert len(foglio) == n_parole + 5
+    assert list(foglio["Categoria"].iloc[:5]) == ["AUTO"] * 5
+    assert foglio["Parola"].iloc[4] == "PAROLA4"
+    assert archivio_parole.mappa()["parola0"] == "AUTO"
+
+
+def test_impara_regola_invariata_non_scrive():
+    archivio = ArchivioMemoria({"DB_KEYWORDS": parole(50)})
+    archivio_parole = ArchivioParole(archivio)
+    archivio_parole.sincronizza(archivio.versione("DB_KEYWORDS"))
+    archivio.celle_scritte = 0
+
+    assert archivio_parole.impara([("parola1", "VARIE")]) == (0, 0)
+    assert archivio.celle_scritte == 0
+
+
+class ConnessioneSenzaClient(ConnessioneMemoria):
+    """Connessione senza l'API privata del client gspread (account pubblico o libreria diversa)."""
+
+    def _select_worksheet(self, worksheet):
+        raise AttributeError("_select_worksheet")
+
+
+def test_senza_worksheet_gspread_riscrive_il_foglio_intero():
+    registro = foglio_registro(genera_registro(200))
+    conn = ConnessioneSenzaClient({"DB_TRANSAZIONI": registro})
+    archivio, memoria = ArchivioFogli(conn), ArchivioMemoria({"DB_TRANSAZIONI": registro})
+    firme = list(registro["Firma"])
+    modifiche = InsiemeModifiche(righe_nuove(2), [(firme[3], 0, {"Categoria": "CASA"})], [(firme[5], 0)])
+
+    assert archivio.versione("DB_TRANSAZIONI") is None
+    assert archivio.intestazione("DB_TRANSAZIONI") == COLONNE
+    # Senza worksheet anche l'append diventa una riscrittura (accoda restituisce False)
+    assert not archivio.accoda("DB_TRANSAZIONI", righe_nuove(1), lambda: archivio.leggi("DB_TRANSAZIONI"))
+    assert memoria.accoda("DB_TRANSAZIONI", righe_nuove(1), registro)
+    for backend in (archivio, memoria):
+        backend.aggiorna_celle("DB_TRANSAZIONI", [(0, "Importo", 99.0)])
+        backend.applica_modifiche("DB_TRANSAZIONI", modifiche)
+
+    atteso = memoria.fogli["DB_TRANSAZIONI"]
+    pd.testing.assert_frame_equal(conn.fogli["DB_TRANSAZIONI"].astype(str), atteso.astype(str))
+    assert len(atteso) == 200 + 1 + 2 - 1
@@ -0,0 +1,75 @@
+"""Token di versione per foglio su Google Sheets: una scrittura invalida solo il foglio scritto."""
+import pandas as pd
+
+from archivio import ArchivioFogli
+from benchmark import ConnessioneMemoria, foglio_registro, genera_registro
+from cache_locale import CacheLocale, VersioniFogli
+from partizioni import Registro
+
+
+def connessione():
+    return ConnessioneMemoria({
+        "DB_TRANSAZIONI": foglio_registro(genera_registro(300)),
+        "DB_KEYWORDS": pd.DataFrame({"Parola": ["esselunga", "enel"], "Categoria": ["CIBO", "CASA"]}),
+        "DB_BUDGET": pd.DataFrame({"Categoria": ["CIBO", "CASA"], "Gen": [300, 500]}),
+    })
+
+
+def test_scrittura_di_un_foglio_non_cambia_gli_altri():
+    conn = connessione()
+    archivio = ArchivioFogli(conn)
+    prima = {f: archivio.versione(f) for f in conn.fogli}
+
+    archivio.aggiorna_celle("DB_KEYWORDS", [(0, "Categoria", "SPESA")])
+    dopo = {f: archivio.versione(f) for f in conn.fogli}
+    assert dopo["DB_KEYWORDS"] != prima["DB_KEYWORDS"]
+    assert dopo["DB_TRANSAZIONI"] == prima["DB_TRANSAZIONI"]
+    assert dopo["DB_BUDGET"] == prima["DB_BUDGET"]
+
+    # Una cella cambiata a mano nel budget (foglio senza Firma) cambia la sua versione
+    archivio.aggiorna_celle("DB_BUDGET", [(1, "Gen", 550)])
+    assert archivio.versione("DB_BUDGET") != prima["DB_BUDGET"]
+    assert archivio.versione("DB_TRANSAZIONI") == prima["DB_TRANSAZIONI"]
+
+
+def test_modifica_a_mano_di_una_cella_del_registro_cambia_la_versione():
+    conn = connessione()
+    archivio = ArchivioFogli(conn)
+    prima = archivio.versione("DB_TRANSAZIONI")
+
+    # Modifica fatta su Sheets (non dall'app): cambia solo l'Importo, Firma e righe restano uguali
+    for colonna, valore in [("Importo", 12345.67), ("Categoria", "ALTRO"), ("Data", "2020-01-01")]:
+        df = conn.fogli["DB_TRANSAZIONI"].copy()
+        df.loc[10, colonna] = valore
+        conn._scrivi("DB_TRANSAZIONI", df, 1)
+        dopo = archivio.versione("DB_TRANSAZIONI")
+        assert dopo != prima
+        prima = dopo
+
+
+def test_versione_riusata_finche_il_file_non_cambia():
+    conn = connessione()
+    archivio = ArchivioFogli(conn)
+    archivio.versione("DB_TRANSAZIONI")
+    chiamate = conn.chiamate
+    archivio.versione("DB_TRANSAZIONI")
+    # Solo la data di modifica del file, senza rileggere le celle
+    assert conn.chiamate == chiamate + 1
+
+
+def test_parole_salvate_dopo_accoda_non_ricaricano_il_registro(tmp_path):
+    conn = connessione()
+    archivio = ArchivioFogli(conn)
+    versioni = VersioniFogli(archivio.versione, intervallo=0)
+    registro = Registro(archivio, CacheLocale(str(tmp_path / "cache.sqlite")), versioni)
+    registro.vista()
+
+    nuove = genera_registro(3, seed=7).drop(columns=["Anno", "MeseNum"], errors="ignore")
+    registro.accoda(nuove)
+    archivio.aggiorna_celle("DB_KEYWORDS", [(1, "Categoria", "BOLLETTE")])
+    versioni.segnala_scrittura("DB_KEYWORDS")
+
+    celle_lette = conn.celle_lette
+    _, df = registro.vista()
+    assert len(df) == 303
+    assert conn.celle_lette == celle_lette